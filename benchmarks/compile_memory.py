@@ -0,0 +1,154 @@
+"""
+Measures the time and peak memory used to compile a large synthetic engine,
+and the memory used by the traced cfgs of all of its callbacks.
+
+Usage: python -m benchmarks.compile_memory [--scripts N] [--blocks N] [-O LEVEL]
+"""
+import argparse
+import gc
+import importlib
+import sys
+import tempfile
+import textwrap
+import time
+import tracemalloc
+from pathlib import Path
+
+from sonolus.backend.cfg import CFG
+from sonolus.engine.engine import trace_callback
+
+_HEADER = """
+from sonolus.core import *
+from sonolus.engine.engine import Engine
+from sonolus.engine.ui import (
+    UIConfig,
+    UIConfigVisibility,
+    UIConfigAnimation,
+    UIConfigAnimationTween,
+)
+from sonolus.scripting import Range
+from sonolus.scripting.internal.buckets import BucketConfig
+from sonolus.scripting.internal.options import OptionConfig, slider_option
+
+
+class Options(OptionConfig):
+    speed = slider_option(
+        name="speed", default=1, min=0.5, max=2, step=0.1, display="number"
+    )
+
+
+class Buckets(BucketConfig):
+    pass
+
+
+class Memory(Struct):
+    a: Num
+    b: Num
+    values: Array[Num, 16]
+"""
+
+_SCRIPT = """
+class Script{index}(Script):
+    memory: Memory
+    shared_memory: Memory
+
+    @callback_function
+    def update_parallel(self):
+        x = +Num(0)
+        y = +Num({index})
+{blocks}
+        self.memory.a @= x
+        self.memory.b @= y
+"""
+
+_BLOCK = """
+if self.memory.values[{i} % 16] > {i}:
+    x @= x + self.memory.values[{i} % 16] * Options.speed
+else:
+    y @= y - x * {i}
+for j in Range(4):
+    self.memory.values[j] @= self.memory.values[j] + x * y + {i}
+"""
+
+_FOOTER = """
+_tween = UIConfigAnimationTween(start=0, end=1, duration=0.1, ease="linear")
+_visibility = UIConfigVisibility(scale=1, alpha=1)
+_animation = UIConfigAnimation(scale=_tween, alpha=_tween)
+
+engine = Engine(
+    [{scripts}],
+    Buckets,
+    Options,
+    UIConfig(
+        primary_metric="arcade",
+        secondary_metric="life",
+        menu_visibility=_visibility,
+        judgment_visibility=_visibility,
+        combo_visibility=_visibility,
+        primary_metric_visibility=_visibility,
+        secondary_metric_visibility=_visibility,
+        judgment_animation=_animation,
+        combo_animation=_animation,
+        judgment_error_style="none",
+        judgment_error_placement="both",
+        judgment_error_min=0,
+    ),
+)
+"""
+
+
+def generate_engine_source(scripts: int, blocks: int) -> str:
+    parts = [_HEADER]
+    for index in range(scripts):
+        body = "".join(_BLOCK.format(i=i) for i in range(blocks))
+        parts.append(_SCRIPT.format(index=index, blocks=textwrap.indent(body, " " * 8)))
+    parts.append(
+        _FOOTER.format(scripts=", ".join(f"Script{i}" for i in range(scripts)))
+    )
+    return "".join(parts)
+
+
+def trace_callbacks(engine) -> list[CFG]:
+    script_ids = {script: i for i, script in enumerate(engine.scripts)}
+    return [
+        trace_callback(script, callback_type, script_ids)[0]
+        for script in engine.scripts
+        for callback_type in script._metadata_.callbacks
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scripts", type=int, default=20)
+    parser.add_argument("--blocks", type=int, default=4)
+    parser.add_argument("-O", dest="level", type=int, default=1, choices=range(4))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        module_path = Path(directory) / "synthetic_engine.py"
+        module_path.write_text(generate_engine_source(args.scripts, args.blocks))
+        sys.path.insert(0, directory)
+        engine = importlib.import_module("synthetic_engine").engine
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        compiled = engine.compile(args.level)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+
+        gc.collect()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        cfgs = trace_callbacks(engine)
+        gc.collect()
+        cfg_memory = tracemalloc.get_traced_memory()[0] - start_memory
+        tracemalloc.stop()
+
+    print(f"scripts: {args.scripts}, blocks per callback: {args.blocks}")
+    print(f"engine nodes: {len(compiled.nodes)}")
+    print(f"compile time: {elapsed:.2f}s (with tracemalloc)")
+    print(f"peak traced memory: {peak / 1024 / 1024:.1f} MiB")
+    print(f"memory held by {len(cfgs)} traced cfgs: {cfg_memory / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Engines shared by the tests and the benchmarks, covering the control flow shapes
+the optimization passes and finalize_cfg handle.
+"""
+from sonolus.core import *
+from sonolus.engine.engine import Engine
+from sonolus.engine.ui import (
+    UIConfig,
+    UIConfigVisibility,
+    UIConfigAnimation,
+    UIConfigAnimationTween,
+)
+from sonolus.scripting import Range, draw, Quad
+from sonolus.scripting.internal.buckets import BucketConfig, judgement_bucket
+from sonolus.scripting.internal.options import (
+    OptionConfig,
+    slider_option,
+    toggle_option,
+)
+
+
+class Options(OptionConfig):
+    speed = slider_option(
+        name="speed", default=1, min=0.5, max=2, step=0.1, display="number"
+    )
+    mirror = toggle_option(name="mirror", default=False)
+
+
+class Buckets(BucketConfig):
+    note = judgement_bucket([])
+
+
+class NoteMemory(Struct):
+    a: Num
+    b: Num
+    c: Num
+    values: Array[Num, 4]
+
+
+class NoteData(Struct):
+    time: Num
+    lane: Num
+
+
+class Note(Script):
+    memory: NoteMemory
+    shared_memory: NoteMemory
+    data: NoteData
+
+    @callback_function
+    def initialize(self):
+        self.memory.a @= self.data.time * Options.speed
+        if Options.mirror:
+            self.memory.b @= -self.data.lane
+        else:
+            self.memory.b @= self.data.lane
+        for i in Range(4):
+            self.memory.values[i] @= i * self.memory.a
+
+    @callback_function
+    def update_parallel(self):
+        t = self.memory.a
+        x = t * 2 + 1
+        if x > 3:
+            self.memory.c @= x + t
+        else:
+            self.memory.c @= x - t
+        total = +Num(0)
+        i = +Num(0)
+        while i < 10:
+            total += i * Options.speed
+            i += 1
+        self.memory.c @= total + self.memory.c
+        draw(1, Quad.rectangle(self.memory.b, self.memory.b + 1, t, t + 1), 1, 1)
+
+    @callback_function
+    def should_spawn(self):
+        return self.memory.a > 0
+
+
+class Follower(Script):
+    memory: NoteMemory
+    shared_memory: NoteMemory
+    data: NoteData
+
+    @callback_function
+    def update_sequential(self):
+        note = Note.at(self.memory.a)
+        self.memory.b @= note.shared_memory.a + note.shared_memory.b
+        k = +Num(0)
+        while k < self.memory.c:
+            if k % 2 == 0:
+                self.memory.a += k
+            else:
+                self.memory.a -= k
+            k += 1
+
+
+_tween = UIConfigAnimationTween(start=0, end=1, duration=0.1, ease="linear")
+_visibility = UIConfigVisibility(scale=1, alpha=1)
+_animation = UIConfigAnimation(scale=_tween, alpha=_tween)
+
+engine = Engine(
+    [Note, Follower],
+    Buckets,
+    Options,
+    UIConfig(
+        primary_metric="arcade",
+        secondary_metric="life",
+        menu_visibility=_visibility,
+        judgment_visibility=_visibility,
+        combo_visibility=_visibility,
+        primary_metric_visibility=_visibility,
+        secondary_metric_visibility=_visibility,
+        judgment_animation=_animation,
+        combo_animation=_animation,
+        judgment_error_style="none",
+        judgment_error_placement="both",
+        judgment_error_min=0,
+    ),
+)
+
+
+class Dispatcher(Script):
+    memory: NoteMemory
+    shared_memory: NoteMemory
+    data: NoteData
+
+    @callback_function
+    def update_parallel(self):
+        # Dense comparisons of the same value, merged into a switch from O2.
+        if self.data.lane == 0:
+            self.memory.a @= 10
+        elif self.data.lane == 1:
+            self.memory.a @= self.memory.b + 20
+        elif self.data.lane == 2:
+            self.memory.a @= 30
+        elif self.data.lane == 3:
+            self.memory.a @= self.memory.c * 40
+        else:
+            self.memory.a @= 50
+
+    @callback_function
+    def update_sequential(self):
+        # A loop with several exits can't be emitted as a While.
+        i = +Num(0)
+        while i < self.memory.c:
+            if self.memory.values[i % 4] == self.data.lane:
+                break
+            self.memory.b += i
+            i += 1
+        self.memory.a @= i
+
+
+# Covers the control flow shapes the main engine lacks.
+control_flow_engine = Engine([Dispatcher], Buckets, Options, engine.ui)
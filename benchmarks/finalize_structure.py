@@ -0,0 +1,102 @@
+"""
+Compares finalize_cfg with lowering each callback to a single JumpLoop, by engine
+node count and by the number of nodes evaluated.
+
+Engine nodes are counted both for each callback on its own, which is what
+finalize_cfg minimizes by falling back to the JumpLoop where it is smaller, and
+for the whole engine, where equal nodes of different callbacks are shared.
+
+Usage: python -m benchmarks.finalize_structure [--runs N] [-O LEVEL]
+"""
+import argparse
+import importlib
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.compile_memory import generate_engine_source
+from benchmarks.engines import control_flow_engine, engine as test_engine
+from sonolus.backend.engine_node import FunctionNode, finalize_cfg, get_engine_nodes
+from sonolus.backend.interpreter import SimpleNodeInterpreter
+from sonolus.backend.ir import MemoryBlock
+from sonolus.backend.optimization.optimization_pass import run_optimization_passes
+from sonolus.backend.optimization.optmization_presets import get_optimization_preset
+from sonolus.engine.engine import trace_callback
+
+
+def lower_callbacks(engine, level: int) -> tuple[list, list]:
+    """Returns the finalized and the JumpLoop lowering of each callback."""
+    script_ids = {script: i for i, script in enumerate(engine.scripts)}
+    finalized = []
+    jump_loops = []
+    for script in engine.scripts:
+        for callback_type in script._metadata_.callbacks:
+            cfg, _ = trace_callback(script, callback_type, script_ids)
+            cfg = run_optimization_passes(cfg, get_optimization_preset(level))
+            finalized.append(finalize_cfg(cfg))
+            jump_loops.append(finalize_cfg(cfg, structured=False))
+    return finalized, jump_loops
+
+
+def count_nodes(nodes: list) -> int:
+    """Returns the total number of engine nodes of each node on its own."""
+    return sum(len(get_engine_nodes([node])[0]) for node in nodes)
+
+
+def count_steps(nodes: list, runs: int) -> int:
+    """
+    Returns the number of nodes evaluated running every node once for each of
+    several random memory states.
+    """
+    steps = 0
+    for node in nodes:
+        for seed in range(runs):
+            rng = random.Random(seed)
+            blocks = {
+                block: [rng.randint(0, 6) for _ in range(256)] for block in MemoryBlock
+            }
+            interpreter = SimpleNodeInterpreter(
+                blocks=blocks, functions={"Draw": lambda args: 0}
+            )
+            interpreter.run_node(node)
+            steps += interpreter.steps
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("-O", dest="level", type=int, default=1, choices=range(4))
+    args = parser.parse_args()
+
+    engines = {"test engine": test_engine, "control flow engine": control_flow_engine}
+    with tempfile.TemporaryDirectory() as directory:
+        module_path = Path(directory) / "synthetic_engine.py"
+        module_path.write_text(generate_engine_source(20, 4))
+        sys.path.insert(0, directory)
+        engines["synthetic engine"] = importlib.import_module(
+            "synthetic_engine"
+        ).engine
+
+        print(f"optimization level: {args.level}, runs per callback: {args.runs}")
+        for name, tested_engine in engines.items():
+            finalized, jump_loops = lower_callbacks(tested_engine, args.level)
+            fallbacks = sum(
+                isinstance(node, FunctionNode) and node.func == "JumpLoop"
+                for node in finalized
+            )
+            print(
+                f"{name}: "
+                f"{count_nodes(jump_loops)} -> {count_nodes(finalized)} "
+                f"engine nodes by callback, "
+                f"{len(get_engine_nodes(jump_loops)[0])} -> "
+                f"{len(get_engine_nodes(finalized)[0])} in the engine, "
+                f"{count_steps(jump_loops, args.runs)} -> "
+                f"{count_steps(finalized, args.runs)} steps, "
+                f"JumpLoop kept for {fallbacks} of {len(finalized)} callbacks"
+            )
+
+
+if __name__ == "__main__":
+    main()
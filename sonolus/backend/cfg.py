@@ -5,6 +5,7 @@ from dataclasses import dataclass, field
 from functools import total_ordering
 from typing import Any
 
+from sonolus.backend.callback import CallbackType
 from sonolus.backend.ir import IRNode, SSARef
 
 
@@ -18,14 +19,24 @@ class CFG:
     edges_by_to: dict[CFGNode, set[CFGEdge]] = field(
         default_factory=lambda: defaultdict(set)
     )
+    # Cached analysis results, keyed by analysis type.
+    analyses: dict[type, Any] = field(default_factory=dict)
+    # Cached depth-first orders (see cfg_traversal.get_orders).
+    # Cleared whenever the edges or the entry node change.
+    orders: Any = None
+    # The callback the cfg is compiled for, if known, which limits the memory
+    # blocks it may write.
+    callback: CallbackType | None = None
 
     def add_edge(self, edge: CFGEdge, /):
         self.edges_by_from[edge.from_node].add(edge)
         self.edges_by_to[edge.to_node].add(edge)
+        self.orders = None
 
     def remove_edge(self, edge: CFGEdge):
         self.edges_by_from[edge.from_node].discard(edge)
         self.edges_by_to[edge.to_node].discard(edge)
+        self.orders = None
 
     def clear_to_edges(self, node: CFGNode):
         for edge in [*self.edges_by_to[node]]:
@@ -43,7 +54,7 @@ class CFG:
         for edge in [*self.edges_by_from[old_node]]:
             self.remove_edge(edge)
             self.add_edge(CFGEdge(new_node, edge.to_node, edge.condition))
-            for phi in edge.to_node.phi:
+            for phi in edge.to_node.phi or ():
                 if old_node in phi.values:
                     phi.values[new_node] = phi.values[old_node]
                     del phi.values[old_node]
@@ -53,6 +64,7 @@ class CFG:
         if old_node is self.entry_node:
             self.entry_node = new_node
             new_node.is_entry = True
+            self.orders = None
         if old_node is self.exit_node:
             self.exit_node = new_node
             new_node.is_exit = True
@@ -72,17 +84,28 @@ class CFG:
                 self.remove_node(node)
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class CFGNode:
     body: list[IRNode]
     test: IRNode | None
-    annotations: dict[Any, Any] = field(default_factory=dict)
-    phi: list[Phi] = field(default_factory=list)
+    # Most nodes have neither, so these are None until first used.
+    annotations: dict[Any, Any] | None = None
+    phi: list[Phi] | None = None
     is_entry: bool = False
     is_exit: bool = False
 
+    def annotate(self, key, value):
+        if self.annotations is None:
+            self.annotations = {}
+        self.annotations[key] = value
+
+    def add_phi(self, phi: Phi):
+        if self.phi is None:
+            self.phi = []
+        self.phi.append(phi)
+
 
-@dataclass
+@dataclass(slots=True)
 class Phi:
     target: SSARef
     values: dict[CFGNode, SSARef]
@@ -94,7 +117,7 @@ class Phi:
 
 
 @total_ordering
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CFGEdge:
     from_node: CFGNode
     to_node: CFGNode
@@ -1,10 +1,13 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
 from typing import Iterator
 
 from sonolus.backend.cfg import CFG, CFGNode
 
 
 def traverse_cfg(cfg: CFG) -> Iterator[CFGNode]:
-    # Traverse the cfg in arbitrary order
+    # Traverse the cfg in an unspecified, but deterministic, order
     visited = set()
     queue = [cfg.entry_node]
     while queue:
@@ -13,36 +16,63 @@ def traverse_cfg(cfg: CFG) -> Iterator[CFGNode]:
             continue
         visited.add(node)
         yield node
-        queue.extend([edge.to_node for edge in cfg.edges_by_from[node]])
-
-
-def traverse_postorder(
-    cfg: CFG, node: CFGNode = None, visited: set = None
-) -> Iterator[CFGNode]:
-    if node is None:
-        node = cfg.entry_node
-    if visited is None:
-        visited = set()
-    if node in visited:
-        return
-    visited.add(node)
-    edges = sorted(cfg.edges_by_from[node])
-    for edge in edges:
-        yield from traverse_postorder(cfg, edge.to_node, visited)
-    yield node
-
-
-def traverse_preorder(
-    cfg: CFG, node: CFGNode = None, visited: set = None
-) -> Iterator[CFGNode]:
-    if node is None:
-        node = cfg.entry_node
-    if visited is None:
-        visited = set()
-    if node in visited:
-        return
-    visited.add(node)
-    edges = sorted(cfg.edges_by_from[node])
-    yield node
-    for edge in edges:
-        yield from traverse_preorder(cfg, edge.to_node, visited)
+        queue.extend([edge.to_node for edge in sorted(cfg.edges_by_from[node])])
+
+
+def traverse_postorder(cfg: CFG) -> Iterator[CFGNode]:
+    yield from get_orders(cfg).postorder
+
+
+def traverse_preorder(cfg: CFG) -> Iterator[CFGNode]:
+    yield from get_orders(cfg).preorder
+
+
+@dataclass
+class CFGOrders:
+    """Depth-first orders of the reachable nodes of a cfg, following sorted edges."""
+
+    preorder: list[CFGNode]
+    postorder: list[CFGNode]
+    reverse_postorder: list[CFGNode]
+    preorder_index: dict[CFGNode, int]
+    reverse_postorder_index: dict[CFGNode, int]
+
+
+def get_orders(cfg: CFG) -> CFGOrders:
+    """
+    Returns the depth-first orders of the cfg.
+    The result is cached on the cfg until an edge is added or removed,
+    so it must not be modified.
+    """
+    if cfg.orders is None:
+        cfg.orders = _compute_orders(cfg)
+    return cfg.orders
+
+
+def _compute_orders(cfg: CFG) -> CFGOrders:
+    # Iterative, so arbitrarily deep cfgs don't hit the recursion limit.
+    preorder = []
+    postorder = []
+    visited = {cfg.entry_node}
+    stack = [(cfg.entry_node, iter(sorted(cfg.edges_by_from[cfg.entry_node])))]
+    preorder.append(cfg.entry_node)
+    while stack:
+        node, edges = stack[-1]
+        for edge in edges:
+            to_node = edge.to_node
+            if to_node not in visited:
+                visited.add(to_node)
+                preorder.append(to_node)
+                stack.append((to_node, iter(sorted(cfg.edges_by_from[to_node]))))
+                break
+        else:
+            stack.pop()
+            postorder.append(node)
+    reverse_postorder = postorder[::-1]
+    return CFGOrders(
+        preorder,
+        postorder,
+        reverse_postorder,
+        {node: i for i, node in enumerate(preorder)},
+        {node: i for i, node in enumerate(reverse_postorder)},
+    )
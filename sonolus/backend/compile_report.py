@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+from sonolus.backend.cfg import CFG
+from sonolus.backend.cfg_traversal import traverse_cfg
+from sonolus.backend.engine_node import SimpleNode, get_engine_nodes
+from sonolus.backend.ir_visitor import IRVisitor
+from sonolus.backend.optimization.allocate import get_temporary_memory_size
+from sonolus.backend.optimization.get_temp_ref_sizes import get_temp_ref_sizes
+from sonolus.backend.optimization.optimization_pass import (
+    OptimizationPass,
+    PassInstrumentation,
+)
+
+
+@dataclass
+class CompileReport:
+    """
+    Statistics about the compilation of an engine.
+
+    If track_allocations is set, memory allocated by each pass is traced with
+    tracemalloc, which slows compilation down considerably.
+    """
+
+    track_allocations: bool = False
+    callbacks: list[CallbackReport] = field(default_factory=list)
+
+    def to_dict(self):
+        return asdict(self)
+
+    def dump(self, path):
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2))
+
+
+@dataclass
+class CallbackReport:
+    script: str
+    callback: str
+    cached: bool = False
+    passes: list[PassReport] = field(default_factory=list)
+    engine_node_count: int | None = None
+    # Unknown for cached callbacks.
+    temporary_memory: int | None = None
+
+    def set_result(self, node: SimpleNode):
+        self.engine_node_count = len(get_engine_nodes([node])[0])
+
+    def set_optimized_cfg(self, cfg: CFG):
+        self.temporary_memory = get_temporary_memory_size(cfg)
+
+
+@dataclass
+class PassReport:
+    name: str
+    changed: bool
+    time: float
+    allocated: int | None
+    before: CFGStats
+    after: CFGStats
+
+
+@dataclass
+class CFGStats:
+    blocks: int
+    ir_nodes: int
+    temp_refs: int
+
+    @classmethod
+    def of(cls, cfg: CFG) -> CFGStats:
+        counter = _IRNodeCounter()
+        blocks = 0
+        for cfg_node in traverse_cfg(cfg):
+            counter.visit(cfg_node)
+            blocks += 1
+        return cls(blocks, counter.count, len(get_temp_ref_sizes(cfg)))
+
+
+class ReportInstrumentation(PassInstrumentation):
+    def __init__(self, report: CallbackReport, track_allocations: bool = False):
+        self.report = report
+        self.track_allocations = track_allocations
+        self.before = None
+        self.start_time = None
+        self.start_memory = None
+        self.stop_tracing = False
+
+    def before_pass(self, opt_pass: OptimizationPass, cfg: CFG):
+        self.before = CFGStats.of(cfg)
+        if self.track_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.stop_tracing = True
+            tracemalloc.reset_peak()
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.start_time = time.perf_counter()
+
+    def after_pass(self, opt_pass: OptimizationPass, cfg: CFG, changed: bool):
+        elapsed = time.perf_counter() - self.start_time
+        allocated = None
+        if self.track_allocations:
+            allocated = tracemalloc.get_traced_memory()[1] - self.start_memory
+            if self.stop_tracing:
+                tracemalloc.stop()
+                self.stop_tracing = False
+        self.report.passes.append(
+            PassReport(
+                type(opt_pass).__name__,
+                changed,
+                elapsed,
+                allocated,
+                self.before,
+                CFGStats.of(cfg),
+            )
+        )
+
+
+class _IRNodeCounter(IRVisitor):
+    def __init__(self):
+        self.count = 0
+
+    def visit_IRConst(self, node):
+        self.count += 1
+
+    def visit_IRComment(self, node):
+        self.count += 1
+
+    def visit_IRFunc(self, node):
+        self.count += 1
+        super().visit_IRFunc(node)
+
+    def visit_IRGet(self, node):
+        self.count += 1
+        super().visit_IRGet(node)
+
+    def visit_IRSet(self, node):
+        self.count += 1
+        super().visit_IRSet(node)
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
 import itertools
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Iterable
 
 from sonolus.backend.cfg import CFG, CFGNode
 from sonolus.backend.cfg_traversal import traverse_preorder
-from sonolus.backend.ir_visitor import IRTransformer
+from sonolus.backend.ir_visitor import IRTransformer, StructuralKeys
+from sonolus.backend.optimization.analyses import (
+    Dominators,
+    Loop,
+    Loops,
+    PostDominators,
+    ReversePostorder,
+)
 
 
 @dataclass(frozen=True)
@@ -18,26 +25,80 @@ class ValueNode:
 class FunctionNode:
     func: str
     args: tuple[SimpleNode, ...]
+    # Hashing the fields would hash the whole subtree every time.
+    _hash: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "_hash", hash((self.func, self.args)))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, FunctionNode):
+            return NotImplemented
+        return (
+            self._hash == other._hash
+            and self.func == other.func
+            and self.args == other.args
+        )
+
+    def __reduce__(self):
+        # String hashes differ between processes, so the hash isn't pickled.
+        return FunctionNode, (self.func, self.args)
 
 
 SimpleNode = ValueNode | FunctionNode
 
 
-def finalize_cfg(cfg: CFG) -> SimpleNode:
-    nodes = [*traverse_preorder(cfg)]
+def finalize_cfg(cfg: CFG, structured: bool = True) -> SimpleNode:
+    """
+    Converts a cfg to a single node.
+
+    If structured, control flow is emitted as nested If, Switch and While nodes
+    where possible. Parts of the cfg that can't be expressed that way, such as loops
+    with several exits, are emitted as a JumpLoop, as is the whole cfg if it is
+    irreducible or if that takes fewer engine nodes. Otherwise, the whole cfg is
+    emitted as a JumpLoop.
+    """
+    jump_loop = _jump_loop(cfg, [*traverse_preorder(cfg)])
+    if not structured:
+        return jump_loop
+    try:
+        node = _Structurer(cfg).run()
+    except _Unstructured:
+        return jump_loop
+    # Structured control flow evaluates fewer nodes, but isn't always smaller.
+    if len(get_engine_nodes([jump_loop])[0]) < len(get_engine_nodes([node])[0]):
+        return jump_loop
+    return node
+
+
+def _jump_loop(
+    cfg: CFG, nodes: list[CFGNode], stop: CFGNode | None = None
+) -> SimpleNode:
+    # Each node evaluates to the index of the next node, and the loop ends by
+    # evaluating the last node, which is the exit node or a jump to stop.
     mapping = {node: i for i, node in enumerate(nodes)}
     no_exit = False
     if cfg.exit_node not in mapping:
         no_exit = True
+    elif stop is not None:
+        raise _Unstructured
     elif mapping[cfg.exit_node] != len(mapping) - 1:
         mapping[nodes[-1]], mapping[cfg.exit_node] = (
             mapping[cfg.exit_node],
             mapping[nodes[-1]],
         )
     nodes = [...] * len(mapping)
+    if stop is not None:
+        mapping[stop] = len(nodes)
     transformer = FinalizeTransformer(cfg, mapping)
     for node, i in mapping.items():
-        nodes[i] = transformer.visit(node)
+        if node is not stop:
+            nodes[i] = transformer.visit(node)
     if no_exit:
         nodes.append(ValueNode(0))
     if len(nodes) == 1:
@@ -46,15 +107,198 @@ def finalize_cfg(cfg: CFG) -> SimpleNode:
         return FunctionNode("JumpLoop", tuple(nodes))
 
 
+class _Unstructured(Exception):
+    pass
+
+
+class _Structurer:
+    def __init__(self, cfg: CFG):
+        self.cfg = cfg
+        self.transformer = FinalizeTransformer(cfg, {})
+        self.nodes = ReversePostorder.get(cfg)
+        self.dominators = Dominators.get(cfg)
+        self.post_dominators = PostDominators.get(cfg)
+        self.loops = {loop.header: loop for loop in Loops.get(cfg)}
+        # The headers of the loops being emitted.
+        self.entered = set()
+        # Nodes reached from several branches are emitted once per branch,
+        # so the total is bounded to avoid blowing up.
+        self.remaining = 4 * len(self.nodes) + 16
+
+    def run(self) -> SimpleNode:
+        order = {node: i for i, node in enumerate(self.nodes)}
+        for node in self.nodes:
+            for edge in self.cfg.edges_by_from[node]:
+                if order[edge.to_node] <= order[node] and not (
+                    self.dominators.dominates(edge.to_node, node)
+                ):
+                    # A retreating edge that isn't a back edge of a natural loop.
+                    raise _Unstructured
+        return _sequence(self.emit(self.nodes[0], None))
+
+    def emit(self, node: CFGNode, stop: CFGNode | None) -> list[SimpleNode]:
+        """
+        Returns the nodes evaluating the cfg from the given node until stop is
+        reached, or ending with the result of the cfg if stop is None.
+        """
+        result = []
+        while node is not stop:
+            self.remaining -= 1
+            if self.remaining < 0:
+                raise _Unstructured
+            if node in self.loops and node not in self.entered:
+                next_node = self.emit_loop(self.loops[node], result)
+                if next_node is None:
+                    result.append(self.emit_jump_loop(node, stop))
+                    return result
+                node = next_node
+                continue
+            edges = {
+                edge.condition: edge.to_node for edge in self.cfg.edges_by_from[node]
+            }
+            if edges and None not in edges:
+                # Without a default edge, the cfg ends if no edge matches.
+                # The jump loop evaluates the whole node, including its body.
+                result.append(self.emit_jump_loop(node, stop))
+                return result
+            result.extend(self.transformer.visit(statement) for statement in node.body)
+            match edges:
+                case empty if empty == {}:
+                    if node.test is None:
+                        result.append(ValueNode(-1))
+                    else:
+                        result.append(self.transformer.visit(node.test))
+                    return result
+                case {None: target, **others} if not others:
+                    node = target
+                case {None: _, **others}:
+                    join = self.post_dominators[node]
+                    test = self.transformer.visit(node.test)
+                    branches = {
+                        condition: _sequence(self.emit(target, join))
+                        for condition, target in edges.items()
+                    }
+                    result.append(_branch(test, branches))
+                    if join is None:
+                        return result
+                    node = join
+        return result
+
+    def emit_loop(self, loop: Loop, result: list[SimpleNode]) -> CFGNode | None:
+        """
+        Emits a loop as a While node, returning the node the loop exits to.
+        Only loops with a single exiting node, reached on every iteration,
+        are supported.
+        """
+        header = loop.header
+        exiting = {
+            node
+            for node in loop.nodes
+            for edge in self.cfg.edges_by_from[node]
+            if edge.to_node not in loop.nodes
+        }
+        if len(exiting) != 1:
+            return None
+        (node,) = exiting
+        if node is not header and node in self.loops:
+            return None
+        if not all(self.dominators.dominates(node, latch) for latch in loop.latches):
+            return None
+        edges = {edge.condition: edge.to_node for edge in self.cfg.edges_by_from[node]}
+        if edges.keys() != {None, 0}:
+            return None
+        test = self.transformer.visit(node.test)
+        if edges[None] in loop.nodes:
+            inside, outside = edges[None], edges[0]
+        else:
+            inside, outside = edges[0], edges[None]
+            test = FunctionNode("Not", (test,))
+
+        self.entered.add(header)
+        condition = self.emit(header, node)
+        condition.extend(self.transformer.visit(statement) for statement in node.body)
+        condition.append(test)
+        body = self.emit(inside, header)
+        self.entered.remove(header)
+        result.append(FunctionNode("While", (_sequence(condition), _sequence(body))))
+        return outside
+
+    def emit_jump_loop(self, node: CFGNode, stop: CFGNode | None) -> SimpleNode:
+        nodes = []
+        visited = {node, stop}
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            nodes.append(current)
+            for edge in sorted(self.cfg.edges_by_from[current], reverse=True):
+                if edge.to_node not in visited:
+                    visited.add(edge.to_node)
+                    stack.append(edge.to_node)
+        return _jump_loop(self.cfg, nodes, stop)
+
+
+def _branch(test: SimpleNode, branches: dict[float | None, SimpleNode]) -> SimpleNode:
+    """
+    Returns a node evaluating the branch whose condition equals the test, or the
+    branch with a condition of None if there is none.
+
+    Dense integer conditions are dispatched by index with SwitchInteger,
+    rather than compared one by one.
+    """
+    default = branches.get(None)
+    cases = {
+        condition: branches[condition]
+        for condition in sorted(
+            condition for condition in branches if condition is not None
+        )
+    }
+    if cases.keys() == {0} and default is not None:
+        return FunctionNode("If", (test, default, cases[0]))
+    if cases and all(float(condition).is_integer() for condition in cases):
+        low, high = int(min(cases)), int(max(cases))
+        # Starting from 0 avoids offsetting the test if it doesn't cost much.
+        if 0 <= low and high < 2 * len(cases):
+            low = 0
+        if high - low < 2 * len(cases):
+            if low != 0:
+                test = FunctionNode("Subtract", (test, ValueNode(low)))
+            # Conditions within the range without a branch go to the default.
+            missing = ValueNode(0) if default is None else default
+            indexed = [cases.get(i, missing) for i in range(low, high + 1)]
+            if default is None:
+                return FunctionNode("SwitchInteger", (test, *indexed))
+            return FunctionNode("SwitchIntegerWithDefault", (test, *indexed, default))
+    conditions = itertools.chain.from_iterable(
+        (ValueNode(condition), branch) for condition, branch in cases.items()
+    )
+    if default is None:
+        return FunctionNode("Switch", (test, *conditions))
+    return FunctionNode("SwitchWithDefault", (test, *conditions, default))
+
+
+def _sequence(nodes: list[SimpleNode]) -> SimpleNode:
+    match nodes:
+        case []:
+            return ValueNode(0)
+        case [node]:
+            return node
+        case _:
+            return FunctionNode("Execute", tuple(nodes))
+
+
 def get_engine_nodes(
     nodes: Iterable[SimpleNode],
 ) -> tuple[list[dict], dict[SimpleNode, int]]:
+    keys = _NodeKeys()
+    indexes = {}
     mapping = {}
     queue = [*nodes]
     while queue:
         node = queue.pop()
-        if node not in mapping:
-            mapping[node] = len(mapping)
+        key = keys.get(node)
+        if key not in indexes:
+            indexes[key] = len(indexes)
+            mapping[node] = indexes[key]
             if isinstance(node, FunctionNode):
                 queue.extend(reversed(node.args))
     nodes = [...] * len(mapping)
@@ -63,12 +307,29 @@ def get_engine_nodes(
             case ValueNode():
                 nodes[i] = {"value": node.value}
             case FunctionNode(func, args):
-                nodes[i] = {"func": func, "args": [mapping[arg] for arg in args]}
+                nodes[i] = {
+                    "func": func,
+                    "args": [indexes[keys.get(arg)] for arg in args],
+                }
             case _:
                 raise ValueError(f"Unexpected node type: {type(node)}")
     return nodes, mapping
 
 
+class _NodeKeys(StructuralKeys):
+    """Numbers finalized nodes such that equal nodes get the same key."""
+
+    def children(self, node: SimpleNode) -> list:
+        if isinstance(node, FunctionNode):
+            return node.args
+        return []
+
+    def entry(self, node: SimpleNode) -> tuple | SimpleNode:
+        if isinstance(node, FunctionNode):
+            return node.func, *(self.keys[id(arg)] for arg in node.args)
+        return node
+
+
 class FinalizeTransformer(IRTransformer):
     node_indexes: dict[CFGNode, int]
 
@@ -87,25 +348,13 @@ class FinalizeTransformer(IRTransformer):
                 terminal = test
             case {None: edge, **other} if not other:
                 terminal = ValueNode(self.node_indexes[edge.to_node])
-            case {None: t_branch, 0: f_branch, **other} if not other:
-                terminal = FunctionNode(
-                    "If",
-                    (
-                        test,
-                        ValueNode(self.node_indexes[t_branch.to_node]),
-                        ValueNode(self.node_indexes[f_branch.to_node]),
-                    ),
-                )
             case {**edges}:
-                terminal = FunctionNode(
-                    "Switch",
-                    (
-                        test,
-                        *itertools.chain.from_iterable(
-                            (condition, self.node_indexes[edge.to_node])
-                            for condition, edge in edges.items()
-                        ),
-                    ),
+                terminal = _branch(
+                    test,
+                    {
+                        condition: ValueNode(self.node_indexes[edge.to_node])
+                        for condition, edge in edges.items()
+                    },
                 )
             case other:
                 raise ValueError(f"Invalid edge: {other}.")
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import collections
+from contextvars import ContextVar, Token
 from dataclasses import dataclass, field
 from typing import TYPE_CHECKING, ClassVar
 
@@ -36,7 +37,10 @@ def evaluate_statement(statement: Statement) -> CFG:
                 queue.append(target)
 
     mapping = {scope: CFGNode(scope.body, scope.test) for scope in scopes}
+    compilation_info = CompilationInfo.current()
     cfg = CFG(mapping[start], mapping[end])
+    if compilation_info is not None:
+        cfg.callback = compilation_info.callback
 
     mapping[start].is_entry = True
     mapping[end].is_exit = True
@@ -60,23 +64,36 @@ class CompilationInfo:
     callback: CallbackType
     script_ids: dict
     refs: dict[str, int] = field(default_factory=dict)
+    # Functions and value types reached while tracing, used for compile caching.
+    dependencies: set = field(default_factory=set)
 
-    _current: ClassVar[CompilationInfo | None] = None
+    # Context-local rather than process-global, so independent compilations
+    # (e.g. in worker threads) do not clobber each other.
+    _current: ClassVar[ContextVar[CompilationInfo | None]] = ContextVar(
+        "compilation_info", default=None
+    )
+    _token: Token | None = field(default=None, init=False, repr=False, compare=False)
 
     @classmethod
     def get(cls) -> CompilationInfo:
-        if cls._current is None:
+        current = cls.current()
+        if current is None:
             raise RuntimeError("No compilation is currently active.")
-        return cls._current
+        return current
+
+    @classmethod
+    def current(cls) -> CompilationInfo | None:
+        return cls._current.get()
 
     def __enter__(self):
-        if CompilationInfo._current is not None:
+        if CompilationInfo._current.get() is not None:
             raise RuntimeError("A compilation is already active.")
-        CompilationInfo._current = self
+        self._token = CompilationInfo._current.set(self)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        CompilationInfo._current = None
+        CompilationInfo._current.reset(self._token)
+        self._token = None
 
 
 @dataclass(eq=False, repr=False)
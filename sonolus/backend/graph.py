@@ -44,7 +44,7 @@ def get_flat_cfg(cfg: CFG) -> FlatCfg:
                 target,
                 {
                     phi.target: {node_indexes[k]: v for k, v in phi.values.items()}
-                    for phi in node.phi
+                    for phi in node.phi or ()
                 },
             )
         )
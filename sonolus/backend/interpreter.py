@@ -22,6 +22,7 @@ from typing import Callable, TypeVar
 
 from sonolus.backend.cfg import CFG
 from sonolus.backend.cfg_traversal import traverse_cfg
+from sonolus.backend.engine_node import FunctionNode, SimpleNode, ValueNode
 from sonolus.backend.evaluation import evaluate_statement
 from sonolus.backend.ir import (
     TempRef,
@@ -83,11 +84,24 @@ class CFGInterpreter:
                 else:
                     return 0
             elif test in targets:
-                cfg_node = targets[test]
+                next_node = targets[test]
             elif None in targets:
-                cfg_node = targets[None]
+                next_node = targets[None]
             else:
                 return 0
+            if next_node.phi:
+                # Phis are evaluated in parallel on entry.
+                values = [self.read_ssa(phi.values[cfg_node]) for phi in next_node.phi]
+                for phi, value in zip(next_node.phi, values):
+                    self.blocks[phi.target] = [value]
+            cfg_node = next_node
+
+    def read_ssa(self, ref: SSARef) -> float:
+        if ref not in self.blocks:
+            if not self.allow_uninitialized:
+                raise ValueError(f"Uninitialized read of {ref}.")
+            return 0
+        return self.blocks[ref][0]
 
     def run_node(self, node: IRNode) -> float:
         match node:
@@ -145,13 +159,13 @@ class CFGInterpreter:
             case "SwitchInteger":
                 test = self.run_node(args[0])
                 for i in range(1, len(args)):
-                    if test == i:
+                    if test == i - 1:
                         return self.run_node(args[i])
                 return 0
             case "SwitchIntegerWithDefault":
                 test = self.run_node(args[0])
                 for i in range(1, len(args) - 1):
-                    if test == i:
+                    if test == i - 1:
                         return self.run_node(args[i])
                 return self.run_node(args[-1])
             case "While":
@@ -313,11 +327,64 @@ class CFGInterpreter:
             case IRNode():
                 return self.run_node(ref)
             case SSARef():
-                raise NotImplementedError("SSA references not supported.")
+                return ref
             case _:
                 raise ValueError(f"Unexpected reference type: {ref}.")
 
 
+class SimpleNodeInterpreter(CFGInterpreter):
+    """
+    Runs finalized nodes, as produced by finalize_cfg, the way they run on device.
+
+    Builtins are evaluated as by CFGInterpreter. Every function node evaluated
+    counts as a step.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.steps = 0
+
+    def run_node(self, node: SimpleNode) -> float:
+        match node:
+            case ValueNode(value):
+                return value
+            case FunctionNode(func, args):
+                self.steps += 1
+                return self.run_function(func, args)
+            case _:
+                return super().run_node(node)
+
+    def run_function(self, func: str, args: tuple[SimpleNode, ...]) -> float:
+        match func:
+            case "Get":
+                block, index = self.get_index(*args)
+                return self.blocks[block][index]
+            case "Set":
+                block, index = self.get_index(*args[:2])
+                self.blocks[block][index] = self.run_node(args[2])
+                return 0
+            case "JumpLoop":
+                # Each argument evaluates to the index of the next one to evaluate,
+                # until the last one, whose value is the result.
+                index = 0
+                while index < len(args) - 1:
+                    index = int(self.run_node(args[index]))
+                return self.run_node(args[-1])
+            case _ if func in self.functions:
+                return self.functions[func]([self.run_node(arg) for arg in args])
+            case _:
+                return self.run_builtin(func, [*args])
+
+    def get_index(self, ref: SimpleNode, offset: SimpleNode) -> tuple[int, int]:
+        block = int(self.run_node(ref))
+        index = int(self.run_node(offset))
+        if self.allow_uninitialized:
+            memory = self.blocks.setdefault(block, [])
+            if index >= len(memory):
+                memory += [0] * (index + 1 - len(memory))
+        return block, index
+
+
 def run_value(
     value: TValue, *, blocks: dict[TempRef | int, list[float]] | None = None, **kwargs
 ) -> TValue:
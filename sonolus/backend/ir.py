@@ -1,22 +1,48 @@
 from __future__ import annotations
 
+import math
 import textwrap
 from dataclasses import dataclass, field
 from enum import IntEnum
 from typing import Optional, TypeAlias
+from weakref import WeakValueDictionary
+
+from sonolus.backend.optimization.node_functions import constant_functions
+
+# Interned nodes, keyed by their structure.
+# IR nodes are never mutated, so nodes with the same structure may be shared.
+# Since the children of an interned node are kept alive by it, their ids are
+# valid for as long as its entry exists.
+_interned: WeakValueDictionary = WeakValueDictionary()
 
 
 class IRNode:
+    # Nodes are slotted to keep large cfgs compact.
+    # The weakref slot is needed for interning.
+    __slots__ = ("__weakref__",)
+
     def constant(self) -> Optional[float]:
         return None
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class IRConst(IRNode):
     """IR for a constant value."""
 
     value: float | int
 
+    @classmethod
+    def of(cls, value: float | int) -> IRConst:
+        """Returns the interned constant with the given value."""
+        key = _const_key(value)
+        if key is None:
+            return cls(value)
+        node = _interned.get(key)
+        if node is None:
+            node = cls(value)
+            _interned[key] = node
+        return node
+
     def constant(self) -> Optional[float]:
         return float(self.value)
 
@@ -26,7 +52,7 @@ class IRConst(IRNode):
         return f"{self.value}"
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class IRComment(IRNode):
     message: str
 
@@ -37,7 +63,7 @@ class IRComment(IRNode):
         return f"/* {self.message} */"
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class IRFunc(IRNode):
     """
     IR for a function call.
@@ -51,6 +77,21 @@ class IRFunc(IRNode):
     name: str
     args: list[IRValueType] = field(default_factory=list)
 
+    @classmethod
+    def of(cls, name: str, args: list[IRValueType]) -> IRFunc:
+        """
+        Returns the interned call if the function is pure,
+        otherwise a new call.
+        """
+        if name not in constant_functions:
+            return cls(name, args)
+        key = (IRFunc, name, *(id(arg) for arg in args))
+        node = _interned.get(key)
+        if node is None:
+            node = cls(name, [*args])
+            _interned[key] = node
+        return node
+
     def __str__(self):
         entries = [str(arg) for arg in self.args]
         if len(entries) > 3 or any("\n" in entry for entry in entries):
@@ -60,17 +101,35 @@ class IRFunc(IRNode):
         return f"{self.name}({body})"
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class IRGet(IRNode):
     """IR for accessing a memory location."""
 
     location: Location
 
+    @classmethod
+    def of(cls, location: Location) -> IRGet:
+        """
+        Returns the interned get if the location is constant,
+        otherwise a new get.
+        """
+        if not isinstance(location.offset, IRConst) or isinstance(location.ref, IRNode):
+            return cls(location)
+        offset_key = _const_key(location.offset.value)
+        if offset_key is None:
+            return cls(location)
+        key = (IRGet, location.ref, offset_key, location.base, location.span)
+        node = _interned.get(key)
+        if node is None:
+            node = cls(location)
+            _interned[key] = node
+        return node
+
     def __str__(self):
         return f"{self.location}"
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class IRSet(IRNode):
     """IR for modifying a memory location."""
 
@@ -84,7 +143,7 @@ class IRSet(IRNode):
 IRValueType: TypeAlias = IRFunc | IRGet | IRConst
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TempRef:
     # name should follow the same limitations as standard Python variable names.
     # Internally, names may contain other characters.
@@ -94,7 +153,7 @@ class TempRef:
         return f"{self.name}"
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SSARef:
     name: str
     number: int = 0
@@ -135,10 +194,24 @@ class MemoryBlock(IntEnum):
 
 MEMORY_BLOCK_VALUES = frozenset(MemoryBlock)
 
+# Blocks that are views of the same memory.
+# For example, the entity shared memory of the current entity is also part of
+# the entity shared memory array.
+_MEMORY_BLOCK_ALIAS_GROUPS = [
+    frozenset({MemoryBlock.ENTITY_INFO, MemoryBlock.ENTITY_INFO_ARRAY}),
+    frozenset({MemoryBlock.ENTITY_DATA, MemoryBlock.ENTITY_DATA_ARRAY}),
+    frozenset(
+        {MemoryBlock.ENTITY_SHARED_MEMORY, MemoryBlock.ENTITY_SHARED_MEMORY_ARRAY}
+    ),
+]
+MEMORY_BLOCK_ALIASES: dict[MemoryBlock, frozenset[MemoryBlock]] = {
+    block: group for group in _MEMORY_BLOCK_ALIAS_GROUPS for block in group
+}
+
 Ref = SSARef | TempRef | IRNode | int
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class Location:
     ref: Ref
     offset: IRValueType
@@ -170,3 +243,13 @@ class Location:
             return f"@Block$${MemoryBlock(self.ref.constant()).name}[{index}]"
         else:
             return f"@{self.ref}[{index}]"
+
+
+def _const_key(value) -> tuple | None:
+    if value is None or value != value:
+        # nan is never equal to itself, so it can't be looked up.
+        return None
+    if value == 0:
+        # 0.0 and -0.0 compare equal, but are distinguishable.
+        return IRConst, type(value), value, math.copysign(1, value)
+    return IRConst, type(value), value
@@ -1,6 +1,17 @@
+import math
+
 from sonolus.backend.cfg import CFGNode
 from sonolus.backend.cfg_traversal import traverse_cfg
-from sonolus.backend.ir import IRFunc, IRGet, IRSet, Location
+from sonolus.backend.ir import (
+    IRComment,
+    IRConst,
+    IRFunc,
+    IRGet,
+    IRNode,
+    IRSet,
+    Location,
+    TempRef,
+)
 
 
 class IRVisitor:
@@ -40,9 +51,35 @@ class IRVisitor:
         self.visit(location.offset)
 
 
+class ReadRefsVisitor(IRVisitor):
+    """Collects the refs of the locations read by the visited nodes."""
+
+    def __init__(self):
+        self.refs = set()
+
+    def visit_IRGet(self, node):
+        super().visit_IRGet(node)
+        self.refs.add(node.location.ref)
+
+
+def get_read_refs(node) -> set:
+    visitor = ReadRefsVisitor()
+    visitor.visit(node)
+    return visitor.refs
+
+
+def get_read_temp_refs(node) -> set[TempRef]:
+    return {ref for ref in get_read_refs(node) if isinstance(ref, TempRef)}
+
+
 class IRTransformer(IRVisitor):
     def visit_CFG(self, cfg):
-        raise NotImplementedError()
+        # Nodes are updated in place, so the structure of the cfg is unchanged.
+        for cfg_node in [*traverse_cfg(cfg)]:
+            transformed = self.visit(cfg_node)
+            cfg_node.body = transformed.body
+            cfg_node.test = transformed.test
+        return cfg
 
     def visit_CFGNode(self, node):
         body = [self.visit(n) for n in node.body]
@@ -60,16 +97,112 @@ class IRTransformer(IRVisitor):
     def visit_IRComment(self, node):
         return node
 
+    # Nodes are immutable, so unchanged nodes are returned as is rather than copied.
+
     def visit_IRFunc(self, node):
-        return IRFunc(node.name, [self.visit(arg) for arg in node.args])
+        args = [self.visit(arg) for arg in node.args]
+        if all(arg is old_arg for arg, old_arg in zip(args, node.args)):
+            return node
+        return IRFunc.of(node.name, args)
 
     def visit_IRGet(self, node):
-        return IRGet(self.visit(node.location))
+        location = self.visit(node.location)
+        if location is node.location:
+            return node
+        return IRGet.of(location)
 
     def visit_IRSet(self, node):
-        return IRSet(self.visit(node.location), self.visit(node.value))
+        location = self.visit(node.location)
+        value = self.visit(node.value)
+        if location is node.location and value is node.value:
+            return node
+        return IRSet(location, value)
 
     def visit_Location(self, location):
-        return Location(
-            location.ref, self.visit(location.offset), location.base, location.span
-        )
+        offset = self.visit(location.offset)
+        if offset is location.offset:
+            return location
+        return Location(location.ref, offset, location.base, location.span)
+
+
+class StructuralKeys:
+    """
+    Numbers nodes such that structurally equal nodes get the same key.
+
+    Nodes are numbered bottom up, so a node is looked up by the keys of its
+    children rather than by comparing whole subtrees. Subclasses number other
+    kinds of nodes by overriding children and entry.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.table = {}
+        # Keys are memoized by id, so nodes with keys are kept alive.
+        self.nodes = []
+
+    def get(self, node) -> int:
+        key = self.keys.get(id(node))
+        if key is not None:
+            return key
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if id(current) in self.keys:
+                stack.pop()
+                continue
+            pending = [
+                child for child in self.children(current) if id(child) not in self.keys
+            ]
+            if pending:
+                stack.extend(pending)
+                continue
+            entry = self.entry(current)
+            self.keys[id(current)] = self.table.setdefault(entry, len(self.table))
+            self.nodes.append(current)
+            stack.pop()
+        return self.keys[id(node)]
+
+    def children(self, node) -> list:
+        match node:
+            case IRFunc(_, args):
+                return args
+            case IRGet(location):
+                return self.location_children(location)
+            case IRSet(location, value):
+                return [*self.location_children(location), value]
+            case _:
+                return []
+
+    def entry(self, node) -> tuple:
+        """Returns what identifies a node, given that its children have keys."""
+        match node:
+            case IRConst(value):
+                return self.constant_entry(node, value)
+            case IRComment(message):
+                return "comment", message
+            case IRFunc(name, args):
+                return "func", name, *(self.keys[id(arg)] for arg in args)
+            case IRGet(location):
+                return "get", *self.location_entry(location)
+            case IRSet(location, value):
+                return "set", *self.location_entry(location), self.keys[id(value)]
+            case _:
+                raise TypeError(f"Unexpected ir node {node}.")
+
+    def constant_entry(self, node, value: float | int) -> tuple:
+        if value != value:
+            # nan is never equal to itself.
+            return "const", id(node)
+        # 0 and -0 are equal, but not interchangeable.
+        return "const", type(value), value, math.copysign(1, value)
+
+    def location_children(self, location: Location) -> list:
+        if isinstance(location.ref, IRNode):
+            return [location.ref, location.offset]
+        return [location.offset]
+
+    def location_entry(self, location: Location) -> tuple:
+        ref = location.ref
+        if isinstance(ref, IRNode):
+            ref = ("node", self.keys[id(ref)])
+        return ref, self.keys[id(location.offset)], location.base, location.span
@@ -5,25 +5,31 @@ from sonolus.backend.cfg import CFG
 from sonolus.backend.cfg_traversal import traverse_cfg
 from sonolus.backend.ir import TempRef, Location, IRConst
 from sonolus.backend.ir_visitor import IRVisitor, IRTransformer
-from sonolus.backend.optimization.get_temp_ref_sizes import get_temp_ref_sizes
+from sonolus.backend.optimization.analyses import (
+    TempRefSizes,
+    ReversePostorder,
+    Predecessors,
+    Dominators,
+)
 from sonolus.backend.optimization.optimization_pass import OptimizationPass
 
 
 class AggregateToScalar(OptimizationPass):
+    requires = (TempRefSizes,)
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
     def run(self, cfg: CFG):
-        visitor = _AggregateAccessVisitor(cfg)
+        visitor = _AggregateAccessVisitor(TempRefSizes.get(cfg))
         for cfg_node in traverse_cfg(cfg):
             visitor.visit(cfg_node)
         transformer = _AggregateAccessTransformer(visitor.values)
-        for cfg_node in [*traverse_cfg(cfg)]:
-            cfg.replace_node(cfg_node, transformer.visit(cfg_node))
+        transformer.visit(cfg)
+        return transformer.changed
 
 
 class _AggregateAccessVisitor(IRVisitor):
-    def __init__(self, cfg):
-        self.values = {
-            ref: [True] * size for ref, size in get_temp_ref_sizes(cfg).items()
-        }
+    def __init__(self, sizes):
+        self.values = {ref: [True] * size for ref, size in sizes.items()}
 
     def visit_Location(self, location):
         ref = location.ref
@@ -54,11 +60,20 @@ class _AggregateAccessTransformer(IRTransformer):
                     ]
                 else:
                     start, end = indexes[0][0], indexes[-1][0] + 1
+                    if start == 0 and end == len(entry):
+                        # Nothing to split, so keep the original ref.
+                        entry[start:end] = [(ref, 0)] * (end - start)
+                        continue
                     entry[start:end] = [
                         (TempRef(f"{ref.name}${start}_{end}"), start)
                     ] * (end - start)
 
         self.values = values
+        self.changed = any(
+            new_ref != ref or base_offset != 0
+            for ref, entry in values.items()
+            for new_ref, base_offset in entry
+        )
 
     def visit_Location(self, location):
         ref = location.ref
@@ -1,26 +1,135 @@
 import dataclasses
 
 from sonolus.backend.cfg import CFG
-from sonolus.backend.cfg_traversal import traverse_cfg
-from sonolus.backend.ir import TempRef, MemoryBlock
-from sonolus.backend.ir_visitor import IRTransformer
-from sonolus.backend.optimization.get_temp_ref_sizes import get_temp_ref_sizes
+from sonolus.backend.ir import TempRef, MemoryBlock, IRSet
+from sonolus.backend.ir_visitor import IRTransformer, IRVisitor, get_read_temp_refs
+from sonolus.backend.optimization.analyses import (
+    TempRefSizes,
+    ReversePostorder,
+    Predecessors,
+    Dominators,
+    Liveness,
+)
 from sonolus.backend.optimization.optimization_pass import OptimizationPass
 
 BASE_INDEX = 4095
 
 
 class Allocate(OptimizationPass):
+    requires = (TempRefSizes,)
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
     def run(self, cfg: CFG):
-        sizes = get_temp_ref_sizes(cfg)
+        sizes = TempRefSizes.get(cfg)
         offset = -1
         mapping = {}
         for ref, size in sizes.items():
             offset += size
             mapping[ref] = BASE_INDEX - offset
-        transformer = AllocateTransformer(mapping)
-        for cfg_node in [*traverse_cfg(cfg)]:
-            cfg.replace_node(cfg_node, transformer.visit(cfg_node))
+        AllocateTransformer(mapping).visit(cfg)
+        return bool(mapping)
+
+
+class InterferenceAllocate(OptimizationPass):
+    """
+    Allocates temp refs to temporary memory, sharing memory between temp refs
+    whose live ranges don't overlap.
+
+    A temp ref has no defined value before it is first written, so it only
+    interferes with the temp refs it is live at the same time as after that.
+    Temp refs are placed at the lowest offset not used by any temp ref they
+    interfere with, in the order they are first accessed.
+    """
+
+    requires = (ReversePostorder, Predecessors, TempRefSizes, Liveness)
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
+    def run(self, cfg: CFG):
+        sizes = TempRefSizes.get(cfg)
+        interference = self.get_interference(cfg)
+        offsets = {}
+        for ref, size in sizes.items():
+            used = sorted(
+                (offsets[other], offsets[other] + sizes[other])
+                for other in interference.get(ref, ())
+                if other in offsets
+            )
+            offset = 0
+            for start, end in used:
+                if start >= offset + size:
+                    break
+                offset = max(offset, end)
+            offsets[ref] = offset
+        mapping = {
+            ref: BASE_INDEX - (offset + sizes[ref] - 1)
+            for ref, offset in offsets.items()
+        }
+        AllocateTransformer(mapping).visit(cfg)
+        return bool(mapping)
+
+    def get_interference(self, cfg: CFG) -> dict[TempRef, set[TempRef]]:
+        nodes = ReversePostorder.get(cfg)
+        predecessors = Predecessors.get(cfg)
+        sizes = TempRefSizes.get(cfg)
+        live_out = Liveness.get(cfg).live_out
+
+        written = {node: set() for node in nodes}
+        for node in nodes:
+            for statement in node.body:
+                if isinstance(statement, IRSet) and isinstance(
+                    statement.location.ref, TempRef
+                ):
+                    written[node].add(statement.location.ref)
+
+        # The temp refs that may have been written at the start of each node.
+        defined_in = {node: frozenset() for node in nodes}
+        changed = True
+        while changed:
+            changed = False
+            for node in nodes:
+                new_defined = frozenset().union(
+                    *(defined_in[pred] | written[pred] for pred in predecessors[node])
+                )
+                if new_defined != defined_in[node]:
+                    defined_in[node] = new_defined
+                    changed = True
+
+        interference = {}
+        for node in nodes:
+            defined = set(defined_in[node])
+            defined_after = []
+            for statement in node.body:
+                if isinstance(statement, IRSet) and isinstance(
+                    statement.location.ref, TempRef
+                ):
+                    defined.add(statement.location.ref)
+                defined_after.append(frozenset(defined))
+
+            live = set(live_out[node])
+            if node.test is not None:
+                live.update(get_read_temp_refs(node.test))
+            for statement, defined in zip(reversed(node.body), reversed(defined_after)):
+                if isinstance(statement, IRSet) and isinstance(
+                    statement.location.ref, TempRef
+                ):
+                    ref = statement.location.ref
+                    for other in live:
+                        if other != ref and other in defined:
+                            interference.setdefault(ref, set()).add(other)
+                            interference.setdefault(other, set()).add(ref)
+                    if sizes[ref] == 1:
+                        live.discard(ref)
+                live.update(get_read_temp_refs(statement))
+        return interference
+
+
+def get_temporary_memory_size(cfg: CFG) -> int:
+    """Returns the amount of temporary memory used by an allocated cfg."""
+    visitor = _TemporaryMemoryVisitor()
+    visitor.visit(cfg)
+    if visitor.lowest is None:
+        return 0
+    return BASE_INDEX + 1 - visitor.lowest
 
 
 class AllocateTransformer(IRTransformer):
@@ -36,3 +145,15 @@ class AllocateTransformer(IRTransformer):
                 base=self.mapping[location.ref] + location.base,
             )
         return location
+
+
+class _TemporaryMemoryVisitor(IRVisitor):
+    def __init__(self):
+        self.lowest = None
+
+    def visit_Location(self, location):
+        super().visit_Location(location)
+        if location.ref == MemoryBlock.TEMPORARY_MEMORY and (
+            self.lowest is None or location.base < self.lowest
+        ):
+            self.lowest = location.base
@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from sonolus.backend.cfg import CFG, CFGNode
+from sonolus.backend.cfg_traversal import get_orders
+from sonolus.backend.ir import TempRef, IRSet, IRGet
+from sonolus.backend.ir_visitor import IRVisitor
+from sonolus.backend.optimization.get_temp_ref_sizes import get_temp_ref_sizes
+from sonolus.backend.optimization.optimization_pass import AnalysisPass
+
+
+class TempRefSizes(AnalysisPass):
+    """The size of every temp ref accessed in the cfg."""
+
+    @classmethod
+    def analyze(cls, cfg: CFG) -> dict[TempRef, int]:
+        return get_temp_ref_sizes(cfg)
+
+
+class ReversePostorder(AnalysisPass):
+    """The reachable nodes of the cfg in reverse postorder."""
+
+    @classmethod
+    def analyze(cls, cfg: CFG) -> list[CFGNode]:
+        return get_orders(cfg).reverse_postorder
+
+
+class Predecessors(AnalysisPass):
+    """The reachable predecessors of every reachable node."""
+
+    requires = (ReversePostorder,)
+
+    @classmethod
+    def analyze(cls, cfg: CFG) -> dict[CFGNode, list[CFGNode]]:
+        order = {node: i for i, node in enumerate(ReversePostorder.get(cfg))}
+        return {
+            node: sorted(
+                {
+                    edge.from_node
+                    for edge in cfg.edges_by_to[node]
+                    if edge.from_node in order
+                },
+                key=order.__getitem__,
+            )
+            for node in order
+        }
+
+
+@dataclass
+class DominatorTree:
+    # The entry node is its own immediate dominator.
+    idom: dict[CFGNode, CFGNode]
+    children: dict[CFGNode, list[CFGNode]]
+    frontiers: dict[CFGNode, set[CFGNode]]
+
+    def dominates(self, a: CFGNode, b: CFGNode) -> bool:
+        while True:
+            if a is b:
+                return True
+            parent = self.idom[b]
+            if parent is b:
+                return False
+            b = parent
+
+
+class Dominators(AnalysisPass):
+    """
+    The dominator tree and dominance frontiers of the reachable nodes,
+    computed with the Cooper-Harvey-Kennedy algorithm.
+    """
+
+    requires = (ReversePostorder, Predecessors)
+
+    @classmethod
+    def analyze(cls, cfg: CFG) -> DominatorTree:
+        nodes = ReversePostorder.get(cfg)
+        predecessors = Predecessors.get(cfg)
+        order = {node: i for i, node in enumerate(nodes)}
+        entry = nodes[0]
+        idom = {entry: entry}
+
+        def intersect(a, b):
+            while a is not b:
+                while order[a] > order[b]:
+                    a = idom[a]
+                while order[b] > order[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for node in nodes[1:]:
+                new_idom = None
+                for pred in predecessors[node]:
+                    if pred not in idom:
+                        continue
+                    new_idom = pred if new_idom is None else intersect(pred, new_idom)
+                if idom.get(node) is not new_idom:
+                    idom[node] = new_idom
+                    changed = True
+
+        children = {node: [] for node in nodes}
+        for node in nodes[1:]:
+            children[idom[node]].append(node)
+
+        frontiers = {node: set() for node in nodes}
+        for node in nodes:
+            if len(predecessors[node]) < 2:
+                continue
+            for pred in predecessors[node]:
+                runner = pred
+                while runner is not idom[node]:
+                    frontiers[runner].add(node)
+                    runner = idom[runner]
+
+        return DominatorTree(idom, children, frontiers)
+
+
+class PostDominators(AnalysisPass):
+    """
+    The immediate post-dominator of every reachable node, or None for nodes only
+    post-dominated by the end of the cfg, including nodes that never reach it.
+    """
+
+    requires = (ReversePostorder, Predecessors)
+
+    @classmethod
+    def analyze(cls, cfg: CFG) -> dict[CFGNode, CFGNode | None]:
+        nodes = ReversePostorder.get(cfg)
+        predecessors = Predecessors.get(cfg)
+        node_order = {node: i for i, node in enumerate(nodes)}
+
+        # The dominators of the reversed cfg, rooted at a virtual node that every
+        # node without successors leads to.
+        root = CFGNode([], None)
+        successors = {
+            node: sorted(
+                {edge.to_node for edge in cfg.edges_by_from[node]},
+                key=node_order.__getitem__,
+            )
+            or [root]
+            for node in nodes
+        }
+        reverse_successors = {
+            root: [node for node in nodes if successors[node] == [root]],
+            **predecessors,
+        }
+
+        postorder = []
+        visited = {root}
+        stack = [(root, iter(reverse_successors[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(reverse_successors[child])))
+                    break
+            else:
+                stack.pop()
+                postorder.append(node)
+        reverse_order = postorder[::-1]
+        order = {node: i for i, node in enumerate(reverse_order)}
+        ipdom = {root: root}
+
+        def intersect(a, b):
+            while a is not b:
+                while order[a] > order[b]:
+                    a = ipdom[a]
+                while order[b] > order[a]:
+                    b = ipdom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for node in reverse_order[1:]:
+                new_ipdom = None
+                for succ in successors[node]:
+                    if succ not in ipdom:
+                        continue
+                    new_ipdom = (
+                        succ if new_ipdom is None else intersect(succ, new_ipdom)
+                    )
+                if ipdom.get(node) is not new_ipdom:
+                    ipdom[node] = new_ipdom
+                    changed = True
+
+        return {
+            node: None if ipdom.get(node, root) is root else ipdom[node]
+            for node in nodes
+        }
+
+
+@dataclass
+class LivenessInfo:
+    live_in: dict[CFGNode, frozenset[TempRef]]
+    live_out: dict[CFGNode, frozenset[TempRef]]
+
+
+class Liveness(AnalysisPass):
+    """
+    The temp refs that may be read before being written at the start and end of
+    every reachable node.
+    Only stores that overwrite the entirety of a temp ref kill it.
+    """
+
+    requires = (ReversePostorder, Predecessors, TempRefSizes)
+
+    @classmethod
+    def analyze(cls, cfg: CFG) -> LivenessInfo:
+        nodes = ReversePostorder.get(cfg)
+        predecessors = Predecessors.get(cfg)
+        sizes = TempRefSizes.get(cfg)
+
+        uses = {}
+        kills = {}
+        for node in nodes:
+            visitor = _UseKillVisitor(sizes)
+            visitor.visit(node)
+            uses[node] = frozenset(visitor.uses)
+            kills[node] = frozenset(visitor.kills)
+
+        live_in = {node: frozenset() for node in nodes}
+        live_out = {node: frozenset() for node in nodes}
+        queue = [*nodes]
+        queued = set(queue)
+        while queue:
+            node = queue.pop()
+            queued.remove(node)
+            out = frozenset().union(
+                *(live_in[edge.to_node] for edge in cfg.edges_by_from[node])
+            )
+            live_out[node] = out
+            new_in = uses[node] | (out - kills[node])
+            if new_in != live_in[node]:
+                live_in[node] = new_in
+                for pred in predecessors[node]:
+                    if pred not in queued:
+                        queued.add(pred)
+                        queue.append(pred)
+        return LivenessInfo(live_in, live_out)
+
+
+class _UseKillVisitor(IRVisitor):
+    def __init__(self, sizes: dict[TempRef, int]):
+        self.sizes = sizes
+        self.uses = set()
+        self.kills = set()
+
+    def visit_IRGet(self, node: IRGet):
+        super().visit_IRGet(node)
+        ref = node.location.ref
+        if isinstance(ref, TempRef) and ref not in self.kills:
+            self.uses.add(ref)
+
+    def visit_IRSet(self, node: IRSet):
+        super().visit_IRSet(node)
+        ref = node.location.ref
+        if isinstance(ref, TempRef) and self.sizes[ref] == 1:
+            self.kills.add(ref)
+
+
+@dataclass
+class Loop:
+    header: CFGNode
+    # The sources of the back edges to the header.
+    latches: list[CFGNode]
+    # Includes the header and the nodes of nested loops.
+    nodes: set[CFGNode]
+
+
+class Loops(AnalysisPass):
+    """
+    The natural loops of the cfg, with inner loops before the loops containing
+    them. Loops with the same header are merged.
+    """
+
+    requires = (ReversePostorder, Predecessors, Dominators)
+
+    @classmethod
+    def analyze(cls, cfg: CFG) -> list[Loop]:
+        nodes = ReversePostorder.get(cfg)
+        predecessors = Predecessors.get(cfg)
+        dominators = Dominators.get(cfg)
+
+        loops = []
+        for header in nodes:
+            latches = [
+                pred
+                for pred in predecessors[header]
+                if dominators.dominates(header, pred)
+            ]
+            if not latches:
+                continue
+            body = {header}
+            queue = [*latches]
+            while queue:
+                node = queue.pop()
+                if node in body:
+                    continue
+                body.add(node)
+                queue.extend(predecessors[node])
+            loops.append(Loop(header, latches, body))
+        # A nested loop has fewer nodes than the loops containing it.
+        loops.sort(key=lambda loop: len(loop.nodes))
+        return loops
@@ -1,16 +1,29 @@
 from sonolus.backend.cfg import CFG
 from sonolus.backend.cfg_traversal import traverse_cfg
 from sonolus.backend.ir import IRSet, IRFunc
+from sonolus.backend.optimization.analyses import (
+    ReversePostorder,
+    Predecessors,
+    Dominators,
+)
 from sonolus.backend.optimization.optimization_pass import OptimizationPass
 
 
 class BasicDeadCodeElimination(OptimizationPass):
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
     def run(self, cfg: CFG):
+        changed = False
         for cfg_node in traverse_cfg(cfg):
-            cfg_node.body = [n for n in cfg_node.body if self.is_effectual(n)]
+            body = [n for n in cfg_node.body if self.is_effectual(n)]
+            if len(body) != len(cfg_node.body):
+                cfg_node.body = body
+                changed = True
             edges = cfg.edges_by_from[cfg_node]
-            if len(edges) == 1 and not cfg_node.is_exit:
+            if len(edges) == 1 and not cfg_node.is_exit and cfg_node.test is not None:
                 cfg_node.test = None
+                changed = True
+        return changed
 
     def is_effectual(self, node):
         match node:
@@ -1,21 +1,32 @@
 from collections import defaultdict
 
 from sonolus.backend.cfg import CFG
-from sonolus.backend.cfg_traversal import traverse_cfg, traverse_postorder
+from sonolus.backend.cfg_traversal import traverse_cfg
 from sonolus.backend.ir import TempRef, IRFunc
 from sonolus.backend.ir_visitor import IRVisitor, IRTransformer
+from sonolus.backend.optimization.analyses import (
+    ReversePostorder,
+    Predecessors,
+    Dominators,
+)
 from sonolus.backend.optimization.basic_dead_code_elimination import EFFECTUAL_FUNCTIONS
 from sonolus.backend.optimization.optimization_pass import OptimizationPass
 
 
 class BasicDeadStoreElimination(OptimizationPass):
+    requires = (ReversePostorder,)
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
     def run(self, cfg: CFG):
         visitor = AccessVisitor()
         for cfg_node in traverse_cfg(cfg):
             visitor.visit(cfg_node)
         transformer = DeadStoreTransformer(visitor.accesses)
-        for cfg_node in [*traverse_postorder(cfg)]:
-            cfg.replace_node(cfg_node, transformer.visit(cfg_node))
+        for cfg_node in reversed(ReversePostorder.get(cfg)):
+            transformed = transformer.visit(cfg_node)
+            cfg_node.body = transformed.body
+            cfg_node.test = transformed.test
+        return transformer.changed
 
 
 class AccessVisitor(IRVisitor):
@@ -34,6 +45,7 @@ class DeadStoreTransformer(IRTransformer):
 
         # We use this to visit pruned nodes, and subtract the access count
         self.visitor = AccessVisitor()
+        self.changed = False
 
     def visit_CFGNode(self, node):
         # We want to visit the body in reverse order
@@ -49,6 +61,7 @@ class DeadStoreTransformer(IRTransformer):
                 - self.visitor.accesses[node.location.ref]
                 == 0
             ):
+                self.changed = True
                 if (
                     isinstance(node.value, IRFunc)
                     and node.value.name in EFFECTUAL_FUNCTIONS
@@ -1,9 +1,13 @@
 from sonolus.backend.cfg import CFG, CFGNode
+from sonolus.backend.optimization.analyses import TempRefSizes
 from sonolus.backend.optimization.optimization_pass import OptimizationPass
 
 
 class CoalesceFlow(OptimizationPass):
+    preserves = (TempRefSizes,)
+
     def run(self, cfg: CFG):
+        changed = False
         queue = [cfg.entry_node]
         visited = set()
         while queue:
@@ -20,16 +24,20 @@ class CoalesceFlow(OptimizationPass):
                 next_node = edge.to_node
                 if next_node == node:
                     continue
-                if len(cfg.edges_by_to[next_node]) != 1:
-                    if not node.body:
+                if next_node.phi:
+                    # Phis refer to their predecessors, so keep them as is.
+                    queue.append(next_node)
+                elif len(cfg.edges_by_to[next_node]) != 1:
+                    if not node.body and not node.phi:
                         cfg.remove_edge(edge)
                         cfg.replace_node(node, next_node)
+                        changed = True
                     queue.append(next_node)
                 else:
                     new_node = CFGNode(
                         node.body + next_node.body,
                         next_node.test,
-                        {},
+                        None,
                         node.phi,
                         node.is_entry,
                         next_node.is_exit,
@@ -38,3 +46,5 @@ class CoalesceFlow(OptimizationPass):
                     cfg.replace_node(node, new_node)
                     cfg.replace_node(next_node, new_node)
                     queue.append(new_node)
+                    changed = True
+        return changed
@@ -1,7 +1,7 @@
 from sonolus.backend.cfg import CFG
 from sonolus.backend.cfg_traversal import traverse_cfg
 from sonolus.backend.ir import IRNode, IRFunc, IRGet, TempRef, IRConst, IRSet, Location
-from sonolus.backend.optimization.get_temp_ref_sizes import get_temp_ref_sizes
+from sonolus.backend.optimization.analyses import TempRefSizes
 from sonolus.backend.optimization.node_functions import constant_functions
 from sonolus.backend.optimization.optimization_pass import OptimizationPass
 
@@ -17,31 +17,60 @@ class _NAC:
 
 
 class ConditionalConstantPropagation(OptimizationPass):
+    requires = (TempRefSizes,)
+
     UNDEF = _UNDEF()
     NAC = _NAC()
 
     def __init__(self):
         super().__init__()
         self.ref_sizes = None
+        self.changed = False
 
     def run(self, cfg: CFG):
-        self.ref_sizes = get_temp_ref_sizes(cfg)
+        lattices_in, _ = self.propagate(cfg)
 
+        # Only rewrites made from here on count as changes.
+        self.changed = False
         for cfg_node in traverse_cfg(cfg):
-            cfg_node.annotations["ccp_lattice_in"] = {}
-            cfg_node.annotations["ccp_lattice_out"] = None
+            lattice = lattices_in[cfg_node]
+            cfg_node.body = [self.visit_ir(n, lattice) for n in cfg_node.body]
+            if cfg_node.test is not None:
+                cfg_node.test = self.visit_ir(cfg_node.test, lattice)
+                test = cfg_node.test.constant()
+                if test is not None:
+                    edges = {
+                        edge.condition: edge for edge in cfg.edges_by_from[cfg_node]
+                    }
+                    key = test if test in edges else None
+                    for k, v in edges.items():
+                        if k != key:
+                            cfg.remove_edge(v)
+                            self.changed = True
+        cfg.remove_dead_nodes()
+        return self.changed
+
+    def propagate(self, cfg: CFG) -> tuple[dict, dict]:
+        """
+        Returns the lattices at the start and end of every node.
+        Nodes that are never reached have a lattice of None at their end.
+        """
+        self.ref_sizes = TempRefSizes.get(cfg)
+
+        lattices_in = {cfg_node: {} for cfg_node in traverse_cfg(cfg)}
+        lattices_out = {cfg_node: None for cfg_node in lattices_in}
 
         queue = [cfg.entry_node]
         while queue:
             cfg_node = queue.pop()
 
-            initial_lattice = cfg_node.annotations["ccp_lattice_in"]
+            initial_lattice = lattices_in[cfg_node]
             lattice = {k: [*v] for k, v in initial_lattice.items()}
             for n in cfg_node.body:
                 self.visit_ir(n, lattice)
 
-            if lattice != cfg_node.annotations["ccp_lattice_out"]:
-                cfg_node.annotations["ccp_lattice_out"] = lattice
+            if lattice != lattices_out[cfg_node]:
+                lattices_out[cfg_node] = lattice
             else:
                 continue
 
@@ -53,33 +82,16 @@ class ConditionalConstantPropagation(OptimizationPass):
                 edges = {edge.condition: edge for edge in cfg.edges_by_from[cfg_node]}
                 edge = edges.get(test) or edges[None]
                 queue.append(edge.to_node)
-                edge.to_node.annotations["ccp_lattice_in"] = self.meet_latices(
-                    [lattice, edge.to_node.annotations["ccp_lattice_in"]]
+                lattices_in[edge.to_node] = self.meet_latices(
+                    [lattice, lattices_in[edge.to_node]]
                 )
             else:
                 for edge in cfg.edges_by_from[cfg_node]:
                     queue.append(edge.to_node)
-                    edge.to_node.annotations["ccp_lattice_in"] = self.meet_latices(
-                        [lattice, edge.to_node.annotations["ccp_lattice_in"]]
+                    lattices_in[edge.to_node] = self.meet_latices(
+                        [lattice, lattices_in[edge.to_node]]
                     )
-
-        for cfg_node in traverse_cfg(cfg):
-            lattice = cfg_node.annotations["ccp_lattice_in"]
-            cfg_node.body = [self.visit_ir(n, lattice) for n in cfg_node.body]
-            if cfg_node.test is not None:
-                cfg_node.test = self.visit_ir(cfg_node.test, lattice)
-                test = cfg_node.test.constant()
-                if test is not None:
-                    edges = {
-                        edge.condition: edge for edge in cfg.edges_by_from[cfg_node]
-                    }
-                    key = test if test in edges else None
-                    for k, v in edges.items():
-                        if k != key:
-                            cfg.remove_edge(v)
-            cfg_node.annotations.pop("ccp_lattice_in")
-            cfg_node.annotations.pop("ccp_lattice_out")
-        cfg.remove_dead_nodes()
+        return lattices_in, lattices_out
 
     def visit_ir(self, node: IRNode, lattice: dict):
         match node:
@@ -89,12 +101,14 @@ class ConditionalConstantPropagation(OptimizationPass):
                     # Useful special case
                     const_args = [arg.constant() for arg in args]
                     if any(arg == 0 for arg in const_args):
-                        return IRConst(0)
+                        self.changed = True
+                        return IRConst.of(0)
                 if node.name in constant_functions:
                     const_args = [arg.constant() for arg in args]
                     if all(arg is not None for arg in const_args):
-                        return IRConst(constant_functions[node.name](*const_args))
-                return IRFunc(node.name, args)
+                        self.changed = True
+                        return IRConst.of(constant_functions[node.name](*const_args))
+                return IRFunc.of(node.name, args)
             case IRGet() as node:
                 loc = node.location
                 values = self.get_ref_values(lattice, loc.ref)
@@ -108,8 +122,13 @@ class ConditionalConstantPropagation(OptimizationPass):
                     offset = int(offset)
                     value = values[int(offset + loc.base)]
                     if isinstance(value, (int, float)):
-                        return IRConst(value)
-                    return IRGet(Location(loc.ref, IRConst(0), loc.base + offset, 1))
+                        self.changed = True
+                        return IRConst.of(value)
+                    if not self.is_scalar_location(loc):
+                        self.changed = True
+                    return IRGet.of(
+                        Location(loc.ref, IRConst.of(0), loc.base + offset, 1)
+                    )
                 return node
             case IRSet() as node:
                 loc = node.location
@@ -124,8 +143,11 @@ class ConditionalConstantPropagation(OptimizationPass):
                         offset = int(offset)
                         index = offset + loc.base
                         values[index] = const_value
+                        if not self.is_scalar_location(loc):
+                            self.changed = True
                         return IRSet(
-                            Location(loc.ref, IRConst(0), loc.base + offset, 1), value
+                            Location(loc.ref, IRConst.of(0), loc.base + offset, 1),
+                            value,
                         )
                     else:
                         for i in range(loc.base, loc.base + loc.span):
@@ -136,6 +158,9 @@ class ConditionalConstantPropagation(OptimizationPass):
             case _:
                 return node
 
+    def is_scalar_location(self, loc: Location):
+        return loc.span == 1 and loc.offset.constant() == 0
+
     def get_ref_values(self, lattice: dict, ref):
         if not isinstance(ref, TempRef):
             return None
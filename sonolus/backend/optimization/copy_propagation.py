@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from sonolus.backend.cfg import CFG, CFGNode
+from sonolus.backend.ir import IRGet, IRSet, Location, TempRef
+from sonolus.backend.ir_visitor import IRTransformer
+from sonolus.backend.optimization.analyses import (
+    Dominators,
+    Predecessors,
+    ReversePostorder,
+    TempRefSizes,
+)
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+
+
+class CopyPropagation(OptimizationPass):
+    """
+    Replaces reads of scalar temp refs that hold a copy of another scalar temp ref
+    with reads of the source, as long as neither is written in between.
+
+    Copies are tracked with an available copies analysis, so a copy is only
+    propagated if it is made on every path to the read.
+    The copies themselves are left to dead store elimination.
+    """
+
+    requires = (ReversePostorder, Predecessors, TempRefSizes)
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
+    def run(self, cfg: CFG):
+        nodes = ReversePostorder.get(cfg)
+        predecessors = Predecessors.get(cfg)
+        scalars = {ref for ref, size in TempRefSizes.get(cfg).items() if size == 1}
+
+        # Nodes not yet visited have no entry and are ignored in the meet.
+        copies_out = {}
+        changed = True
+        while changed:
+            changed = False
+            for node in nodes:
+                copies = _meet(
+                    [
+                        copies_out[pred]
+                        for pred in predecessors[node]
+                        if pred in copies_out
+                    ]
+                )
+                for statement in node.body:
+                    _apply_statement(statement, copies, scalars)
+                if copies_out.get(node) != copies:
+                    copies_out[node] = copies
+                    changed = True
+
+        transformer = _CopyTransformer(scalars)
+        for node in nodes:
+            self.rewrite_node(node, predecessors, copies_out, transformer)
+        return transformer.changed
+
+    def rewrite_node(
+        self,
+        node: CFGNode,
+        predecessors: dict[CFGNode, list[CFGNode]],
+        copies_out: dict[CFGNode, dict[TempRef, TempRef]],
+        transformer: _CopyTransformer,
+    ):
+        transformer.copies = _meet([copies_out[pred] for pred in predecessors[node]])
+        body = []
+        for statement in node.body:
+            statement = transformer.visit(statement)
+            _apply_statement(statement, transformer.copies, transformer.scalars)
+            body.append(statement)
+        node.body = body
+        if node.test is not None:
+            node.test = transformer.visit(node.test)
+
+
+def _meet(copies: list[dict[TempRef, TempRef]]) -> dict[TempRef, TempRef]:
+    if not copies:
+        return {}
+    first, *rest = copies
+    return {
+        target: source
+        for target, source in first.items()
+        if all(other.get(target) == source for other in rest)
+    }
+
+
+def _apply_statement(statement, copies: dict[TempRef, TempRef], scalars: set):
+    if not isinstance(statement, IRSet):
+        return
+    target = statement.location.ref
+    if target not in scalars:
+        return
+    for other, source in [*copies.items()]:
+        if other == target or source == target:
+            del copies[other]
+    value = statement.value
+    if isinstance(value, IRGet):
+        source = value.location.ref
+        if source in scalars and source != target:
+            # Chains of copies are collapsed to the original source.
+            copies[target] = copies.get(source, source)
+
+
+class _CopyTransformer(IRTransformer):
+    def __init__(self, scalars: set[TempRef]):
+        self.scalars = scalars
+        self.copies = {}
+        self.changed = False
+
+    def visit_IRGet(self, node):
+        source = self.copies.get(node.location.ref)
+        if source is not None:
+            self.changed = True
+            return IRGet.of(Location(source, node.location.offset, 0, 1))
+        return super().visit_IRGet(node)
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from sonolus.backend.cfg import CFG, CFGNode
+from sonolus.backend.ir import IRFunc, IRSet, TempRef
+from sonolus.backend.ir_visitor import get_read_temp_refs
+from sonolus.backend.optimization.analyses import (
+    Dominators,
+    Liveness,
+    Predecessors,
+    ReversePostorder,
+    TempRefSizes,
+)
+from sonolus.backend.optimization.basic_dead_code_elimination import EFFECTUAL_FUNCTIONS
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+
+
+class DeadStoreElimination(OptimizationPass):
+    """
+    Removes stores to temp refs that are not read on any path before being
+    overwritten or the end of the cfg, using liveness.
+
+    Only stores to scalar temp refs overwrite them, so a store to a larger temp
+    ref is only removed if the temp ref is never read again.
+    Values with side effects are kept as statements.
+    """
+
+    requires = (ReversePostorder, Predecessors, TempRefSizes, Liveness)
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
+    def run(self, cfg: CFG):
+        nodes = ReversePostorder.get(cfg)
+        sizes = TempRefSizes.get(cfg)
+        live_out = Liveness.get(cfg).live_out
+        changed = False
+        while True:
+            removed = False
+            for node in nodes:
+                removed |= self.sweep(node, set(live_out[node]), sizes)
+            if not removed:
+                return changed
+            changed = True
+            # Removed stores may have been the only reads of other temp refs.
+            live_out = Liveness.analyze(cfg).live_out
+
+    def sweep(self, node: CFGNode, live: set[TempRef], sizes: dict[TempRef, int]):
+        removed = False
+        if node.test is not None:
+            live |= get_read_temp_refs(node.test)
+        body = []
+        for statement in reversed(node.body):
+            match statement:
+                case IRSet(location, value) if isinstance(location.ref, TempRef):
+                    ref = location.ref
+                    if ref not in live:
+                        removed = True
+                        if (
+                            isinstance(value, IRFunc)
+                            and value.name in EFFECTUAL_FUNCTIONS
+                        ):
+                            body.append(value)
+                            live |= get_read_temp_refs(value)
+                        continue
+                    if sizes[ref] == 1:
+                        live.discard(ref)
+            body.append(statement)
+            live |= get_read_temp_refs(statement)
+        if removed:
+            node.body = body[::-1]
+        return removed
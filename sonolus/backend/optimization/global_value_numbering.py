@@ -0,0 +1,424 @@
+from __future__ import annotations
+
+from sonolus.backend.cfg import CFG, CFGNode
+from sonolus.backend.ir import (
+    MEMORY_BLOCK_ALIASES,
+    IRConst,
+    IRFunc,
+    IRGet,
+    IRNode,
+    IRSet,
+    Location,
+    MemoryBlock,
+    SSARef,
+    TempRef,
+)
+from sonolus.backend.ir_visitor import StructuralKeys
+from sonolus.backend.optimization.analyses import (
+    Dominators,
+    Predecessors,
+    ReversePostorder,
+    TempRefSizes,
+)
+from sonolus.backend.optimization.node_functions import constant_functions
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+
+# Functions that only evaluate their first argument unconditionally.
+LAZY_FUNCTIONS = {"If", "And", "Or"}
+
+# Functions that write to memory other than through a Set.
+MEMORY_WRITING_FUNCTIONS = {
+    "Spawn": (
+        MemoryBlock.ENTITY_INFO_ARRAY,
+        MemoryBlock.ENTITY_DATA_ARRAY,
+        MemoryBlock.ENTITY_SHARED_MEMORY_ARRAY,
+    ),
+}
+
+
+class GlobalValueNumbering(OptimizationPass):
+    """
+    Reuses the values of repeated pure expressions.
+
+    The first evaluation of an expression is stored in a new temp ref, and later
+    evaluations it dominates read the temp ref instead. Expressions reading memory
+    that is written anywhere in the cfg are only reused within a node and the nodes
+    only reached from it, up to the next write that may alias what they read.
+    An expression is only stored if it is reused often enough to be worth it.
+    In SSA form (see ToSSA), values assigned to SSA refs are read back from the
+    SSA ref itself rather than stored in a new temp ref, since it is never
+    reassigned.
+    """
+
+    requires = (ReversePostorder, Predecessors, Dominators, TempRefSizes)
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
+    def run(self, cfg: CFG):
+        nodes = ReversePostorder.get(cfg)
+        children = Dominators.get(cfg).children
+        predecessors = Predecessors.get(cfg)
+        numbering = ValueNumbering(nodes, writable_blocks(cfg))
+
+        # The first walk counts how often the value computed at each site would be
+        # reused, and the second walk only stores the values worth storing.
+        counter = _ValueReuser(numbering)
+        counter.walk(nodes[0], children, predecessors)
+        sites = {
+            site
+            for site, reuses in counter.reuses.items()
+            if (numbering.costs[site[-1]] - 1) * reuses >= 2
+        }
+        if not sites:
+            return False
+
+        rewriter = _ValueReuser(numbering, sites, {*TempRefSizes.get(cfg)})
+        rewriter.walk(nodes[0], children, predecessors)
+        return rewriter.changed
+
+
+class ValueNumbering:
+    """
+    Numbers pure expressions such that equal numbers mean equal values.
+
+    A value is invariant if none of the given nodes may write to what it reads.
+    Writes to computed refs are assumed to only write the given writable blocks.
+    """
+
+    def __init__(
+        self, nodes: list[CFGNode], writable_blocks: set[MemoryBlock] | None = None
+    ):
+        self.numbers = {}
+        # Numbers by the structural key of the numbered value.
+        self.keys = StructuralKeys()
+        self.table = {}
+        self.costs = []
+        self.deps = []
+        self.is_invariant = []
+        # Whether the value reads memory at a computed offset,
+        # which may be out of bounds where the value isn't normally evaluated.
+        self.is_dynamic = []
+        # Numbers are memoized by id, so numbered nodes are kept alive.
+        self.numbered = []
+
+        self.writes = Writes(writable_blocks)
+        for node in nodes:
+            for statement in node.body:
+                self.writes.add(statement)
+
+    def number(self, node: IRNode) -> int | None:
+        key = id(node)
+        if key in self.numbers:
+            return self.numbers[key]
+        self.numbered.append(node)
+        match node:
+            case IRConst():
+                result = self.get_number(node, 0, frozenset(), False)
+            case IRGet(Location(ref, offset, base)) if not isinstance(ref, IRNode):
+                offset_number = self.number(offset)
+                if offset_number is None:
+                    result = None
+                else:
+                    index = offset.constant()
+                    if index is not None:
+                        index = int(index + base)
+                    result = self.get_number(
+                        node,
+                        self.costs[offset_number] + 1,
+                        self.deps[offset_number] | {(ref, index)},
+                        self.costs[offset_number] > 0,
+                    )
+            case IRFunc(name, args) if name in constant_functions:
+                arg_numbers = [self.number(arg) for arg in args]
+                if None in arg_numbers:
+                    result = None
+                else:
+                    result = self.get_number(
+                        node,
+                        sum(self.costs[n] for n in arg_numbers) + 1,
+                        frozenset().union(*(self.deps[n] for n in arg_numbers)),
+                        any(self.is_dynamic[n] for n in arg_numbers),
+                    )
+            case _:
+                result = None
+        self.numbers[key] = result
+        return result
+
+    def get_number(
+        self, node: IRNode, cost: int, deps: frozenset, is_dynamic: bool
+    ) -> int:
+        key = self.keys.get(node)
+        number = self.table.get(key)
+        if number is None:
+            number = len(self.costs)
+            self.table[key] = number
+            self.costs.append(cost)
+            self.deps.append(deps)
+            self.is_invariant.append(
+                not any(self.writes.may_write(*dep) for dep in deps)
+            )
+            self.is_dynamic.append(is_dynamic)
+        return number
+
+    def is_candidate(self, number: int | None) -> bool:
+        # Reading a temp ref is never cheaper than a single function or get.
+        return number is not None and self.costs[number] >= 2
+
+
+class _ValueReuser:
+    """
+    Walks the dominator tree, keeping track of the values available at each point.
+
+    Without sites, every first evaluation of an expression makes its value
+    available, and reuses of it are counted by site. Otherwise, only the values of
+    the given sites are made available, by storing them in new temp refs, and
+    reuses are rewritten to read them.
+    """
+
+    def __init__(
+        self,
+        numbering: ValueNumbering,
+        sites: set[tuple] | None = None,
+        temp_refs: set[TempRef] | None = None,
+    ):
+        self.numbering = numbering
+        self.sites = sites
+        self.temp_refs = temp_refs
+        self.reuses = {}
+        self.changed = False
+        self.global_values = {}
+        self.local_values = {}
+        # The values made globally available by each node on the current
+        # dominator tree path.
+        self.scopes = []
+        self.site = None
+        self.hoisted = []
+        self.temp_count = 0
+
+    def walk(
+        self,
+        entry: CFGNode,
+        children: dict[CFGNode, list[CFGNode]],
+        predecessors: dict[CFGNode, list[CFGNode]],
+    ):
+        stack = [(entry, {})]
+        while stack:
+            node, local_values = stack.pop()
+            if node is None:
+                for number in self.scopes.pop():
+                    del self.global_values[number]
+                continue
+            self.scopes.append([])
+            self.local_values = local_values
+            self.visit_node(node)
+            stack.append((None, None))
+            # A node only reached from its parent sees the values at the end of it.
+            stack.extend(
+                (child, {**self.local_values} if predecessors[child] == [node] else {})
+                for child in reversed(children[node])
+            )
+
+    def visit_node(self, node: CFGNode):
+        body = []
+        for index, statement in enumerate(node.body):
+            self.site = (node, index)
+            self.hoisted = []
+            statement = self.visit_statement(statement)
+            body.extend(self.hoisted)
+            body.append(statement)
+            self.kill(statement)
+        test = node.test
+        if test is not None:
+            self.site = (node, len(node.body))
+            self.hoisted = []
+            test = self.visit_value(test)
+            body.extend(self.hoisted)
+        if self.sites is not None:
+            node.body = body
+            node.test = test
+
+    def visit_statement(self, statement: IRNode) -> IRNode:
+        match statement:
+            case IRSet(Location(SSARef() as ref, offset, base, span), value):
+                # Values assigned to ssa refs can be read from the ssa ref itself.
+                number = self.numbering.number(value)
+                if self.numbering.is_candidate(number) and self.lookup(number) is None:
+                    value = self.visit_args(value, True)
+                    holder = IRGet.of(statement.location)
+                    self.define(number, value, holder)
+                else:
+                    value = self.visit_value(value)
+                location = Location(ref, self.visit_value(offset), base, span)
+                if location.offset is offset and value is statement.value:
+                    return statement
+                return IRSet(location, value)
+            case IRSet(location, value):
+                value = self.visit_value(value)
+                offset = self.visit_value(location.offset)
+                if offset is location.offset and value is statement.value:
+                    return statement
+                return IRSet(
+                    Location(location.ref, offset, location.base, location.span),
+                    value,
+                )
+            case _:
+                return self.visit_value(statement)
+
+    def visit_value(self, value: IRNode, eager: bool = True) -> IRNode:
+        number = self.numbering.number(value)
+        if not self.numbering.is_candidate(number):
+            return self.visit_args(value, eager)
+        available = self.lookup(number)
+        if available is not None:
+            if self.sites is None:
+                self.reuses[available] += 1
+                return value
+            self.changed = True
+            return available
+        value = self.visit_args(value, eager)
+        if eager:
+            # Lazily evaluated values may not be evaluated at all,
+            # so they can't be reused.
+            value = self.define(number, value)
+        return value
+
+    def visit_args(self, value: IRNode, eager: bool) -> IRNode:
+        match value:
+            case IRFunc(name, args):
+                new_args = [
+                    self.visit_value(
+                        arg, eager and (i == 0 or name not in LAZY_FUNCTIONS)
+                    )
+                    for i, arg in enumerate(args)
+                ]
+                if all(arg is old_arg for arg, old_arg in zip(new_args, args)):
+                    return value
+                return IRFunc.of(name, new_args)
+            case IRGet(location):
+                offset = self.visit_value(location.offset, eager)
+                if offset is location.offset:
+                    return value
+                return IRGet.of(
+                    Location(location.ref, offset, location.base, location.span)
+                )
+            case _:
+                return value
+
+    def lookup(self, number: int):
+        available = self.local_values.get(number)
+        if available is None:
+            available = self.global_values.get(number)
+        return available
+
+    def define(self, number: int, value: IRNode, holder: IRGet | None = None):
+        site = (*self.site, number)
+        if self.sites is None:
+            self.reuses[site] = 0
+            self.make_available(number, site)
+            return value
+        if holder is not None:
+            self.make_available(number, holder)
+            return value
+        if site not in self.sites:
+            return value
+        holder = IRGet.of(_scalar_location(self.new_temp_ref()))
+        self.hoisted.append(IRSet(holder.location, value))
+        self.changed = True
+        self.make_available(number, holder)
+        return holder
+
+    def make_available(self, number: int, holder):
+        if self.numbering.is_invariant[number]:
+            self.global_values[number] = holder
+            self.scopes[-1].append(number)
+        else:
+            self.local_values[number] = holder
+
+    def kill(self, statement: IRNode):
+        writes = Writes(self.numbering.writes.writable_blocks)
+        writes.add(statement)
+        if not writes:
+            return
+        self.local_values = {
+            number: holder
+            for number, holder in self.local_values.items()
+            if not any(writes.may_write(*dep) for dep in self.numbering.deps[number])
+        }
+
+    def new_temp_ref(self) -> TempRef:
+        while True:
+            ref = TempRef(f"gvn${self.temp_count}")
+            self.temp_count += 1
+            if ref not in self.temp_refs:
+                self.temp_refs.add(ref)
+                return ref
+
+
+class Writes:
+    """
+    The memory that may be written by some statements.
+
+    Statements writing to a computed ref may write any of the writable blocks,
+    or any block if they aren't known.
+    """
+
+    def __init__(self, writable_blocks: set[MemoryBlock] | None = None):
+        self.writable_blocks = writable_blocks
+        # The written indexes of each ref, or None if any index may be written.
+        self.indexes: dict[object, set[int] | None] = {}
+        self.all_memory = False
+
+    def __bool__(self):
+        return bool(self.indexes) or self.all_memory
+
+    def add(self, statement: IRNode):
+        match statement:
+            case IRSet(Location(ref, offset, base)):
+                if isinstance(ref, IRNode):
+                    self.all_memory = True
+                    return
+                index = offset.constant()
+                if index is None:
+                    self.indexes[ref] = None
+                else:
+                    indexes = self.indexes.setdefault(ref, set())
+                    if indexes is not None:
+                        indexes.add(int(index + base))
+            case IRFunc(name) if name in MEMORY_WRITING_FUNCTIONS:
+                for block in MEMORY_WRITING_FUNCTIONS[name]:
+                    self.indexes[block] = None
+
+    def may_write(self, ref, index: int | None) -> bool:
+        """Returns whether the given index of a ref, if known, may be written."""
+        if isinstance(ref, SSARef):
+            return False
+        if isinstance(ref, int):
+            if self.all_memory and self.is_writable(ref):
+                return True
+            # Aliased blocks index the same memory differently.
+            if any(
+                block != ref and block in self.indexes
+                for block in MEMORY_BLOCK_ALIASES.get(ref, ())
+            ):
+                return True
+        if ref not in self.indexes:
+            return False
+        indexes = self.indexes[ref]
+        return indexes is None or index is None or index in indexes
+
+    def is_writable(self, block: int) -> bool:
+        if self.writable_blocks is None:
+            return True
+        # Writing an aliased block writes the block as well.
+        aliases = MEMORY_BLOCK_ALIASES.get(block, {block})
+        return any(alias in self.writable_blocks for alias in aliases)
+
+
+def writable_blocks(cfg: CFG) -> set[MemoryBlock] | None:
+    """The blocks the callback of a cfg may write, or None if it isn't known."""
+    if cfg.callback is None:
+        return None
+    return cfg.callback.writable_blocks
+
+
+def _scalar_location(ref: TempRef) -> Location:
+    return Location(ref, IRConst.of(0), 0, 1)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from sonolus.backend.cfg import CFG, CFGEdge, CFGNode
+from sonolus.backend.ir import IRFunc, IRGet, IRNode, IRSet, Location, TempRef
+from sonolus.backend.ir_visitor import get_read_refs
+from sonolus.backend.optimization.analyses import Predecessors, ReversePostorder
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+from sonolus.backend.optimization.peephole import PeepholeTransformer
+from sonolus.backend.optimization.strength_reduction import (
+    STRENGTH_REDUCTION_RULES,
+    get_cost,
+    is_pure,
+)
+
+
+class IfConversion(OptimizationPass):
+    """
+    Replaces branches that only assign pure values, such as `x = a if c else b`,
+    with unconditional assignments of If(c, a, b), which are further reduced to
+    Min or Max where the condition compares the two values.
+
+    Both diamonds, where each branch assigns values, and triangles, where only one
+    does, are converted. A location assigned by only one branch is assigned its
+    own value by the other, so this is only done for temp refs.
+    Branches are only converted if the assignments cost at most max_cost by
+    FUNCTION_COSTS.
+    """
+
+    requires = (ReversePostorder, Predecessors)
+    settings = ("max_cost",)
+
+    def __init__(self, max_cost: int = 16):
+        super().__init__()
+        self.max_cost = max_cost
+
+    def run(self, cfg: CFG):
+        # Copied, since it is updated as branches are converted.
+        predecessors = {**Predecessors.get(cfg)}
+        changed = False
+        for head in ReversePostorder.get(cfg):
+            # Arms of converted branches are unreachable, so they are skipped.
+            if head in predecessors:
+                changed |= self.convert(cfg, head, predecessors)
+        if changed:
+            cfg.remove_dead_nodes()
+        return changed
+
+    def convert(
+        self,
+        cfg: CFG,
+        head: CFGNode,
+        predecessors: dict[CFGNode, list[CFGNode]],
+    ) -> bool:
+        edges = {edge.condition: edge.to_node for edge in cfg.edges_by_from[head]}
+        if edges.keys() != {None, 0} or head.test is None:
+            return False
+        true_node, false_node = edges[None], edges[0]
+        true_join = _get_arm_join(cfg, true_node, head, predecessors)
+        false_join = _get_arm_join(cfg, false_node, head, predecessors)
+        if true_join is not None and true_join is false_join:
+            join, arms = true_join, (true_node, false_node)
+        elif true_join is false_node:
+            join, arms = false_node, (true_node, None)
+        elif false_join is true_node:
+            join, arms = true_node, (None, false_node)
+        else:
+            return False
+        if join.phi:
+            return False
+
+        assignments = [_get_assignments(arm) for arm in arms]
+        if None in assignments:
+            return False
+        true_values, false_values = assignments
+        locations = {**true_values, **false_values}
+        if not locations:
+            return False
+
+        condition = _get_condition(head)
+        if not is_pure(condition):
+            return False
+        if len(locations) > 1:
+            # The condition is read from where the head stores it rather than
+            # evaluated again for every location.
+            condition = head.test
+            # Each assignment is evaluated after the previous ones,
+            # so none may read what another writes.
+            written = {key[0] for key in locations}
+            values = [
+                value for _, value in [*true_values.values(), *false_values.values()]
+            ]
+            if any(get_read_refs(value) & written for value in [condition, *values]):
+                return False
+
+        reducer = PeepholeTransformer(STRENGTH_REDUCTION_RULES)
+        body = []
+        for key, (location, _) in locations.items():
+            if key not in true_values or key not in false_values:
+                if not isinstance(location.ref, TempRef):
+                    return False
+            current = IRGet.of(location)
+            value = IRFunc.of(
+                "If",
+                [
+                    condition,
+                    true_values.get(key, (None, current))[1],
+                    false_values.get(key, (None, current))[1],
+                ],
+            )
+            body.append(IRSet(location, reducer.visit(value)))
+        if sum(get_cost(statement.value) for statement in body) > self.max_cost:
+            return False
+
+        head.body = [*head.body, *body]
+        head.test = None
+        cfg.clear_from_edges(head)
+        cfg.add_edge(CFGEdge(head, join))
+        # Keep the predecessors exact for the heads converted after this one.
+        for arm in arms:
+            if arm is not None:
+                del predecessors[arm]
+        join_predecessors = [node for node in predecessors[join] if node not in arms]
+        if head not in join_predecessors:
+            join_predecessors.append(head)
+        predecessors[join] = join_predecessors
+        return True
+
+
+def _get_arm_join(
+    cfg: CFG,
+    node: CFGNode,
+    head: CFGNode,
+    predecessors: dict[CFGNode, list[CFGNode]],
+) -> CFGNode | None:
+    """Returns the node a branch of the head always continues to, if any."""
+    if predecessors[node] != [head] or node.phi or node.is_exit:
+        return None
+    match [*cfg.edges_by_from[node]]:
+        case [CFGEdge(to_node=to_node, condition=None)] if to_node is not node:
+            return to_node
+    return None
+
+
+def _get_assignments(node: CFGNode | None) -> dict[tuple, tuple] | None:
+    """
+    Returns the locations assigned by a node and the values assigned, by the
+    ref and index of each location, or None if the node does anything else.
+    """
+    if node is None:
+        return {}
+    assignments = {}
+    for statement in node.body:
+        match statement:
+            case IRSet(Location(ref, offset, base) as location, value) if (
+                not isinstance(ref, IRNode)
+                and offset.constant() is not None
+                and is_pure(value)
+            ):
+                key = (ref, int(offset.constant() + base))
+                if key in assignments:
+                    return None
+                assignments[key] = (location, value)
+            case _:
+                return None
+    return assignments
+
+
+def _get_condition(head: CFGNode) -> IRNode:
+    """
+    Returns the test of the head, or the value it reads from a temp ref assigned
+    by the last statement of the head.
+    """
+    test = head.test
+    match test:
+        case IRGet(Location(TempRef() as ref, offset, base, 1)) if head.body:
+            match head.body[-1]:
+                case IRSet(Location(last_ref, last_offset, last_base, 1), value) if (
+                    last_ref == ref
+                    and offset.constant() is not None
+                    and last_offset.constant() is not None
+                    and offset.constant() + base == last_offset.constant() + last_base
+                    and ref not in get_read_refs(value)
+                ):
+                    return value
+    return test
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import math
+
+from sonolus.backend.cfg import CFG, CFGEdge, CFGNode
+from sonolus.backend.ir import IRFunc, IRGet, IRSet, TempRef
+from sonolus.backend.optimization.analyses import (
+    Liveness,
+    Predecessors,
+    ReversePostorder,
+)
+from sonolus.backend.optimization.global_value_numbering import (
+    ValueNumbering,
+    writable_blocks,
+)
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+
+
+class IfToSwitch(OptimizationPass):
+    """
+    Merges chains of branches comparing the same pure value to different
+    constants, such as an if-elif chain over an archetype or judgment,
+    into a single multi-way branch on the value.
+
+    A branch is only merged into the chain if it does nothing but the comparison
+    and is only reached from the previous branch of the chain.
+    """
+
+    requires = (ReversePostorder, Predecessors, Liveness)
+    settings = ("min_cases",)
+
+    def __init__(self, min_cases: int = 2):
+        super().__init__()
+        self.min_cases = min_cases
+
+    def run(self, cfg: CFG):
+        nodes = ReversePostorder.get(cfg)
+        predecessors = Predecessors.get(cfg)
+        live_out = Liveness.get(cfg).live_out
+        numbering = ValueNumbering(nodes, writable_blocks(cfg))
+
+        changed = False
+        merged = set()
+        for head in nodes:
+            if head in merged:
+                continue
+            comparison = _get_comparison(cfg, head, numbering)
+            if comparison is None:
+                continue
+            value, number, constant, temp, target, default = comparison
+            if temp is not None and temp in _read_refs(numbering, number):
+                continue
+            cases = {constant: target}
+            temps = {temp}
+            chain = []
+            node = default
+            while (
+                len(predecessors[node]) == 1
+                and not node.phi
+                and node is not head
+                and node not in chain
+            ):
+                comparison = _get_comparison(cfg, node, numbering)
+                if comparison is None or comparison[1] != number:
+                    break
+                _, _, constant, temp, target, next_default = comparison
+                # The comparison is skipped, so its result must not be needed.
+                if len(node.body) != (temp is not None) or temp in live_out[node]:
+                    break
+                temps.add(temp)
+                if temps & _read_refs(numbering, number):
+                    break
+                # Later comparisons with the same constant are never true.
+                cases.setdefault(constant, target)
+                chain.append(node)
+                default = next_default
+                node = default
+            if len(cases) < self.min_cases:
+                continue
+            if any(target.phi for target in [*cases.values(), default]):
+                continue
+
+            for edge in [*cfg.edges_by_from[head]]:
+                cfg.remove_edge(edge)
+            for constant, target in cases.items():
+                cfg.add_edge(CFGEdge(head, target, constant))
+            cfg.add_edge(CFGEdge(head, default))
+            head.test = value
+            merged.update(chain)
+            changed = True
+
+        if changed:
+            cfg.remove_dead_nodes()
+        return changed
+
+
+def _get_comparison(cfg: CFG, node: CFGNode, numbering: ValueNumbering):
+    """
+    Returns the pure value a node compares to a constant, its value number,
+    the constant, the temp ref holding the result of the comparison if any,
+    and the targets taken when the comparison is true and false.
+    """
+    edges = {edge.condition: edge.to_node for edge in cfg.edges_by_from[node]}
+    if edges.keys() != {None, 0}:
+        return None
+    test = node.test
+    temp = None
+    match test:
+        case IRGet(location) if (
+            isinstance(location.ref, TempRef)
+            and location.span == 1
+            and node.body
+            and isinstance(node.body[-1], IRSet)
+            and node.body[-1].location.ref == location.ref
+            and node.body[-1].location.offset == location.offset
+            and node.body[-1].location.base == location.base
+            and node.body[-1].location.span == 1
+        ):
+            temp = location.ref
+            test = node.body[-1].value
+    match test:
+        case IRFunc("Equal", [a, b]):
+            pass
+        case _:
+            return None
+    if b.constant() is None:
+        a, b = b, a
+    constant = b.constant()
+    if constant is None or math.isnan(constant):
+        return None
+    number = numbering.number(a)
+    if number is None:
+        return None
+    return a, number, constant, temp, edges[None], edges[0]
+
+
+def _read_refs(numbering: ValueNumbering, number: int) -> set:
+    return {ref for ref, _ in numbering.deps[number]}
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+from sonolus.backend.cfg import CFG, CFGEdge, CFGNode
+from sonolus.backend.ir import (
+    IRConst,
+    IRFunc,
+    IRGet,
+    IRNode,
+    IRSet,
+    Location,
+    MemoryBlock,
+    TempRef,
+)
+from sonolus.backend.optimization.analyses import (
+    Loop,
+    Loops,
+    ReversePostorder,
+    TempRefSizes,
+)
+from sonolus.backend.optimization.global_value_numbering import (
+    LAZY_FUNCTIONS,
+    ValueNumbering,
+    writable_blocks,
+)
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+
+
+class LoopInvariantCodeMotion(OptimizationPass):
+    """
+    Moves pure expressions whose value doesn't change within a loop into a new
+    node before the loop, storing their values in new temp refs.
+
+    Pure functions have no side effects, so invariant expressions may be evaluated
+    before the loop even if the loop wouldn't evaluate them. The exception is
+    reading memory at a computed offset, which is only moved out of the header,
+    since the header is evaluated whenever the loop is entered.
+    Inner loops are handled first, so an expression invariant in several nested
+    loops is moved out of all of them.
+    """
+
+    requires = (ReversePostorder, Loops, TempRefSizes)
+
+    def run(self, cfg: CFG):
+        order = ReversePostorder.get(cfg)
+        loops = Loops.get(cfg)
+        loop_nodes = [[node for node in order if node in loop.nodes] for loop in loops]
+        temp_refs = {*TempRefSizes.get(cfg)}
+        changed = False
+        for i, loop in enumerate(loops):
+            if loop.header.phi:
+                continue
+            hoister = _InvariantHoister(
+                loop, loop_nodes[i], temp_refs, writable_blocks(cfg)
+            )
+            for node in loop_nodes[i]:
+                hoister.hoist_node(node)
+            if not hoister.hoisted:
+                continue
+            preheader = self.add_preheader(cfg, loop, hoister.hoisted)
+            # The preheader is part of the loops containing this one.
+            for j in range(i + 1, len(loops)):
+                if loop.header in loops[j].nodes:
+                    loop_nodes[j].append(preheader)
+            changed = True
+        return changed
+
+    def add_preheader(self, cfg: CFG, loop: Loop, body: list[IRSet]) -> CFGNode:
+        header = loop.header
+        preheader = CFGNode(body, None)
+        for edge in sorted(cfg.edges_by_to[header]):
+            if edge.from_node not in loop.nodes:
+                cfg.remove_edge(edge)
+                cfg.add_edge(CFGEdge(edge.from_node, preheader, edge.condition))
+        cfg.add_edge(CFGEdge(preheader, header))
+        if header is cfg.entry_node:
+            header.is_entry = False
+            preheader.is_entry = True
+            cfg.entry_node = preheader
+        return preheader
+
+
+class _InvariantHoister:
+    def __init__(
+        self,
+        loop: Loop,
+        nodes: list[CFGNode],
+        temp_refs: set[TempRef],
+        writable_blocks: set[MemoryBlock] | None,
+    ):
+        self.loop = loop
+        self.temp_refs = temp_refs
+        self.numbering = ValueNumbering(nodes, writable_blocks)
+        self.temps = {}
+        self.hoisted = []
+        self.temp_count = 0
+
+    def hoist_node(self, node: CFGNode):
+        # Only the header is known to be evaluated whenever the loop is entered.
+        guaranteed = node is self.loop.header
+        node.body = [
+            self.visit_statement(statement, guaranteed) for statement in node.body
+        ]
+        if node.test is not None:
+            node.test = self.visit_value(node.test, guaranteed)
+
+    def visit_statement(self, statement: IRNode, guaranteed: bool) -> IRNode:
+        match statement:
+            case IRSet(location, value):
+                new_value = self.visit_value(value, guaranteed)
+                offset = self.visit_value(location.offset, guaranteed)
+                if new_value is value and offset is location.offset:
+                    return statement
+                return IRSet(
+                    Location(location.ref, offset, location.base, location.span),
+                    new_value,
+                )
+            case _:
+                return self.visit_value(statement, guaranteed)
+
+    def visit_value(self, value: IRNode, guaranteed: bool) -> IRNode:
+        number = self.numbering.number(value)
+        if (
+            number is not None
+            and self.numbering.costs[number] >= 2
+            and self.numbering.is_invariant[number]
+            and (guaranteed or not self.numbering.is_dynamic[number])
+        ):
+            return self.get_temp(number, value)
+        match value:
+            case IRFunc(name, args):
+                new_args = [
+                    self.visit_value(
+                        arg, guaranteed and (i == 0 or name not in LAZY_FUNCTIONS)
+                    )
+                    for i, arg in enumerate(args)
+                ]
+                if all(arg is old_arg for arg, old_arg in zip(new_args, args)):
+                    return value
+                return IRFunc.of(name, new_args)
+            case IRGet(location):
+                offset = self.visit_value(location.offset, guaranteed)
+                if offset is location.offset:
+                    return value
+                return IRGet.of(
+                    Location(location.ref, offset, location.base, location.span)
+                )
+            case _:
+                return value
+
+    def get_temp(self, number: int, value: IRNode) -> IRGet:
+        temp = self.temps.get(number)
+        if temp is None:
+            while True:
+                ref = TempRef(f"licm${self.temp_count}")
+                self.temp_count += 1
+                if ref not in self.temp_refs:
+                    break
+            self.temp_refs.add(ref)
+            temp = IRGet.of(Location(ref, IRConst.of(0), 0, 1))
+            self.hoisted.append(IRSet(temp.location, value))
+            self.temps[number] = temp
+        return temp
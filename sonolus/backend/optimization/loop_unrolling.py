@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from sonolus.backend.cfg import CFG, CFGEdge, CFGNode
+from sonolus.backend.ir import IRNode, Location
+from sonolus.backend.ir_visitor import IRVisitor
+from sonolus.backend.optimization.analyses import Loop, Loops, TempRefSizes
+from sonolus.backend.optimization.conditional_constant_propagation import (
+    ConditionalConstantPropagation,
+)
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+
+
+class LoopUnrolling(OptimizationPass):
+    """
+    Fully unrolls loops whose path is known at compile time, such as loops over
+    a constant range.
+
+    Starting from the constants known on entry to a loop, the loop is evaluated
+    with conditional constant propagation until it exits. If every test along the
+    way is constant, the loop is replaced by a single node made of the evaluated
+    bodies, with the constants known at each point folded in.
+    Loops are only unrolled if they exit within max_iterations iterations and the
+    unrolled code has at most max_size ir nodes.
+    """
+
+    requires = (Loops, TempRefSizes)
+    settings = ("max_iterations", "max_size")
+
+    def __init__(self, max_iterations: int = 16, max_size: int = 256):
+        super().__init__()
+        self.max_iterations = max_iterations
+        self.max_size = max_size
+
+    def run(self, cfg: CFG):
+        loops = Loops.get(cfg)
+        if not loops:
+            return False
+        propagation = ConditionalConstantPropagation()
+        _, lattices_out = propagation.propagate(cfg)
+
+        unrolled = set()
+        for loop in loops:
+            # Loops containing an unrolled loop are left for the next run.
+            if loop.nodes & unrolled:
+                continue
+            if self.unroll(cfg, loop, propagation, lattices_out):
+                unrolled |= loop.nodes
+        if not unrolled:
+            return False
+        cfg.remove_dead_nodes()
+        return True
+
+    def unroll(
+        self,
+        cfg: CFG,
+        loop: Loop,
+        propagation: ConditionalConstantPropagation,
+        lattices_out: dict[CFGNode, dict | None],
+    ) -> bool:
+        header = loop.header
+        if header.phi or header is cfg.entry_node:
+            return False
+        entry_edges = [
+            edge
+            for edge in sorted(cfg.edges_by_to[header])
+            if edge.from_node not in loop.nodes
+        ]
+        entry_lattices = [lattices_out.get(edge.from_node) for edge in entry_edges]
+        if None in entry_lattices:
+            return False
+        lattice = propagation.meet_latices(entry_lattices)
+
+        body = []
+        size = 0
+        iterations = 0
+        node = header
+        while node in loop.nodes:
+            if node is header:
+                iterations += 1
+                if iterations > self.max_iterations + 1:
+                    return False
+            for statement in node.body:
+                statement = propagation.visit_ir(statement, lattice)
+                size += _ir_size(statement)
+                if size > self.max_size:
+                    return False
+                body.append(statement)
+            edges = {edge.condition: edge for edge in cfg.edges_by_from[node]}
+            if node.test is None:
+                edge = edges.get(None)
+            else:
+                test = propagation.visit_ir(node.test, lattice).constant()
+                if test is None:
+                    return False
+                edge = edges.get(test if test in edges else None)
+            if edge is None:
+                return False
+            node = edge.to_node
+        if node.phi:
+            return False
+
+        unrolled = CFGNode(body, None)
+        for edge in entry_edges:
+            cfg.remove_edge(edge)
+            cfg.add_edge(CFGEdge(edge.from_node, unrolled, edge.condition))
+        cfg.add_edge(CFGEdge(unrolled, node))
+        return True
+
+
+def _ir_size(node: IRNode) -> int:
+    visitor = _IRSizeVisitor()
+    visitor.visit(node)
+    return visitor.size
+
+
+class _IRSizeVisitor(IRVisitor):
+    def __init__(self):
+        self.size = 0
+
+    def visit(self, node):
+        if not isinstance(node, Location):
+            self.size += 1
+        return super().visit(node)
@@ -1,40 +1,163 @@
 from __future__ import annotations
 
 from abc import ABC
+from typing import Type
 
 from sonolus.backend.cfg import CFG
 
 
 class OptimizationPass(ABC):
-    requires: tuple[AnalysisPass, ...] = ()
+    # Analyses computed before the pass runs, available through AnalysisPass.get.
+    requires: tuple[Type[AnalysisPass], ...] = ()
+    # Analyses that are still valid after the pass runs. All others are invalidated.
+    preserves: tuple[Type[AnalysisPass], ...] = ()
+    # Attributes that change the output of the pass, which are part of its
+    # description.
+    settings: tuple[str, ...] = ()
 
-    def run(self, cfg: CFG):
+    def run(self, cfg: CFG) -> bool:
+        """
+        Runs the pass and returns whether the cfg was changed.
+        A return value of None is treated as a potential change.
+        """
         ...
 
+    def describe(self) -> list | None:
+        """
+        Returns a json serializable description of the pass and its settings,
+        which is part of the key of cached compile output, or None if the pass
+        can't be described, in which case output compiled with it is not cached.
+
+        Only passes defined in sonolus are described by default, since the source
+        of other passes is not part of the key.
+        """
+        cls = type(self)
+        if cls.__module__.partition(".")[0] != "sonolus":
+            return None
+        return [qualified_name(cls), [getattr(self, name) for name in self.settings]]
+
 
 class AnalysisPass(ABC):
-    requires: tuple[AnalysisPass, ...] = ()
+    """
+    An analysis whose result is cached on the cfg until a pass that does not
+    preserve it runs.
+    """
+
+    requires: tuple[Type[AnalysisPass], ...] = ()
+
+    @classmethod
+    def get(cls, cfg: CFG):
+        if cls not in cfg.analyses:
+            cfg.analyses[cls] = cls.analyze(cfg)
+        return cfg.analyses[cls]
 
     @classmethod
     def analyze(cls, cfg: CFG):
         ...
 
 
+def invalidate_analyses(cfg: CFG, preserved: tuple[Type[AnalysisPass], ...] = ()):
+    preserved = set(preserved)
+    # Analyses depending on an invalidated analysis are invalidated as well.
+    changed = True
+    while changed:
+        changed = False
+        for analysis in [*preserved]:
+            if any(required not in preserved for required in analysis.requires):
+                preserved.remove(analysis)
+                changed = True
+    for analysis in [*cfg.analyses]:
+        if analysis not in preserved:
+            del cfg.analyses[analysis]
+
+
+class PassInstrumentation(ABC):
+    """Hook called around every pass run by run_optimization_passes."""
+
+    def before_pass(self, opt_pass: OptimizationPass, cfg: CFG):
+        ...
+
+    def after_pass(self, opt_pass: OptimizationPass, cfg: CFG, changed: bool):
+        ...
+
+
+class PassGroup(OptimizationPass, ABC):
+    """
+    A pass made up of other passes.
+    The passes in the group are instrumented individually, rather than the group.
+    """
+
+    def run(self, cfg: CFG, instrumentation: PassInstrumentation | None = None) -> bool:
+        ...
+
+
+class FixedPoint(PassGroup):
+    """
+    Runs a sequence of passes repeatedly until none of them changes the cfg or
+    the iteration limit is reached.
+    """
+
+    settings = ("max_iterations",)
+
+    def __init__(self, passes: list[OptimizationPass], max_iterations: int = 8):
+        self.passes = passes
+        self.max_iterations = max_iterations
+
+    def describe(self) -> list | None:
+        description = super().describe()
+        passes = [opt_pass.describe() for opt_pass in self.passes]
+        if description is None or None in passes:
+            return None
+        return [*description, passes]
+
+    def run(self, cfg: CFG, instrumentation: PassInstrumentation | None = None) -> bool:
+        changed = False
+        for _ in range(self.max_iterations):
+            if not run_passes(cfg, self.passes, instrumentation):
+                break
+            changed = True
+        return changed
+
+
+def qualified_name(obj) -> str:
+    return f"{obj.__module__}.{obj.__qualname__}"
+
+
 def run_optimization_passes(
     cfg: CFG,
     passes: list[OptimizationPass],
+    instrumentation: PassInstrumentation | None = None,
 ):
-    for opt_pass in passes:
-        analyses = set()
-        required_analyses = [*opt_pass.requires]
-        while required_analyses:
-            analysis = required_analyses.pop()
-            unsatisfied_analyses = analysis.requires - analyses
-            if unsatisfied_analyses:
-                required_analyses.extend(unsatisfied_analyses)
-                required_analyses.append(analysis)
-            else:
-                analyses.add(analysis)
-                analysis.analyze(cfg)
-        opt_pass.run(cfg)
+    run_passes(cfg, passes, instrumentation)
     return cfg
+
+
+def run_passes(
+    cfg: CFG,
+    passes: list[OptimizationPass],
+    instrumentation: PassInstrumentation | None = None,
+) -> bool:
+    changed = False
+    for opt_pass in passes:
+        if run_pass(cfg, opt_pass, instrumentation):
+            changed = True
+    return changed
+
+
+def run_pass(
+    cfg: CFG,
+    opt_pass: OptimizationPass,
+    instrumentation: PassInstrumentation | None = None,
+) -> bool:
+    if isinstance(opt_pass, PassGroup):
+        return opt_pass.run(cfg, instrumentation)
+    if instrumentation is not None:
+        instrumentation.before_pass(opt_pass, cfg)
+    for analysis in opt_pass.requires:
+        analysis.get(cfg)
+    changed = opt_pass.run(cfg) is not False
+    if changed:
+        invalidate_analyses(cfg, opt_pass.preserves)
+    if instrumentation is not None:
+        instrumentation.after_pass(opt_pass, cfg, changed)
+    return changed
@@ -1,6 +1,7 @@
 from sonolus.backend.optimization.aggregate_to_scalar import AggregateToScalar
-from sonolus.backend.optimization.allocate import Allocate
+from sonolus.backend.optimization.allocate import Allocate, InterferenceAllocate
 from sonolus.backend.optimization.arithmetic_simplification import (
+    ARITHMETIC_REWRITE_RULES,
     ArithmeticSimplification,
 )
 from sonolus.backend.optimization.basic_dead_code_elimination import (
@@ -10,11 +11,42 @@ from sonolus.backend.optimization.basic_dead_store_elimination import (
     BasicDeadStoreElimination,
 )
 from sonolus.backend.optimization.coalesce_flow import CoalesceFlow
+from sonolus.backend.optimization.copy_propagation import CopyPropagation
 from sonolus.backend.optimization.conditional_constant_propagation import (
     ConditionalConstantPropagation,
 )
+from sonolus.backend.optimization.dead_store_elimination import DeadStoreElimination
+from sonolus.backend.optimization.global_value_numbering import GlobalValueNumbering
+from sonolus.backend.optimization.if_conversion import IfConversion
+from sonolus.backend.optimization.if_to_switch import IfToSwitch
+from sonolus.backend.optimization.loop_invariant_code_motion import (
+    LoopInvariantCodeMotion,
+)
+from sonolus.backend.optimization.loop_unrolling import LoopUnrolling
+from sonolus.backend.optimization.optimization_pass import (
+    FixedPoint,
+    OptimizationPass,
+)
+from sonolus.backend.optimization.peephole import Peephole
+from sonolus.backend.optimization.strength_reduction import STRENGTH_REDUCTION_RULES
+from sonolus.backend.optimization.tail_merging import TailMerging
+
+# The arithmetic simplification and strength reduction rules, applied together in
+# a single walk over the cfg.
+DEFAULT_REWRITE_RULES = [*ARITHMETIC_REWRITE_RULES, *STRENGTH_REDUCTION_RULES]
+
+# Every preset ends with an allocation pass,
+# which is required to produce valid output.
 
-DEFAULT_OPTIMIZATION_PRESET = [
+# No optimizations; every temp ref is allocated its own temporary memory.
+# Fastest to compile, intended for development builds.
+O0_OPTIMIZATION_PRESET = [
+    Allocate(),
+]
+
+# The basic passes run once. This is the original default pipeline, unchanged.
+# The other passes only run from O2.
+O1_OPTIMIZATION_PRESET = [
     ConditionalConstantPropagation(),
     CoalesceFlow(),
     ArithmeticSimplification(),
@@ -24,3 +56,79 @@ DEFAULT_OPTIMIZATION_PRESET = [
     CoalesceFlow(),
     Allocate(),
 ]
+
+# The basic passes and every other scalar, control flow and redundancy pass
+# except loop unrolling are repeated until none of them makes a change,
+# for at most 4 iterations. Temp refs with disjoint live ranges then share
+# temporary memory.
+O2_OPTIMIZATION_PRESET = [
+    FixedPoint(
+        [
+            ConditionalConstantPropagation(),
+            CoalesceFlow(),
+            Peephole(DEFAULT_REWRITE_RULES),
+            AggregateToScalar(),
+            CopyPropagation(),
+            IfToSwitch(),
+            IfConversion(),
+            BasicDeadCodeElimination(),
+            DeadStoreElimination(),
+            GlobalValueNumbering(),
+            LoopInvariantCodeMotion(),
+            TailMerging(),
+            CoalesceFlow(),
+        ],
+        max_iterations=4,
+    ),
+    InterferenceAllocate(),
+]
+
+# As O2, but loops with a constant trip count are also unrolled, trading size for
+# speed, and the passes are repeated for up to 32 iterations.
+# Slowest to compile, intended for release builds.
+O3_OPTIMIZATION_PRESET = [
+    FixedPoint(
+        [
+            ConditionalConstantPropagation(),
+            LoopUnrolling(),
+            CoalesceFlow(),
+            Peephole(DEFAULT_REWRITE_RULES),
+            AggregateToScalar(),
+            CopyPropagation(),
+            IfToSwitch(),
+            IfConversion(),
+            BasicDeadCodeElimination(),
+            DeadStoreElimination(),
+            GlobalValueNumbering(),
+            LoopInvariantCodeMotion(),
+            TailMerging(),
+            CoalesceFlow(),
+        ],
+        max_iterations=32,
+    ),
+    InterferenceAllocate(),
+]
+
+DEFAULT_OPTIMIZATION_PRESET = O1_OPTIMIZATION_PRESET
+
+OPTIMIZATION_LEVELS = {
+    0: O0_OPTIMIZATION_PRESET,
+    1: O1_OPTIMIZATION_PRESET,
+    2: O2_OPTIMIZATION_PRESET,
+    3: O3_OPTIMIZATION_PRESET,
+}
+
+
+def get_optimization_preset(
+    optimizations: int | list[OptimizationPass],
+) -> list[OptimizationPass]:
+    """Returns the preset for an optimization level, or the given passes unchanged."""
+    if isinstance(optimizations, int):
+        try:
+            return OPTIMIZATION_LEVELS[optimizations]
+        except KeyError:
+            raise ValueError(
+                f"Unknown optimization level {optimizations}, "
+                f"expected one of {[*OPTIMIZATION_LEVELS]}."
+            ) from None
+    return optimizations
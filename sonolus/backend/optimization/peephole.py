@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+from sonolus.backend.cfg import CFG
+from sonolus.backend.ir import IRConst, IRFunc, IRNode
+from sonolus.backend.ir_visitor import IRTransformer
+from sonolus.backend.optimization.analyses import (
+    Dominators,
+    Predecessors,
+    ReversePostorder,
+)
+from sonolus.backend.optimization.optimization_pass import (
+    OptimizationPass,
+    qualified_name,
+)
+
+
+@dataclass(frozen=True)
+class Capture:
+    """
+    Matches any value, which is passed to the guard and rewrite of the rule by name.
+    A name captured more than once must match the same value each time.
+    """
+
+    name: str
+
+
+@dataclass(frozen=True)
+class Rest:
+    """
+    Matches the remaining arguments of a call, which are passed to the guard and
+    rewrite of the rule as a list by name. Only allowed as the last argument of a
+    call pattern.
+    """
+
+    name: str
+
+
+class Call:
+    """
+    Matches a call of a function whose arguments match the given patterns.
+    A number matches a constant equal to it.
+    """
+
+    def __init__(self, func: str, *args: Call | Capture | Rest | float):
+        self.func = func
+        self.args = args
+
+    def __repr__(self):
+        return f"Call({self.func!r}, {', '.join(map(repr, self.args))})"
+
+
+@dataclass(frozen=True)
+class RewriteRule:
+    pattern: Call
+    # Called with the captured values by name, returning the replacement, or None
+    # if the rule doesn't apply after all.
+    rewrite: Callable[..., IRNode | None]
+    # Called with the captured values by name. The rule only applies if it returns
+    # a true value.
+    guard: Callable[..., bool] | None = None
+
+
+class Peephole(OptimizationPass):
+    """
+    Applies rewrite rules to every call in the cfg in a single bottom up walk.
+
+    The rules are indexed by the function and number of arguments of their
+    pattern, and the first rule in order whose pattern matches a call and whose
+    guard passes is applied. Rules are
+    applied again to the result until none applies, for at most max_rewrites
+    rewrites of each call.
+    """
+
+    preserves = (ReversePostorder, Predecessors, Dominators)
+    settings = ("max_rewrites",)
+
+    def __init__(self, rules: Iterable[RewriteRule], max_rewrites: int = 16):
+        super().__init__()
+        self.rules = [*rules]
+        self.max_rewrites = max_rewrites
+
+    def describe(self) -> list | None:
+        description = super().describe()
+        rules = [_describe_rule(rule) for rule in self.rules]
+        if description is None or None in rules:
+            return None
+        return [*description, rules]
+
+    def run(self, cfg: CFG):
+        transformer = PeepholeTransformer(self.rules, self.max_rewrites)
+        transformer.visit(cfg)
+        return transformer.changed
+
+
+class PeepholeTransformer(IRTransformer):
+    def __init__(self, rules: Iterable[RewriteRule], max_rewrites: int = 16):
+        self.rules = [*rules]
+        # Rules by function and number of arguments, filled in as calls are seen.
+        self.table = {}
+        self.max_rewrites = max_rewrites
+        self.changed = False
+        # Results are memoized by id, so visited nodes are kept alive.
+        self.results = {}
+        self.visited = []
+
+    def visit_IRFunc(self, node):
+        result = self.results.get(id(node))
+        if result is not None:
+            return result
+        result = super().visit_IRFunc(node)
+        for _ in range(self.max_rewrites):
+            rewritten = self.rewrite(result)
+            if rewritten is None:
+                break
+            self.changed = True
+            result = rewritten
+            if isinstance(result, IRFunc):
+                # The rewrite may have built new calls that rules apply to.
+                result = super().visit_IRFunc(result)
+        self.results[id(node)] = result
+        self.results[id(result)] = result
+        self.visited.extend((node, result))
+        return result
+
+    def rewrite(self, node: IRNode) -> IRNode | None:
+        if not isinstance(node, IRFunc):
+            return None
+        key = (node.name, len(node.args))
+        rules = self.table.get(key)
+        if rules is None:
+            rules = [rule for rule in self.rules if _accepts(rule.pattern, *key)]
+            self.table[key] = rules
+        for rule in rules:
+            captures = {}
+            if not _match(rule.pattern, node, captures):
+                continue
+            if rule.guard is not None and not rule.guard(**captures):
+                continue
+            result = rule.rewrite(**captures)
+            if result is not None:
+                return result
+        return None
+
+
+def _accepts(pattern: Call, func: str, arg_count: int) -> bool:
+    """Returns whether a pattern can match a call of a function with arg_count args."""
+    if pattern.func != func:
+        return False
+    if pattern.args and isinstance(pattern.args[-1], Rest):
+        return arg_count >= len(pattern.args) - 1
+    return arg_count == len(pattern.args)
+
+
+def _match(
+    pattern: Call | Capture | Rest | float, node: IRNode, captures: dict
+) -> bool:
+    match pattern:
+        case Capture(name):
+            if name in captures:
+                return captures[name] is node
+            captures[name] = node
+            return True
+        case Call(func=func, args=args):
+            if not isinstance(node, IRFunc) or node.name != func:
+                return False
+            if args and isinstance(args[-1], Rest):
+                args = args[:-1]
+                if len(node.args) < len(args):
+                    return False
+                captures[pattern.args[-1].name] = [*node.args[len(args) :]]
+            elif len(node.args) != len(args):
+                return False
+            return all(
+                _match(arg_pattern, arg, captures)
+                for arg_pattern, arg in zip(args, node.args)
+            )
+        case _:
+            return isinstance(node, IRConst) and node.constant() == pattern
+
+
+def _describe_rule(rule: RewriteRule) -> list | None:
+    """
+    Describes a rule by its pattern and functions, or returns None if a function
+    is defined outside sonolus, since only the source of sonolus is part of the
+    key of cached compile output.
+    """
+    description = [repr(rule.pattern)]
+    for function in (rule.rewrite, rule.guard):
+        if function is None:
+            continue
+        code = getattr(function, "__code__", None)
+        module = getattr(function, "__module__", None) or ""
+        if code is None or module.partition(".")[0] != "sonolus":
+            return None
+        description.append(f"{qualified_name(function)}:{code.co_firstlineno}")
+    return description
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from sonolus.backend.cfg import CFG, CFGEdge, CFGNode, Phi
+from sonolus.backend.ir import IRConst, IRGet, IRSet, Location, SSARef, TempRef
+from sonolus.backend.ir_visitor import IRTransformer
+from sonolus.backend.optimization.analyses import (
+    Dominators,
+    Liveness,
+    Predecessors,
+    ReversePostorder,
+    TempRefSizes,
+)
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+
+
+class ToSSA(OptimizationPass):
+    """
+    Converts scalar temp refs to pruned SSA form.
+
+    Phis are placed on the iterated dominance frontiers of the definitions of a ref,
+    where the ref is live. Version 0 of a ref is its value on entry to the cfg.
+    Since every version is assigned once, passes such as GlobalValueNumbering can
+    follow a read straight to its definition instead of tracking later writes.
+    Passes between ToSSA and FromSSA must preserve phis.
+
+    Not part of the optimization presets, since the round trip doesn't reduce the
+    size of typical engines.
+    """
+
+    requires = (ReversePostorder, Predecessors, Dominators, TempRefSizes, Liveness)
+    preserves = (ReversePostorder, Predecessors, Dominators)
+
+    def run(self, cfg: CFG):
+        nodes = ReversePostorder.get(cfg)
+        dominators = Dominators.get(cfg)
+        live_in = Liveness.get(cfg).live_in
+        refs = [ref for ref, size in TempRefSizes.get(cfg).items() if size == 1]
+        if not refs:
+            return False
+        scalars = set(refs)
+
+        definitions = {ref: [] for ref in refs}
+        for node in nodes:
+            for statement in node.body:
+                if (
+                    isinstance(statement, IRSet)
+                    and statement.location.ref in scalars
+                    and node not in definitions[statement.location.ref][-1:]
+                ):
+                    definitions[statement.location.ref].append(node)
+
+        order = {node: i for i, node in enumerate(nodes)}
+        phis = {node: [] for node in nodes}
+        for ref in refs:
+            placed = set()
+            queue = [*definitions[ref]]
+            while queue:
+                node = queue.pop()
+                for frontier_node in sorted(
+                    dominators.frontiers[node], key=order.__getitem__
+                ):
+                    if frontier_node in placed or ref not in live_in[frontier_node]:
+                        continue
+                    placed.add(frontier_node)
+                    phi = Phi(SSARef(ref.name), {})
+                    frontier_node.add_phi(phi)
+                    phis[frontier_node].append((phi, ref))
+                    queue.append(frontier_node)
+
+        renamer = _SSARenamer(scalars)
+        # Depth-first over the dominator tree, undoing each node's definitions
+        # once its subtree is done.
+        stack = [(nodes[0], False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                for ref in renamer.defined.pop():
+                    renamer.versions[ref].pop()
+                continue
+            renamer.defined.append([])
+            for phi, ref in phis[node]:
+                phi.target = renamer.define(ref)
+            node.body = [renamer.visit(statement) for statement in node.body]
+            if node.test is not None:
+                node.test = renamer.visit(node.test)
+            for edge in sorted(cfg.edges_by_from[node]):
+                successor = edge.to_node
+                for phi, ref in phis[successor]:
+                    phi.values[node] = renamer.current(ref)
+            stack.append((node, True))
+            stack.extend(
+                (child, False) for child in reversed(dominators.children[node])
+            )
+        return True
+
+
+class _SSARenamer(IRTransformer):
+    def __init__(self, scalars: set[TempRef]):
+        self.scalars = scalars
+        self.versions = {ref: [] for ref in scalars}
+        self.counts = {ref: 0 for ref in scalars}
+        # The refs defined by each node on the current dominator tree path.
+        self.defined = []
+
+    def current(self, ref: TempRef) -> SSARef:
+        versions = self.versions[ref]
+        return versions[-1] if versions else SSARef(ref.name)
+
+    def define(self, ref: TempRef) -> SSARef:
+        self.counts[ref] += 1
+        version = SSARef(ref.name, self.counts[ref])
+        self.versions[ref].append(version)
+        self.defined[-1].append(ref)
+        return version
+
+    def visit_IRGet(self, node):
+        if node.location.ref in self.scalars:
+            return IRGet.of(_scalar_location(self.current(node.location.ref)))
+        return super().visit_IRGet(node)
+
+    def visit_IRSet(self, node):
+        if node.location.ref in self.scalars:
+            value = self.visit(node.value)
+            return IRSet(_scalar_location(self.define(node.location.ref)), value)
+        return super().visit_IRSet(node)
+
+
+class FromSSA(OptimizationPass):
+    """
+    Converts SSA refs back to temp refs.
+
+    Each phi is replaced by copies at the end of its predecessors, splitting
+    edges where a predecessor has other successors. Version 0 of a ref becomes
+    the original temp ref, and other versions become new temp refs.
+    """
+
+    requires = (ReversePostorder,)
+
+    def run(self, cfg: CFG):
+        changed = False
+        for node in ReversePostorder.get(cfg):
+            if not node.phi:
+                continue
+            changed = True
+            predecessors = [
+                *dict.fromkeys(pred for phi in node.phi for pred in phi.values)
+            ]
+            for pred in predecessors:
+                copies = [
+                    (phi.target, phi.values[pred])
+                    for phi in node.phi
+                    if pred in phi.values
+                ]
+                if {*cfg.edges_by_from[pred]} != {CFGEdge(pred, node)}:
+                    pred = self.split_edges(cfg, pred, node)
+                pred.body = [*pred.body, *self.sequentialize(copies)]
+            node.phi = None
+
+        transformer = _SSARefLowering()
+        transformer.visit(cfg)
+        return changed or transformer.changed
+
+    def split_edges(self, cfg: CFG, pred: CFGNode, node: CFGNode) -> CFGNode:
+        new_node = CFGNode([], None)
+        for edge in sorted(cfg.edges_by_from[pred]):
+            if edge.to_node is node:
+                cfg.remove_edge(edge)
+                cfg.add_edge(CFGEdge(pred, new_node, edge.condition))
+        cfg.add_edge(CFGEdge(new_node, node))
+        for phi in node.phi:
+            if pred in phi.values:
+                phi.values[new_node] = phi.values.pop(pred)
+        return new_node
+
+    def sequentialize(self, copies: list[tuple[SSARef, SSARef]]) -> list[IRSet]:
+        # Phi copies happen in parallel, so a copy may only be emitted once no
+        # remaining copy reads its target. Cycles are broken with a temporary.
+        pending = [(target, source) for target, source in copies if target != source]
+        result = []
+        while pending:
+            sources = {source for _, source in pending}
+            for i, (target, source) in enumerate(pending):
+                if target not in sources:
+                    result.append(_copy(target, source))
+                    del pending[i]
+                    break
+            else:
+                target, _ = pending[0]
+                temp = TempRef(f"{target.name}#{target.number}$swap")
+                result.append(_copy(temp, target))
+                pending = [
+                    (other_target, temp if source == target else source)
+                    for other_target, source in pending
+                ]
+        return result
+
+
+class _SSARefLowering(IRTransformer):
+    def __init__(self):
+        self.changed = False
+
+    def visit_Location(self, location):
+        location = super().visit_Location(location)
+        if isinstance(location.ref, SSARef):
+            self.changed = True
+            return Location(
+                get_ssa_temp_ref(location.ref),
+                location.offset,
+                location.base,
+                location.span,
+            )
+        return location
+
+
+def get_ssa_temp_ref(ref: SSARef) -> TempRef:
+    if ref.number == 0:
+        return TempRef(ref.name)
+    return TempRef(f"{ref.name}#{ref.number}")
+
+
+def _scalar_location(ref: SSARef | TempRef) -> Location:
+    return Location(ref, IRConst.of(0), 0, 1)
+
+
+def _copy(target: SSARef | TempRef, source: SSARef | TempRef) -> IRSet:
+    return IRSet(_scalar_location(target), IRGet.of(_scalar_location(source)))
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import math
+
+from sonolus.backend.ir import IRConst, IRFunc, IRGet, IRNode
+from sonolus.backend.optimization.node_functions import constant_functions
+from sonolus.backend.optimization.peephole import (
+    Call,
+    Capture,
+    Rest,
+    RewriteRule,
+)
+
+# The relative cost of calling each builtin, not counting its arguments.
+# Builtins not listed cost as much as a single arithmetic operation.
+FUNCTION_COSTS = {
+    "Add": 1,
+    "Subtract": 1,
+    "Multiply": 1,
+    "Divide": 2,
+    "Mod": 2,
+    "Power": 4,
+    "Log": 4,
+    "Not": 1,
+    "Min": 1,
+    "Max": 1,
+    "Abs": 1,
+    "Sign": 1,
+    "Ceil": 1,
+    "Floor": 1,
+    "Round": 1,
+    "Frac": 1,
+    "Trunc": 1,
+    "Degree": 2,
+    "Radian": 2,
+    "Sin": 4,
+    "Cos": 4,
+    "Tan": 4,
+    "Sinh": 4,
+    "Cosh": 4,
+    "Tanh": 4,
+    "Arcsin": 4,
+    "Arccos": 4,
+    "Arctan": 4,
+    "Arctan2": 4,
+    "Clamp": 1,
+    "Lerp": 2,
+    "LerpClamped": 2,
+    "Unlerp": 3,
+    "UnlerpClamped": 3,
+    "Remap": 4,
+    "RemapClamped": 4,
+    "Smoothstep": 4,
+    "Random": 2,
+    "RandomInteger": 2,
+}
+
+BOOLEAN_FUNCTIONS = {
+    "Equal",
+    "NotEqual",
+    "Greater",
+    "GreaterOr",
+    "Less",
+    "LessOr",
+    "And",
+    "Or",
+    "Not",
+}
+
+
+def get_cost(node: IRNode) -> int:
+    match node:
+        case IRFunc(name, args):
+            return FUNCTION_COSTS.get(name, 1) + sum(get_cost(arg) for arg in args)
+        case IRGet(location):
+            return 1 + get_cost(location.offset)
+        case _:
+            return 1
+
+
+def is_pure(node: IRNode) -> bool:
+    """Returns whether a value can be evaluated more than once."""
+    match node:
+        case IRConst():
+            return True
+        case IRGet(location):
+            return not isinstance(location.ref, IRNode) and is_pure(location.offset)
+        case IRFunc(name, args):
+            return name in constant_functions and all(is_pure(arg) for arg in args)
+        case _:
+            return False
+
+
+def _is_power_of_two(value: float | None) -> bool:
+    if value is None or value == 0 or not math.isfinite(value):
+        return False
+    return abs(math.frexp(value)[0]) == 0.5 and math.isfinite(1 / value)
+
+
+def _negated(node: IRNode) -> IRNode | None:
+    """Returns x if the node is Multiply(-1, x)."""
+    match node:
+        case IRFunc("Multiply", [factor, x]) if factor.constant() == -1:
+            return x
+    return None
+
+
+def _split_constant(a: IRNode, b: IRNode) -> tuple[IRNode, IRNode | None]:
+    """Returns the non-constant argument of a pair and the constant, if any."""
+    if a.constant() is not None:
+        a, b = b, a
+    if a.constant() is not None or b.constant() is None:
+        return a, None
+    return a, b
+
+
+def _call(func: str):
+    return lambda x: IRFunc.of(func, [x])
+
+
+def _rewrite_add(args: list[IRNode]) -> IRNode | None:
+    *args, last = args
+    if not args or not _negated(last):
+        return None
+    # Only the last term is moved, so the order of operations is kept.
+    first = args[0] if len(args) == 1 else IRFunc.of("Add", args)
+    return IRFunc.of("Subtract", [first, _negated(last)])
+
+
+def _rewrite_min_max(name: str):
+    def rewrite(a: IRNode, b: IRNode) -> IRNode | None:
+        inner, outer_bound = _split_constant(a, b)
+        if (
+            outer_bound is None
+            or not isinstance(inner, IRFunc)
+            or inner.name not in ("Min", "Max")
+            or len(inner.args) != 2
+        ):
+            return None
+        x, inner_bound = _split_constant(*inner.args)
+        if inner_bound is None:
+            return None
+        outer_value, inner_value = outer_bound.constant(), inner_bound.constant()
+        if math.isnan(outer_value) or math.isnan(inner_value):
+            return None
+        if name == inner.name:
+            if name == "Min":
+                tighter = outer_value < inner_value
+            else:
+                tighter = outer_value > inner_value
+            return IRFunc.of(name, [x, outer_bound if tighter else inner_bound])
+        elif name == "Min" and inner_value <= outer_value:
+            return IRFunc.of("Clamp", [x, inner_bound, outer_bound])
+        elif name == "Max" and outer_value <= inner_value:
+            return IRFunc.of("Clamp", [x, outer_bound, inner_bound])
+        return None
+
+    return rewrite
+
+
+def _are_pure(a: IRNode, b: IRNode) -> bool:
+    return is_pure(a) and is_pure(b)
+
+
+def _if_to_min_max(comparison: str) -> list[RewriteRule]:
+    lesser, greater = ("Min", "Max") if "Less" in comparison else ("Max", "Min")
+    return [
+        RewriteRule(
+            Call("If", Call(comparison, _a, _b), _a, _b),
+            lambda a, b: IRFunc.of(lesser, [a, b]),
+            _are_pure,
+        ),
+        RewriteRule(
+            Call("If", Call(comparison, _b, _a), _a, _b),
+            lambda a, b: IRFunc.of(greater, [b, a]),
+            _are_pure,
+        ),
+    ]
+
+
+_x = Capture("x")
+_a = Capture("a")
+_b = Capture("b")
+_c = Capture("c")
+_args = Rest("args")
+
+ROUNDING_FUNCTIONS = ("Floor", "Ceil", "Round", "Trunc")
+
+# Functions whose value is never negative.
+NON_NEGATIVE_FUNCTIONS = {"Abs", "Frac"}
+
+# Every rule produces a strictly cheaper call, so applying them always
+# terminates. Where several rules match a call, the first is applied.
+# Rules that drop a captured value or evaluate it fewer times only apply
+# if it is pure, so calls with side effects are kept.
+STRENGTH_REDUCTION_RULES = [
+    RewriteRule(Call("Power", _x, 0), lambda x: IRConst.of(1), lambda x: is_pure(x)),
+    RewriteRule(Call("Power", _x, 1), lambda x: x),
+    RewriteRule(
+        Call("Power", _x, 2),
+        lambda x: IRFunc.of("Multiply", [x, x]),
+        lambda x: is_pure(x) and get_cost(x) < FUNCTION_COSTS["Power"],
+    ),
+    RewriteRule(
+        Call("Divide", _x, _c),
+        lambda x, c: IRFunc.of("Multiply", [IRConst.of(1 / c.constant()), x]),
+        lambda x, c: _is_power_of_two(c.constant()),
+    ),
+    RewriteRule(Call("Mod", _x, 1), _call("Frac")),
+    RewriteRule(
+        Call("Multiply", -1, Call("Subtract", _a, _b)),
+        lambda a, b: IRFunc.of("Subtract", [b, a]),
+        _are_pure,
+    ),
+    RewriteRule(Call("Add", _args), _rewrite_add),
+    RewriteRule(
+        Call("Subtract", _a, Call("Multiply", -1, _b)),
+        lambda a, b: IRFunc.of("Add", [a, b]),
+    ),
+    RewriteRule(Call("Min", _a, _a), lambda a: a, lambda a: is_pure(a)),
+    RewriteRule(Call("Max", _a, _a), lambda a: a, lambda a: is_pure(a)),
+    RewriteRule(Call("Min", _a, _b), _rewrite_min_max("Min")),
+    RewriteRule(Call("Max", _a, _b), _rewrite_min_max("Max")),
+    RewriteRule(
+        Call("Not", Call("Not", _x)),
+        lambda x: x,
+        lambda x: isinstance(x, IRFunc) and x.name in BOOLEAN_FUNCTIONS,
+    ),
+    RewriteRule(
+        Call("Not", Call("Equal", _args)), lambda args: IRFunc.of("NotEqual", args)
+    ),
+    RewriteRule(
+        Call("Not", Call("NotEqual", _args)), lambda args: IRFunc.of("Equal", args)
+    ),
+    RewriteRule(
+        Call("If", _c, _a, _a), lambda c, a: a, lambda c, a: is_pure(c)
+    ),
+    RewriteRule(
+        Call("If", Call("Not", _c), _a, _b),
+        lambda c, a, b: IRFunc.of("If", [c, b, a]),
+    ),
+    *_if_to_min_max("Less"),
+    *_if_to_min_max("LessOr"),
+    *_if_to_min_max("Greater"),
+    *_if_to_min_max("GreaterOr"),
+    RewriteRule(Call("Lerp", 0, 1, _x), lambda x: x),
+    RewriteRule(Call("Lerp", 0, _b, _x), lambda b, x: IRFunc.of("Multiply", [b, x])),
+    # Rounding a value that is already rounded doesn't change it.
+    *(
+        RewriteRule(Call(outer, Call(inner, _x)), _call(inner))
+        for outer in ROUNDING_FUNCTIONS
+        for inner in ROUNDING_FUNCTIONS
+    ),
+    RewriteRule(Call("Frac", Call("Frac", _x)), _call("Frac")),
+    RewriteRule(
+        Call("Abs", _x),
+        lambda x: x,
+        lambda x: isinstance(x, IRFunc) and x.name in NON_NEGATIVE_FUNCTIONS,
+    ),
+    RewriteRule(Call("Abs", Call("Multiply", -1, _x)), _call("Abs")),
+    RewriteRule(
+        Call("Clamp", Call("Clamp", _x, _a, _b), _a, _b),
+        lambda x, a, b: IRFunc.of("Clamp", [x, a, b]),
+        lambda x, a, b: is_pure(a) and is_pure(b),
+    ),
+    RewriteRule(Call("Unlerp", 0, 1, _x), lambda x: x),
+]
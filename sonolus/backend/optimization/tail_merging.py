@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from sonolus.backend.cfg import CFG, CFGEdge, CFGNode
+from sonolus.backend.cfg_traversal import get_orders
+from sonolus.backend.ir import IRNode
+from sonolus.backend.ir_visitor import StructuralKeys
+from sonolus.backend.optimization.optimization_pass import OptimizationPass
+
+
+class TailMerging(OptimizationPass):
+    """
+    Merges nodes with identical bodies, tests and outgoing edges, and moves the
+    statements shared by the ends of the unconditional predecessors of a node
+    into a single node before it.
+    """
+
+    def run(self, cfg: CFG):
+        keys = StructuralKeys()
+        changed = False
+        # Merging nodes may make their predecessors identical in turn.
+        while self.merge_duplicates(cfg, keys):
+            changed = True
+        return self.merge_tails(cfg, keys) or changed
+
+    def merge_duplicates(self, cfg: CFG, keys: StructuralKeys) -> bool:
+        changed = False
+        nodes = {}
+        # The edges change as nodes are merged, so the order isn't cached.
+        for node in get_orders(cfg).reverse_postorder:
+            if node.phi or node.is_entry or node.is_exit:
+                continue
+            edges = cfg.edges_by_from[node]
+            if any(edge.to_node is node or edge.to_node.phi for edge in edges):
+                continue
+            key = (
+                tuple(keys.get(statement) for statement in node.body),
+                None if node.test is None else keys.get(node.test),
+                frozenset((edge.condition, edge.to_node) for edge in edges),
+            )
+            existing = nodes.setdefault(key, node)
+            if existing is node:
+                continue
+            for edge in [*cfg.edges_by_to[node]]:
+                cfg.remove_edge(edge)
+                cfg.add_edge(CFGEdge(edge.from_node, existing, edge.condition))
+            cfg.clear_from_edges(node)
+            changed = True
+        return changed
+
+    def merge_tails(self, cfg: CFG, keys: StructuralKeys) -> bool:
+        changed = False
+        for node in get_orders(cfg).reverse_postorder:
+            if node.phi:
+                continue
+            groups = {}
+            for edge in cfg.edges_by_to[node]:
+                pred = edge.from_node
+                if pred is node or not pred.body:
+                    continue
+                if cfg.edges_by_from[pred] != {CFGEdge(pred, node)}:
+                    continue
+                groups.setdefault(keys.get(pred.body[-1]), []).append(pred)
+            for preds in groups.values():
+                if len(preds) < 2:
+                    continue
+                tail = self.common_tail(preds, keys)
+                if len(cfg.edges_by_to[node]) == len(preds) and not node.is_entry:
+                    node.body = [*tail, *node.body]
+                else:
+                    tail_node = CFGNode(tail, None)
+                    for pred in preds:
+                        cfg.remove_edge(CFGEdge(pred, node))
+                        cfg.add_edge(CFGEdge(pred, tail_node))
+                    cfg.add_edge(CFGEdge(tail_node, node))
+                for pred in preds:
+                    pred.body = pred.body[: len(pred.body) - len(tail)]
+                changed = True
+        return changed
+
+    def common_tail(self, preds: list[CFGNode], keys: StructuralKeys) -> list[IRNode]:
+        first, *rest = preds
+        length = 1
+        while length < len(first.body) and all(
+            length < len(pred.body)
+            and keys.get(pred.body[-length - 1]) == keys.get(first.body[-length - 1])
+            for pred in rest
+        ):
+            length += 1
+        return first.body[-length:]
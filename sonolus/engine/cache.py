@@ -0,0 +1,403 @@
+from __future__ import annotations
+
+import ast
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import sysconfig
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Type
+
+import sonolus
+from sonolus.backend.engine_node import SimpleNode
+
+if TYPE_CHECKING:
+    from sonolus.backend.callback import CallbackType
+    from sonolus.engine.engine import Engine
+    from sonolus.scripting.internal.script import Script
+
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+
+_SONOLUS_ROOT = Path(sonolus.__file__).resolve().parent
+
+# Modules installed here are not hashed, since they are not expected to change
+# between compilations.
+_INSTALLED_ROOTS = {
+    Path(sysconfig.get_path(name)).resolve()
+    for name in ("stdlib", "platstdlib", "purelib", "platlib")
+}
+
+
+class CompileCache:
+    """
+    A persistent, content-addressed cache of finalized callback nodes.
+
+    Entries are keyed by the source of every module defining the callback or a
+    user-defined sls_func or value type reached while it was last traced, and of
+    every user module those modules import, directly or transitively. The layouts
+    of the engine's script types, the script ids, and the optimization passes and
+    their settings are also part of the key.
+    Since whole modules are hashed, editing a module level constant or a plain
+    python helper invalidates the callbacks that may use it. Modules of the
+    standard library and of installed packages are not hashed.
+    The sonolus package itself is hashed as a whole, so upgrading it invalidates
+    every entry.
+
+    Dependencies are discovered while tracing, so a callback is always compiled
+    the first time it is seen. Callbacks that reach functions or types whose source
+    is unavailable (e.g. defined in an interactive session) are never cached, and
+    neither is output compiled with passes that can't be described
+    (see OptimizationPass.describe).
+
+    When the total size of cached nodes exceeds max_size bytes, evict removes the
+    least recently used entries. Engine.compile calls it once after compiling
+    every callback.
+    """
+
+    def __init__(self, path, max_size: int = DEFAULT_MAX_CACHE_SIZE):
+        self.path = Path(path)
+        self.max_size = max_size
+
+    def get_engine_key(self, engine: Engine, optimizations) -> str | None:
+        """
+        Returns the part of the cache key shared by all callbacks of an engine,
+        or None if the engine's output can't be cached.
+        """
+        passes = [opt_pass.describe() for opt_pass in optimizations]
+        if None in passes:
+            return None
+        return _hash_json(
+            {
+                "sonolus": _get_library_hash(),
+                "script_ids": [_qualified_name(script) for script in engine.scripts],
+                "layouts": [
+                    [
+                        _describe_layout(script._metadata_.memory_type),
+                        _describe_layout(script._metadata_.shared_memory_type),
+                        _describe_layout(script._metadata_.data_type),
+                        script._metadata_.input,
+                    ]
+                    for script in engine.scripts
+                ],
+                "options": [
+                    [name, repr(option)]
+                    for name, option in engine.options._option_entries_.items()
+                ],
+                "buckets": [*engine.buckets._bucket_entries_],
+                "optimizations": passes,
+            }
+        )
+
+    def load(
+        self, script: Type[Script], callback_type: CallbackType, engine_key: str
+    ) -> SimpleNode | None:
+        try:
+            dependencies = json.loads(
+                self._dependencies_path(script, callback_type, engine_key).read_text(
+                    "utf-8"
+                )
+            )
+        except (OSError, ValueError):
+            return None
+        if not isinstance(dependencies, dict):
+            return None
+        key = _get_callback_key(script, callback_type, engine_key, dependencies)
+        if key is None:
+            return None
+        path = self._node_path(key)
+        try:
+            node = pickle.loads(path.read_bytes())
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        try:
+            # Refresh the access time used for eviction.
+            os.utime(path)
+        except OSError:
+            pass
+        return node
+
+    def store(
+        self,
+        script: Type[Script],
+        callback_type: CallbackType,
+        engine_key: str,
+        dependencies: Iterable,
+        node: SimpleNode,
+    ):
+        described = _describe_dependencies(dependencies)
+        if described is None:
+            return
+        key = _get_callback_key(script, callback_type, engine_key, described)
+        if key is None:
+            return
+        _atomic_write(self._node_path(key), pickle.dumps(node))
+        _atomic_write(
+            self._dependencies_path(script, callback_type, engine_key),
+            json.dumps(described).encode("utf-8"),
+        )
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_size."""
+        entries = []
+        for path in (self.path / "nodes").glob("*.pickle"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for directory in ("nodes", "dependencies"):
+            for path in (self.path / directory).glob("*"):
+                path.unlink(missing_ok=True)
+
+    def _node_path(self, key: str) -> Path:
+        return self.path / "nodes" / f"{key}.pickle"
+
+    def _dependencies_path(
+        self, script: Type[Script], callback_type: CallbackType, engine_key: str
+    ) -> Path:
+        # Keyed by the engine too, so compiling the same script with different
+        # settings doesn't replace the dependencies stored by the other.
+        name = _hash_json([_qualified_name(script), callback_type.name, engine_key])
+        return self.path / "dependencies" / f"{name}.json"
+
+
+def _get_callback_key(
+    script: Type[Script],
+    callback_type: CallbackType,
+    engine_key: str,
+    dependencies: dict,
+) -> str | None:
+    # Whole modules are hashed rather than just the dependencies, since those may
+    # read module level constants and call helpers defined alongside them or in
+    # the modules they import.
+    try:
+        definitions = dependencies["definitions"]
+        imported = dependencies["modules"]
+        modules = {}
+        for filename, qualname in definitions:
+            module = _get_module(filename)
+            if module is None or qualname not in module[1]:
+                return None
+            modules[filename] = module[0]
+        for filename in imported:
+            module = _get_module(filename)
+            if module is None:
+                return None
+            modules[filename] = module[0]
+    except (KeyError, TypeError, ValueError):
+        # Written by an older version.
+        return None
+    return _hash_json(
+        {
+            "engine": engine_key,
+            "script": _qualified_name(script),
+            "callback": callback_type.name,
+            "dependencies": dependencies,
+            "modules": sorted(modules.items()),
+        }
+    )
+
+
+def _describe_dependencies(dependencies: Iterable) -> dict | None:
+    described = set()
+    module_names = set()
+    for dependency in dependencies:
+        if isinstance(dependency, type):
+            # Generated types (e.g. from generics) have no source of their own,
+            # so fall back to the nearest base class that does.
+            for cls in dependency.__mro__:
+                filename = _get_filename(cls)
+                if filename is None or _is_library_file(filename):
+                    break
+                if _get_source(filename, cls.__qualname__) is not None:
+                    described.add((filename, cls.__qualname__))
+                    module_names.add(cls.__module__)
+                    break
+        else:
+            filename = _get_filename(dependency)
+            if filename is None:
+                return None
+            if _is_library_file(filename):
+                continue
+            if _get_source(filename, dependency.__qualname__) is None:
+                return None
+            described.add((filename, dependency.__qualname__))
+            module_names.add(dependency.__module__)
+    return {
+        "definitions": [[*entry] for entry in sorted(described)],
+        "modules": _get_imported_files(module_names),
+    }
+
+
+def _get_imported_files(module_names: Iterable[str]) -> list[str]:
+    """
+    Returns the files of the user modules with the given names and of the user
+    modules they import, directly or transitively.
+
+    Imports are found through the globals of the loaded modules, which hold the
+    imported modules and the functions, classes and other values imported from
+    them.
+    """
+    files = set()
+    visited = set()
+    pending = [*module_names]
+    while pending:
+        name = pending.pop()
+        if name in visited:
+            continue
+        visited.add(name)
+        module = sys.modules.get(name)
+        filename = _get_module_file(module)
+        if filename is None or not _is_user_file(filename):
+            continue
+        files.add(filename)
+        for value in [*vars(module).values()]:
+            if isinstance(value, type(sys)):
+                pending.append(value.__name__)
+            else:
+                imported_name = getattr(value, "__module__", None)
+                if isinstance(imported_name, str):
+                    pending.append(imported_name)
+    return sorted(files)
+
+
+def _get_module_file(module) -> str | None:
+    filename = getattr(module, "__file__", None)
+    if not isinstance(filename, str) or not filename.endswith(".py"):
+        return None
+    return str(Path(filename).resolve())
+
+
+def _get_filename(obj) -> str | None:
+    try:
+        filename = inspect.getsourcefile(obj)
+    except TypeError:
+        return None
+    if filename is None:
+        return None
+    return str(Path(filename).resolve())
+
+
+def _is_library_file(filename: str) -> bool:
+    return Path(filename).is_relative_to(_SONOLUS_ROOT)
+
+
+def _is_user_file(filename: str) -> bool:
+    path = Path(filename)
+    return not _is_library_file(filename) and not any(
+        path.is_relative_to(root) for root in _INSTALLED_ROOTS
+    )
+
+
+_module_cache: dict[str, tuple[tuple[int, int], str, dict[str, str]]] = {}
+
+
+def _get_module(filename: str) -> tuple[str, dict[str, str]] | None:
+    """
+    Returns the hash of the current source of a module and the source of each of
+    its definitions by qualname.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _module_cache.get(filename)
+    if cached is None or cached[0] != version:
+        try:
+            text = Path(filename).read_text("utf-8")
+            index = _index_source(text)
+        except (OSError, SyntaxError, ValueError):
+            return None
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        cached = version, digest, index
+        _module_cache[filename] = cached
+    return cached[1], cached[2]
+
+
+def _get_source(filename: str, qualname: str) -> str | None:
+    """Returns the current source of the definition with the given qualname."""
+    module = _get_module(filename)
+    if module is None:
+        return None
+    return module[1].get(qualname)
+
+
+def _index_source(text: str) -> dict[str, str]:
+    index = {}
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                qualname = prefix + child.name
+                index[qualname] = ast.get_source_segment(text, child)
+                visit(child, qualname + ".<locals>.")
+            elif isinstance(child, ast.ClassDef):
+                qualname = prefix + child.name
+                index[qualname] = ast.get_source_segment(text, child)
+                visit(child, qualname + ".")
+            else:
+                visit(child, prefix)
+
+    visit(ast.parse(text), "")
+    return index
+
+
+def _describe_layout(type_) -> list:
+    fields = getattr(type_, "_struct_fields_", None)
+    if fields is None:
+        return [_qualified_name(type_), type_._size_]
+    return [
+        _qualified_name(type_),
+        type_._size_,
+        [[field.name, field.offset, _describe_layout(field.type)] for field in fields],
+    ]
+
+
+def _qualified_name(obj) -> str:
+    return f"{obj.__module__}.{obj.__qualname__}"
+
+
+_library_hash: str | None = None
+
+
+def _get_library_hash() -> str:
+    global _library_hash
+    if _library_hash is None:
+        digest = hashlib.sha256()
+        for path in sorted(_SONOLUS_ROOT.rglob("*.py")):
+            digest.update(str(path.relative_to(_SONOLUS_ROOT)).encode("utf-8"))
+            digest.update(path.read_bytes())
+        _library_hash = digest.hexdigest()
+    return _library_hash
+
+
+def _hash_json(value) -> str:
+    return hashlib.sha256(json.dumps(value).encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
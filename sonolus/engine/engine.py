@@ -3,15 +3,27 @@ from __future__ import annotations
 import gzip
 import itertools
 import json
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Type
 
-from sonolus.backend.engine_node import finalize_cfg, get_engine_nodes
+from sonolus.backend.callback import CALLBACK_TYPES, CallbackType
+from sonolus.backend.cfg import CFG
+from sonolus.backend.compile_report import (
+    CallbackReport,
+    CompileReport,
+    ReportInstrumentation,
+)
+from sonolus.backend.engine_node import SimpleNode, finalize_cfg, get_engine_nodes
 from sonolus.backend.evaluation import CompilationInfo, evaluate_statement
 from sonolus.backend.ir import IRConst
 from sonolus.backend.optimization.optimization_pass import run_optimization_passes
-from sonolus.backend.optimization.optmization_presets import DEFAULT_OPTIMIZATION_PRESET
+from sonolus.backend.optimization.optmization_presets import (
+    DEFAULT_OPTIMIZATION_PRESET,
+    get_optimization_preset,
+)
+from sonolus.engine.cache import CompileCache
 from sonolus.engine.level import (
     CompiledEntity,
     CompiledEntityData,
@@ -39,28 +51,101 @@ class Engine:
         self.options = options
         self.ui = ui
 
-    def compile(self, optimizations=DEFAULT_OPTIMIZATION_PRESET):
+    def compile(
+        self,
+        optimizations=DEFAULT_OPTIMIZATION_PRESET,
+        *,
+        workers=None,
+        cache: CompileCache | None = None,
+        report: CompileReport | None = None,
+    ):
+        """
+        Compiles the engine.
+
+        optimizations is either a list of optimization passes or an optimization
+        level from 0 to 3 (see optmization_presets). The default level 1 runs the
+        basic passes once.
+
+        If workers is greater than 1, callbacks are compiled in a pool of that many
+        processes. The result is identical to a serial compilation.
+
+        If a cache is given, callbacks whose sources and dependencies are unchanged
+        since they were last compiled are loaded from it instead of recompiled.
+        The cache is not used if an optimization pass can't describe its settings.
+
+        If a report is given, statistics about each callback and optimization pass
+        are added to it.
+        """
+        optimizations = get_optimization_preset(optimizations)
         script_ids = {script: i for i, script in enumerate(self.scripts)}
-        nodes = []
-        compiled = {}
-        for script in self.scripts:
-            instance = script.create_for_evaluation()
-            callbacks = {}
-            for callback_type, callback in script._metadata_.callbacks.items():
-                compilation_info = CompilationInfo(
-                    callback=callback_type,
-                    script_ids=script_ids,
+        engine_key = (
+            cache.get_engine_key(self, optimizations) if cache is not None else None
+        )
+        if engine_key is None:
+            cache = None
+        tasks = [
+            (script_index, callback_type)
+            for script_index, script in enumerate(self.scripts)
+            for callback_type in script._metadata_.callbacks
+        ]
+        callback_reports = [
+            CallbackReport(self.scripts[script_index].__name__, callback_type.name)
+            if report is not None
+            else None
+            for script_index, callback_type in tasks
+        ]
+        track_allocations = report is not None and report.track_allocations
+        if workers is not None and workers > 1:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_compile_worker,
+                initargs=(
+                    self.scripts,
+                    optimizations,
+                    cache,
+                    engine_key,
+                    track_allocations,
+                ),
+            ) as executor:
+                worker_results = [
+                    *executor.map(
+                        _compile_callback_in_worker,
+                        [script_index for script_index, _ in tasks],
+                        [callback_type.name for _, callback_type in tasks],
+                        callback_reports,
+                    )
+                ]
+            results = [node for node, _ in worker_results]
+            callback_reports = [
+                callback_report for _, callback_report in worker_results
+            ]
+        else:
+            results = [
+                compile_callback(
+                    self.scripts[script_index],
+                    callback_type,
+                    script_ids,
+                    optimizations,
+                    cache,
+                    engine_key,
+                    callback_report,
+                    track_allocations,
+                )
+                for (script_index, callback_type), callback_report in zip(
+                    tasks, callback_reports
                 )
-                with compilation_info:
-                    result = callback(instance)
-                    if not isinstance(result, Primitive):
-                        result = Execute(result, Num(0))
-                    cfg = evaluate_statement(result)
-                    cfg = run_optimization_passes(cfg, optimizations)
-                    node = finalize_cfg(cfg)
-                    callbacks[callback_type.name] = node, callback._callback_order_
-                    nodes.append(node)
-            compiled[script] = callbacks
+            ]
+        if cache is not None:
+            cache.evict()
+        if report is not None:
+            report.callbacks.extend(callback_reports)
+        nodes = []
+        compiled = {script: {} for script in self.scripts}
+        for (script_index, callback_type), node in zip(tasks, results):
+            script = self.scripts[script_index]
+            callback = script._metadata_.callbacks[callback_type]
+            compiled[script][callback_type.name] = node, callback._callback_order_
+            nodes.append(node)
         compiled_nodes, mapping = get_engine_nodes(nodes)
         scripts = [
             CompiledScript(
@@ -104,11 +189,115 @@ class Engine:
             raw_data = [0.0] * entity_data.data.index + entity_data.data.values
             raw_data.extend([0.0] * (data_type._size_ - len(raw_data)))
             raw_data = raw_data[: data_type._size_]
-            data = data_type._from_flat_([IRConst(v) for v in raw_data])
+            data = data_type._from_flat_([IRConst.of(v) for v in raw_data])
             entities.append(Entity(script, data))
         return entities
 
 
+def compile_callback(
+    script: Type[Script],
+    callback_type: CallbackType,
+    script_ids: dict[Type[Script], int],
+    optimizations=DEFAULT_OPTIMIZATION_PRESET,
+    cache: CompileCache | None = None,
+    engine_key: str | None = None,
+    report: CallbackReport | None = None,
+    track_allocations: bool = False,
+) -> SimpleNode:
+    node = None
+    if cache is not None:
+        node = cache.load(script, callback_type, engine_key)
+    if node is None:
+        node = _compile_callback_uncached(
+            script,
+            callback_type,
+            script_ids,
+            optimizations,
+            cache,
+            engine_key,
+            report,
+            track_allocations,
+        )
+    elif report is not None:
+        report.cached = True
+    if report is not None:
+        report.set_result(node)
+    return node
+
+
+def _compile_callback_uncached(
+    script,
+    callback_type,
+    script_ids,
+    optimizations,
+    cache,
+    engine_key,
+    report,
+    track_allocations,
+) -> SimpleNode:
+    instrumentation = (
+        ReportInstrumentation(report, track_allocations) if report is not None else None
+    )
+    cfg, dependencies = trace_callback(script, callback_type, script_ids)
+    cfg = run_optimization_passes(cfg, optimizations, instrumentation)
+    if report is not None:
+        report.set_optimized_cfg(cfg)
+    node = finalize_cfg(cfg)
+    if cache is not None:
+        cache.store(script, callback_type, engine_key, dependencies, node)
+    return node
+
+
+def trace_callback(
+    script: Type[Script],
+    callback_type: CallbackType,
+    script_ids: dict[Type[Script], int],
+) -> tuple[CFG, set]:
+    """
+    Traces a callback into an unoptimized cfg, and returns it along with the
+    functions and value types reached while tracing.
+    """
+    callback = script._metadata_.callbacks[callback_type]
+    instance = script.create_for_evaluation()
+    with CompilationInfo(
+        callback=callback_type, script_ids=script_ids
+    ) as compilation_info:
+        result = callback(instance)
+        if not isinstance(result, Primitive):
+            result = Execute(result, Num(0))
+        cfg = evaluate_statement(result)
+    return cfg, compilation_info.dependencies
+
+
+_worker_args: tuple | None = None
+
+
+def _init_compile_worker(scripts, optimizations, cache, engine_key, track_allocations):
+    global _worker_args
+    _worker_args = scripts, optimizations, cache, engine_key, track_allocations
+
+
+def _compile_callback_in_worker(
+    script_index: int, callback_name: str, report: CallbackReport | None
+) -> tuple[SimpleNode, CallbackReport | None]:
+    scripts, optimizations, cache, engine_key, track_allocations = _worker_args
+    script_ids = {script: i for i, script in enumerate(scripts)}
+    callback_type = next(
+        value for value in CALLBACK_TYPES.values() if value.name == callback_name
+    )
+    node = compile_callback(
+        scripts[script_index],
+        callback_type,
+        script_ids,
+        optimizations,
+        cache,
+        engine_key,
+        report,
+        track_allocations,
+    )
+    return node, report
+
+
 @dataclass
 class CompiledEngine:
     options: list[Option]
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import traceback
+from pathlib import Path
+from types import ModuleType
+
+from sonolus.backend.optimization.optmization_presets import DEFAULT_OPTIMIZATION_PRESET
+from sonolus.engine.cache import CompileCache
+from sonolus.engine.engine import CompiledEngine, Engine
+
+
+class EngineWatcher:
+    """
+    Rebuilds an engine whenever one of its source files changes.
+
+    The engine is given as "module:attribute". Modules whose files are under root
+    (by default, the directory containing the engine module) are watched.
+    On a change, the changed modules and the watched modules depending on them are
+    reloaded, and the engine is recompiled using a compile cache,
+    so only callbacks that depend on the changed code are traced and optimized again.
+    """
+
+    def __init__(
+        self,
+        engine: str,
+        output,
+        *,
+        root=None,
+        cache: CompileCache | None = None,
+        optimizations=DEFAULT_OPTIMIZATION_PRESET,
+        workers: int | None = None,
+    ):
+        module_name, _, attribute = engine.partition(":")
+        if not attribute:
+            raise ValueError("Expected engine in the form 'module:attribute'.")
+        self.module_name = module_name
+        self.attribute = attribute
+        self.output = Path(output)
+        module = importlib.import_module(module_name)
+        if root is None:
+            root = Path(module.__file__).parent
+        self.root = Path(root).resolve()
+        if cache is None:
+            cache = CompileCache(self.root / ".sonolus_cache")
+        self.cache = cache
+        self.optimizations = optimizations
+        self.workers = workers
+        self.mtimes = self._get_mtimes()
+
+    @property
+    def engine(self) -> Engine:
+        return getattr(sys.modules[self.module_name], self.attribute)
+
+    def build(self) -> CompiledEngine:
+        compiled = self.engine.compile(
+            self.optimizations, workers=self.workers, cache=self.cache
+        )
+        self.output.mkdir(parents=True, exist_ok=True)
+        compiled.save(self.output)
+        return compiled
+
+    def poll(self) -> bool:
+        """Rebuilds the engine if a watched file changed and returns whether it did."""
+        mtimes = self._get_mtimes()
+        changed = {
+            name
+            for name, mtime in mtimes.items()
+            if self.mtimes.get(name) not in (None, mtime)
+        }
+        self.mtimes = mtimes
+        if not changed:
+            return False
+        for name in self._get_reload_order(changed):
+            importlib.reload(sys.modules[name])
+        self.build()
+        # Reloading may have imported new modules.
+        self.mtimes = self._get_mtimes()
+        return True
+
+    def run(self, interval: float = 0.5):
+        self._build_and_report()
+        while True:
+            time.sleep(interval)
+            start = time.perf_counter()
+            try:
+                if self.poll():
+                    print(f"Rebuilt in {time.perf_counter() - start:.2f}s")
+            except Exception:
+                traceback.print_exc()
+
+    def _build_and_report(self):
+        start = time.perf_counter()
+        try:
+            self.build()
+        except Exception:
+            traceback.print_exc()
+        else:
+            print(f"Built in {time.perf_counter() - start:.2f}s")
+
+    def _get_watched_modules(self) -> dict[str, ModuleType]:
+        modules = {}
+        for name, module in [*sys.modules.items()]:
+            if name in ("__main__", "__mp_main__"):
+                continue
+            filename = getattr(module, "__file__", None)
+            if filename is None:
+                continue
+            if Path(filename).resolve().is_relative_to(self.root):
+                modules[name] = module
+        return modules
+
+    def _get_mtimes(self) -> dict[str, int]:
+        mtimes = {}
+        for name, module in self._get_watched_modules().items():
+            try:
+                mtimes[name] = os.stat(module.__file__).st_mtime_ns
+            except OSError:
+                continue
+        return mtimes
+
+    def _get_reload_order(self, changed: set[str]) -> list[str]:
+        modules = self._get_watched_modules()
+        dependencies = {
+            name: _get_module_dependencies(module, modules)
+            for name, module in modules.items()
+        }
+        dependents = {name: set() for name in modules}
+        for name, deps in dependencies.items():
+            for dep in deps:
+                dependents[dep].add(name)
+
+        to_reload = set()
+        queue = [*changed]
+        while queue:
+            name = queue.pop()
+            if name in to_reload or name not in modules:
+                continue
+            to_reload.add(name)
+            queue.extend(dependents[name])
+
+        # Dependencies are reloaded before the modules using them.
+        order = []
+        visited = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+            for dep in sorted(dependencies[name]):
+                if dep in to_reload:
+                    visit(dep)
+            order.append(name)
+
+        for name in sorted(to_reload):
+            visit(name)
+        return order
+
+
+def _get_module_dependencies(
+    module: ModuleType, modules: dict[str, ModuleType]
+) -> set[str]:
+    result = set()
+    for value in [*vars(module).values()]:
+        if isinstance(value, ModuleType):
+            name = value.__name__
+        else:
+            name = getattr(value, "__module__", None)
+        if name in modules and name != module.__name__:
+            result.add(name)
+    return result
+
+
+def watch(engine: str, output, *, interval: float = 0.5, **kwargs):
+    """Builds the engine to output and rebuilds it whenever its sources change."""
+    EngineWatcher(engine, output, **kwargs).run(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build an engine and rebuild it when its sources change."
+    )
+    parser.add_argument("engine", help="The engine to build, as module:attribute.")
+    parser.add_argument("output", help="The directory to write the engine to.")
+    parser.add_argument("--root", default=None, help="The directory to watch.")
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "-O",
+        dest="level",
+        type=int,
+        default=1,
+        choices=range(4),
+        help="The optimization level.",
+    )
+    args = parser.parse_args()
+    sys.path.insert(0, os.getcwd())
+    watch(
+        args.engine,
+        args.output,
+        interval=args.interval,
+        root=args.root,
+        workers=args.workers,
+        optimizations=args.level,
+    )
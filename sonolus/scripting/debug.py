@@ -20,7 +20,7 @@ __all__ = (
 )
 
 
-is_debug: Bool = Bool._create_(IRFunc("IsDebug", []))._set_static_()
+is_debug: Bool = Bool._create_(IRFunc.of("IsDebug", []))._set_static_()
 
 
 @sls_func(ast=False)
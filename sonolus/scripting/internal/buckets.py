@@ -117,7 +117,7 @@ class BucketConfig:
                 raise TypeError("Expected all class members to be buckets.")
             bucket_entries[k] = v
             accessor = BucketData._create_(
-                Location(MemoryBlock.LEVEL_BUCKET, IRConst(0), offset, None),
+                Location(MemoryBlock.LEVEL_BUCKET, IRConst.of(0), offset, None),
             )._set_static_()
             accessor.index = index
             setattr(cls, k, accessor)
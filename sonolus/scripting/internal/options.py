@@ -190,7 +190,7 @@ class OptionConfig:
                 cls,
                 k,
                 option_type._create_(
-                    Location(MemoryBlock.LEVEL_OPTION, IRConst(0), offset, None)
+                    Location(MemoryBlock.LEVEL_OPTION, IRConst.of(0), offset, None)
                 )._set_static_(),
             )
             offset += option_type._size_
@@ -33,7 +33,9 @@ class Pointer(Struct, Generic[T]):
             and (index := self.index.constant()) is not None
             and self._attributes_.is_static
         ):
-            return type_._create_(Location(block, IRConst(0), index, 1))._set_static_()
+            return type_._create_(
+                Location(block, IRConst.of(0), index, 1)
+            )._set_static_()
         return type_._create_(
             Location(self.block.ir(), self.index.ir(), 0, None)
         )._set_parent_(self)
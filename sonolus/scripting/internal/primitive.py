@@ -57,9 +57,9 @@ class Primitive(Value):
     def ir(self) -> IRValueType:
         match self._value_:
             case Location() as loc:
-                return IRGet(loc)
+                return IRGet.of(loc)
             case int() | float() | bool() as constant:
-                return IRConst(float(constant))
+                return IRConst.of(float(constant))
             case IRNode() as node:
                 return node
             case _:
@@ -69,7 +69,7 @@ class Primitive(Value):
         other = convert_value(other, type(self))
         truthiness = self is other
         result = (
-            Bool._create_(IRFunc("Equal", [self.ir(), other.ir()]))
+            Bool._create_(IRFunc.of("Equal", [self.ir(), other.ir()]))
             ._set_parent_(Execute(self, other))
             .copy()
         )
@@ -80,7 +80,7 @@ class Primitive(Value):
         other = convert_value(other, type(self))
         truthiness = self is not other
         result = (
-            Bool._create_(IRFunc("NotEqual", [self.ir(), other.ir()]))
+            Bool._create_(IRFunc.of("NotEqual", [self.ir(), other.ir()]))
             ._set_parent_(Execute(self, other))
             .copy()
         )
@@ -101,11 +101,12 @@ class Primitive(Value):
         return type(self)(runner(self.ir()))._set_static_()
 
     def _check_readable(self):
-        if CompilationInfo._current is None:
+        compilation_info = CompilationInfo.current()
+        if compilation_info is None:
             return
         if not isinstance(self._value_, Location):
             return
-        callback_type = CompilationInfo._current.callback
+        callback_type = compilation_info.callback
         if (
             isinstance(self._value_.ref, int)
             and self._value_.ref not in callback_type.readable_blocks
@@ -115,11 +116,12 @@ class Primitive(Value):
             )
 
     def _check_writable(self):
-        if CompilationInfo._current is None:
+        compilation_info = CompilationInfo.current()
+        if compilation_info is None:
             return
         if not isinstance(self._value_, Location):
             return
-        callback_type = CompilationInfo._current.callback
+        callback_type = compilation_info.callback
         if (
             isinstance(self._value_.ref, int)
             and self._value_.ref not in callback_type.writable_blocks
@@ -368,7 +370,7 @@ class Number(Primitive):
 def invoke_builtin(
     name: str, arguments: Sequence[Primitive], type_: Type[Primitive] = None
 ) -> Any:
-    node = IRFunc(name=name, args=[arg.ir() for arg in arguments])
+    node = IRFunc.of(name, [arg.ir() for arg in arguments])
     if type_ is None:
         return Void(node=node)._set_parent_(Execute(*arguments))
     else:
@@ -112,19 +112,19 @@ class Script(Statement):
         result = cls.__new__(cls)
         Statement.__init__(result)
         result.memory = meta.memory_type._create_(
-            Location(MemoryBlock.ENTITY_MEMORY, IRConst(0), 0, 1)
+            Location(MemoryBlock.ENTITY_MEMORY, IRConst.of(0), 0, 1)
         )._set_static_()
         result.shared_memory = meta.shared_memory_type._create_(
-            Location(MemoryBlock.ENTITY_SHARED_MEMORY, IRConst(0), 0, 1)
+            Location(MemoryBlock.ENTITY_SHARED_MEMORY, IRConst.of(0), 0, 1)
         )._set_static_()
         result.data = meta.data_type._create_(
-            Location(MemoryBlock.ENTITY_DATA, IRConst(0), 0, 1)
+            Location(MemoryBlock.ENTITY_DATA, IRConst.of(0), 0, 1)
         )._set_static_()
         result.info = EntityInfo._create_(
-            Location(MemoryBlock.ENTITY_INFO, IRConst(0), 0, 1)
+            Location(MemoryBlock.ENTITY_INFO, IRConst.of(0), 0, 1)
         )._set_static_()
         result.input = EntityInput._create_(
-            Location(MemoryBlock.ENTITY_INPUT, IRConst(0), 0, 1)
+            Location(MemoryBlock.ENTITY_INPUT, IRConst.of(0), 0, 1)
         )._set_static_()
         result._attributes_.is_static = True
         return result
@@ -132,7 +132,7 @@ class Script(Statement):
     @classmethod
     def spawn(cls, data) -> Void:
         data = convert_value(data, cls._metadata_.memory_type)
-        node = IRFunc("Spawn", [cls._get_archetype_id(), *data._flatten_()])
+        node = IRFunc.of("Spawn", [cls._get_archetype_id(), *data._flatten_()])
         return Void(node)._set_parent_(data)
 
     @classmethod
@@ -165,15 +165,15 @@ class Script(Statement):
     def _get_archetype_id(cls) -> IRValueType:
         compilation_info = CompilationInfo.get()
         if compilation_info.callback.name == "_debug_":
-            return IRGet(
-                Location(TempRef(f"ScriptIndex${cls.__name__}", 1), IRConst(0), 0, 1)
+            return IRGet.of(
+                Location(TempRef(f"ScriptIndex${cls.__name__}", 1), IRConst.of(0), 0, 1)
             )
         else:
             if cls not in compilation_info.script_ids:
                 raise KeyError(
                     f"Script {cls.__name__} is not part of the current compilation."
                 )
-            return IRConst(compilation_info.script_ids[cls])
+            return IRConst.of(compilation_info.script_ids[cls])
 
 
 def callback_function(fn=None, /, *, order: int = 0, preprocessor=sls_func):
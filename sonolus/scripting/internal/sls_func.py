@@ -3,6 +3,7 @@ import inspect
 from types import FunctionType
 from typing import Callable, TypeVar, get_type_hints, overload
 
+from sonolus.backend.evaluation import CompilationInfo
 from sonolus.scripting.internal.ast_function import process_ast_function
 from sonolus.scripting.internal.statement import Statement
 from sonolus.scripting.internal.value import convert_value, Value
@@ -62,6 +63,9 @@ def _lazy_process(fn, ast, return_parameter):
 
     @functools.wraps(fn)
     def wrapped(*args, **kwargs):
+        compilation_info = CompilationInfo.current()
+        if compilation_info is not None:
+            compilation_info.dependencies.add(fn)
         try:
             f = get_processed()
         except Exception as e:
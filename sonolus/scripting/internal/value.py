@@ -70,6 +70,9 @@ class Value(Statement):
         Returns a new instance of this class as an alternative to __init__,
         which may take other arguments.
         """
+        compilation_info = CompilationInfo.current()
+        if compilation_info is not None:
+            compilation_info.dependencies.add(cls)
         result = cls.__new__(cls)
         Value.__init__(result, attributes=attributes)
         result._value_ = value
@@ -225,7 +228,7 @@ def transmute(value: Value, type_: Type[TValue], /) -> TValue:
 
 
 def _new_temp_loc(name: str):
-    return Location(_new_temp_ref(name), IRConst(0), 0, 1)
+    return Location(_new_temp_ref(name), IRConst.of(0), 0, 1)
 
 
 def _new_temp_ref(name: str):
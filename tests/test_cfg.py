@@ -0,0 +1,276 @@
+import itertools
+import pickle
+import sys
+
+from sonolus.backend.cfg import CFG, CFGEdge, CFGNode
+from sonolus.backend.cfg_traversal import (
+    get_orders,
+    traverse_postorder,
+    traverse_preorder,
+)
+from sonolus.backend.engine_node import (
+    FunctionNode,
+    SimpleNode,
+    ValueNode,
+    finalize_cfg,
+    get_engine_nodes,
+)
+from sonolus.backend.interpreter import CFGInterpreter, SimpleNodeInterpreter
+from sonolus.backend.ir import IRConst, IRFunc, IRGet, IRSet, Location, MemoryBlock
+
+
+def chain(length: int) -> tuple[CFG, list[CFGNode]]:
+    nodes = [CFGNode([], None) for _ in range(length)]
+    cfg = CFG(nodes[0], nodes[-1])
+    nodes[0].is_entry = True
+    nodes[-1].is_exit = True
+    for a, b in zip(nodes, nodes[1:]):
+        cfg.add_edge(CFGEdge(a, b))
+    return cfg, nodes
+
+
+def diamond() -> tuple[CFG, list[CFGNode]]:
+    entry, t_branch, f_branch, exit_node = [CFGNode([], None) for _ in range(4)]
+    cfg = CFG(entry, exit_node)
+    cfg.add_edge(CFGEdge(entry, t_branch))
+    cfg.add_edge(CFGEdge(entry, f_branch, 0))
+    cfg.add_edge(CFGEdge(t_branch, exit_node))
+    cfg.add_edge(CFGEdge(f_branch, exit_node))
+    return cfg, [entry, t_branch, f_branch, exit_node]
+
+
+class TestTraversal:
+    def test_orders(self):
+        cfg, (entry, t_branch, f_branch, exit_node) = diamond()
+        assert [*traverse_preorder(cfg)] == [entry, t_branch, exit_node, f_branch]
+        assert [*traverse_postorder(cfg)] == [exit_node, t_branch, f_branch, entry]
+        assert get_orders(cfg).reverse_postorder == [
+            entry,
+            f_branch,
+            t_branch,
+            exit_node,
+        ]
+
+    def test_deep_cfg(self):
+        length = sys.getrecursionlimit() * 2
+        cfg, nodes = chain(length)
+        assert [*traverse_preorder(cfg)] == nodes
+        assert [*traverse_postorder(cfg)] == nodes[::-1]
+
+    def test_orders_cached_until_edges_change(self):
+        cfg, (entry, t_branch, f_branch, exit_node) = diamond()
+        orders = get_orders(cfg)
+        assert get_orders(cfg) is orders
+        cfg.remove_edge(CFGEdge(entry, f_branch, 0))
+        assert get_orders(cfg) is not orders
+        assert get_orders(cfg).preorder == [entry, t_branch, exit_node]
+
+
+def _test_value(index: int):
+    return IRGet.of(Location(MemoryBlock.LEVEL_MEMORY, IRConst.of(index), 0, 1))
+
+
+def _func_names(node: SimpleNode) -> set[str]:
+    if not isinstance(node, FunctionNode):
+        return set()
+    return {node.func}.union(*(_func_names(arg) for arg in node.args))
+
+
+def _memory(index: int) -> Location:
+    return Location(MemoryBlock.LEVEL_MEMORY, IRConst.of(index), 0, 1)
+
+
+def _add_to(index: int, amount: float) -> IRSet:
+    value = IRFunc.of("Add", [IRGet.of(_memory(index)), IRConst.of(amount)])
+    return IRSet(_memory(index), value)
+
+
+def _count_visits(cfg: CFG, nodes: list[CFGNode]):
+    # Each node counts its visits, so the order of evaluation is observable.
+    for i, node in enumerate(nodes):
+        node.body = [*node.body, _add_to(4 + i, 1)]
+    cfg.exit_node.test = _test_value(0)
+
+
+def _assert_finalized_matches(cfg: CFG, result: SimpleNode):
+    """
+    Checks that a finalized cfg has the same result and memory as the cfg itself,
+    for every combination of small values of the first two memory values.
+    """
+    for values in itertools.product(range(4), repeat=2):
+        expected = {MemoryBlock.LEVEL_MEMORY: [*values] + [0] * 16}
+        actual = {MemoryBlock.LEVEL_MEMORY: [*values] + [0] * 16}
+        assert SimpleNodeInterpreter(blocks=actual).run_node(result) == (
+            CFGInterpreter(blocks=expected).run(cfg)
+        ), values
+        assert actual == expected, values
+
+
+class TestFinalize:
+    def test_branches_structured(self):
+        cfg, nodes = diamond()
+        entry, *_, exit_node = nodes
+        entry.is_entry = True
+        exit_node.is_exit = True
+        entry.test = _test_value(0)
+        _count_visits(cfg, nodes)
+        result = finalize_cfg(cfg)
+        assert "If" in _func_names(result)
+        assert "JumpLoop" not in _func_names(result)
+        _assert_finalized_matches(cfg, result)
+
+    def test_loop_structured(self):
+        entry, header, body, exit_node = [CFGNode([], None) for _ in range(4)]
+        entry.is_entry = True
+        exit_node.is_exit = True
+        header.test = _test_value(0)
+        cfg = CFG(entry, exit_node)
+        cfg.add_edge(CFGEdge(entry, header))
+        cfg.add_edge(CFGEdge(header, body))
+        cfg.add_edge(CFGEdge(header, exit_node, 0))
+        cfg.add_edge(CFGEdge(body, header))
+        _count_visits(cfg, [entry, header, body, exit_node])
+        body.body.append(_add_to(0, -1))
+        header.test = IRFunc.of("Greater", [_test_value(0), IRConst.of(0)])
+        result = finalize_cfg(cfg)
+        assert "While" in _func_names(result)
+        assert "JumpLoop" not in _func_names(result)
+        _assert_finalized_matches(cfg, result)
+
+    def test_loop_with_several_exits_falls_back(self):
+        entry, header, body, early_exit, exit_node = [
+            CFGNode([], None) for _ in range(5)
+        ]
+        entry.is_entry = True
+        exit_node.is_exit = True
+        header.test = _test_value(0)
+        body.test = _test_value(1)
+        cfg = CFG(entry, exit_node)
+        cfg.add_edge(CFGEdge(entry, header))
+        cfg.add_edge(CFGEdge(header, body))
+        cfg.add_edge(CFGEdge(header, exit_node, 0))
+        cfg.add_edge(CFGEdge(body, header))
+        cfg.add_edge(CFGEdge(body, early_exit, 0))
+        cfg.add_edge(CFGEdge(early_exit, exit_node))
+        _count_visits(cfg, [entry, header, body, early_exit, exit_node])
+        header.test = IRFunc.of("Greater", [_test_value(0), IRConst.of(0)])
+        body.body.append(_add_to(0, -1))
+        body.test = IRFunc.of("NotEqual", [_test_value(0), _test_value(1)])
+        result = finalize_cfg(cfg)
+        assert "JumpLoop" in _func_names(result)
+        assert "While" not in _func_names(result)
+        _assert_finalized_matches(cfg, result)
+
+    def test_irreducible_falls_back(self):
+        entry, a, b, exit_node = [CFGNode([], None) for _ in range(4)]
+        entry.is_entry = True
+        exit_node.is_exit = True
+        entry.test = _test_value(0)
+        a.test = _test_value(1)
+        cfg = CFG(entry, exit_node)
+        cfg.add_edge(CFGEdge(entry, a))
+        cfg.add_edge(CFGEdge(entry, b, 0))
+        cfg.add_edge(CFGEdge(a, b))
+        cfg.add_edge(CFGEdge(a, exit_node, 0))
+        cfg.add_edge(CFGEdge(b, a))
+        _count_visits(cfg, [entry, a, b, exit_node])
+        a.body.append(_add_to(1, -1))
+        a.test = IRFunc.of("Greater", [_test_value(1), IRConst.of(0)])
+        result = finalize_cfg(cfg)
+        assert isinstance(result, FunctionNode) and result.func == "JumpLoop"
+        _assert_finalized_matches(cfg, result)
+
+    def test_dense_switch_indexed(self):
+        entry, *branches, exit_node = [CFGNode([], None) for _ in range(5)]
+        entry.is_entry = True
+        exit_node.is_exit = True
+        entry.test = _test_value(0)
+        cfg = CFG(entry, exit_node)
+        for condition, branch in zip([None, 1, 2, 3], branches):
+            cfg.add_edge(CFGEdge(entry, branch, condition))
+            cfg.add_edge(CFGEdge(branch, exit_node))
+        _count_visits(cfg, [entry, *branches, exit_node])
+        result = finalize_cfg(cfg)
+        names = _func_names(result)
+        assert "SwitchIntegerWithDefault" in names
+        assert "Subtract" not in names
+        _assert_finalized_matches(cfg, result)
+
+    def test_switch_without_default_indexed(self):
+        entry, *branches, exit_node = [CFGNode([], None) for _ in range(6)]
+        entry.is_entry = True
+        exit_node.is_exit = True
+        entry.test = _test_value(0)
+        cfg = CFG(entry, exit_node)
+        # Every value of the test has a branch, so the cfg doesn't end early.
+        for condition, branch in zip([0, 1, 2, 3], branches):
+            cfg.add_edge(CFGEdge(entry, branch, condition))
+            cfg.add_edge(CFGEdge(branch, exit_node))
+        _count_visits(cfg, [entry, *branches, exit_node])
+        result = finalize_cfg(cfg)
+        names = _func_names(result)
+        assert "SwitchInteger" in names
+        assert "JumpLoop" in names
+        _assert_finalized_matches(cfg, result)
+
+    def test_smaller_jump_loop_kept(self):
+        nodes = [CFGNode([], None) for _ in range(4)]
+        entry, first, second, exit_node = nodes
+        entry.is_entry = True
+        exit_node.is_exit = True
+        cfg = CFG(entry, exit_node)
+        # The entry loops on itself, and is followed by a loop with several exits,
+        # which is emitted as a JumpLoop after a While. A single JumpLoop for the
+        # whole cfg takes fewer engine nodes.
+        for node, test, targets in [
+            (entry, 4, [first, entry]),
+            (first, 5, [exit_node, second, first]),
+            (second, 6, [exit_node, first]),
+        ]:
+            node.test = _test_value(test)
+            cfg.add_edge(CFGEdge(node, targets[0]))
+            for condition, target in enumerate(targets[1:]):
+                cfg.add_edge(CFGEdge(node, target, condition))
+        _count_visits(cfg, nodes)
+        result = finalize_cfg(cfg)
+        assert result == finalize_cfg(cfg, structured=False)
+        assert "While" not in _func_names(result)
+        _assert_finalized_matches(cfg, result)
+
+    def test_sparse_switch_compared(self):
+        entry, *branches, exit_node = [CFGNode([], None) for _ in range(5)]
+        entry.is_entry = True
+        exit_node.is_exit = True
+        entry.test = _test_value(0)
+        cfg = CFG(entry, exit_node)
+        for condition, branch in zip([None, 1, 50, 100], branches):
+            cfg.add_edge(CFGEdge(entry, branch, condition))
+            cfg.add_edge(CFGEdge(branch, exit_node))
+        _count_visits(cfg, [entry, *branches, exit_node])
+        result = finalize_cfg(cfg)
+        names = _func_names(result)
+        assert "SwitchWithDefault" in names
+        assert "SwitchIntegerWithDefault" not in names
+        _assert_finalized_matches(cfg, result)
+
+
+def _nested_adds(depth: int) -> SimpleNode:
+    node = ValueNode(0)
+    for i in range(depth):
+        node = FunctionNode("Add", (node, ValueNode(i % 3)))
+    return node
+
+
+class TestEngineNodes:
+    def test_equal_nodes_deduplicated(self):
+        # Equal but distinct subtrees share engine nodes.
+        root = FunctionNode("Execute", (_nested_adds(50), _nested_adds(50)))
+        nodes, mapping = get_engine_nodes([root, _nested_adds(50)])
+        assert len(nodes) == 1 + 50 + 3
+        assert nodes[mapping[root]]["args"] == [mapping[_nested_adds(50)]] * 2
+
+    def test_pickled_nodes_are_equal(self):
+        node = _nested_adds(10)
+        loaded = pickle.loads(pickle.dumps(node))
+        assert loaded == node and hash(loaded) == hash(node)
+        assert loaded != _nested_adds(9)
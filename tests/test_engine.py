@@ -0,0 +1,377 @@
+import functools
+import importlib
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmarks.engines import control_flow_engine, engine
+from sonolus.backend.compile_report import CompileReport
+from sonolus.backend.engine_node import FunctionNode, finalize_cfg
+from sonolus.backend.interpreter import CFGInterpreter, SimpleNodeInterpreter
+from sonolus.backend.ir import MemoryBlock
+from sonolus.backend.optimization.allocate import Allocate, InterferenceAllocate
+from sonolus.backend.optimization.if_to_switch import IfToSwitch
+from sonolus.backend.optimization.optimization_pass import (
+    FixedPoint,
+    run_optimization_passes,
+)
+from sonolus.backend.optimization.optmization_presets import (
+    DEFAULT_REWRITE_RULES,
+    DEFAULT_OPTIMIZATION_PRESET,
+    get_optimization_preset,
+)
+from sonolus.backend.optimization.peephole import (
+    Call,
+    Capture,
+    Peephole,
+    RewriteRule,
+)
+from sonolus.backend.optimization.strength_reduction import STRENGTH_REDUCTION_RULES
+from sonolus.engine.cache import CompileCache
+from sonolus.engine.engine import trace_callback
+from sonolus.engine.watch import EngineWatcher
+
+
+def dump_engine_data(compiled):
+    return json.dumps(compiled.get_data())
+
+
+def _run_callback(cfg, seed):
+    """
+    Runs a compiled callback with memory filled with random values, and returns
+    its result, the memory it left behind and the effects it had, in order.
+    """
+    interpreter, blocks, effects = _make_interpreter(CFGInterpreter, seed)
+    return interpreter.run(cfg), blocks, effects
+
+
+def _run_finalized(node, seed):
+    """As _run_callback, but runs the finalized node of a callback."""
+    interpreter, blocks, effects = _make_interpreter(SimpleNodeInterpreter, seed)
+    return interpreter.run_node(node), blocks, effects
+
+
+def _make_interpreter(interpreter_type, seed):
+    rng = random.Random(seed)
+    blocks = {
+        block: [rng.randint(0, 6) for _ in range(256)]
+        for block in MemoryBlock
+        if block not in (MemoryBlock.TEMPORARY_MEMORY, MemoryBlock.TEMPORARY_DATA)
+    }
+    effects = []
+    interpreter = interpreter_type(
+        blocks={
+            **blocks,
+            MemoryBlock.TEMPORARY_MEMORY: [0] * 4096,
+            MemoryBlock.TEMPORARY_DATA: [0] * 4096,
+        },
+        functions={"Draw": lambda args: effects.append(("Draw", args)) or 0},
+        seed=seed,
+    )
+    return interpreter, blocks, effects
+
+
+def _func_names(node) -> set[str]:
+    if not isinstance(node, FunctionNode):
+        return set()
+    return {node.func}.union(*(_func_names(arg) for arg in node.args))
+
+
+class _ExternalAllocate(Allocate):
+    """An allocation pass defined outside sonolus, which can't be described."""
+
+
+class TestEngineCompile:
+    def test_compile_is_deterministic(self):
+        assert dump_engine_data(engine.compile()) == dump_engine_data(engine.compile())
+
+    def test_parallel_compile_matches_serial(self):
+        assert dump_engine_data(engine.compile(workers=2)) == dump_engine_data(
+            engine.compile()
+        )
+
+    def test_cached_compile_matches_uncached(self, tmp_path):
+        cache = CompileCache(tmp_path)
+        expected = dump_engine_data(engine.compile())
+        assert dump_engine_data(engine.compile(cache=cache)) == expected
+        assert [*(tmp_path / "nodes").iterdir()]
+        assert dump_engine_data(engine.compile(cache=cache)) == expected
+
+    def test_cache_reused_across_optimizations(self, tmp_path, monkeypatch):
+        cache = CompileCache(tmp_path)
+        optimizations = [[Allocate()], DEFAULT_OPTIMIZATION_PRESET]
+        engine.compile(optimizations[0], cache=cache)
+        callback_count = len([*(tmp_path / "dependencies").iterdir()])
+        engine.compile(optimizations[1], cache=cache)
+        # Each set of passes keeps its own dependencies rather than replacing the
+        # other's.
+        assert len([*(tmp_path / "dependencies").iterdir()]) == 2 * callback_count
+        stores = []
+        monkeypatch.setattr(cache, "store", lambda *args: stores.append(args))
+        for passes in optimizations:
+            engine.compile(passes, cache=cache)
+        assert not stores
+
+    def test_compile_report(self, tmp_path):
+        report = CompileReport()
+        engine.compile(report=report)
+        assert [(c.script, c.callback) for c in report.callbacks] == [
+            ("Note", "shouldSpawn"),
+            ("Note", "initialize"),
+            ("Note", "updateParallel"),
+            ("Follower", "updateSequential"),
+        ]
+        for callback in report.callbacks:
+            assert [p.name for p in callback.passes] == [
+                type(p).__name__ for p in DEFAULT_OPTIMIZATION_PRESET
+            ]
+            assert callback.engine_node_count > 0
+            assert callback.temporary_memory > 0
+        report.dump(tmp_path / "report.json")
+        assert json.loads((tmp_path / "report.json").read_text()) == report.to_dict()
+
+    def test_cache_eviction(self, tmp_path, monkeypatch):
+        cache = CompileCache(tmp_path, max_size=0)
+        evictions = []
+        evict = cache.evict
+        monkeypatch.setattr(cache, "evict", lambda: evictions.append(evict()))
+        engine.compile(cache=cache)
+        assert not [*(tmp_path / "nodes").iterdir()]
+        # Eviction runs once per compilation rather than once per callback.
+        assert len(evictions) == 1
+
+    def test_cache_keyed_by_pass_settings(self, tmp_path):
+        cache = CompileCache(tmp_path)
+        assert cache.get_engine_key(
+            engine, [FixedPoint([], max_iterations=1)]
+        ) != cache.get_engine_key(engine, [FixedPoint([], max_iterations=2)])
+        assert cache.get_engine_key(engine, [IfToSwitch()]) != cache.get_engine_key(
+            engine, [IfToSwitch(min_cases=3)]
+        )
+        assert cache.get_engine_key(
+            engine, [Peephole(DEFAULT_REWRITE_RULES)]
+        ) != cache.get_engine_key(engine, [Peephole(STRENGTH_REDUCTION_RULES)])
+
+        # Passes defined outside sonolus can't be described, so the cache is
+        # bypassed.
+        passes = [_ExternalAllocate()]
+        assert cache.get_engine_key(engine, passes) is None
+        engine.compile(passes, cache=cache)
+        assert not (tmp_path / "nodes").exists()
+
+        # Neither can rewrite rules defined outside sonolus.
+        passes = [Peephole([*DEFAULT_REWRITE_RULES]), Allocate()]
+        passes[0].rules.append(
+            RewriteRule(Call("Negate", Call("Negate", Capture("x"))), lambda x: x)
+        )
+        assert cache.get_engine_key(engine, passes) is None
+
+    def test_optimization_levels(self):
+        node_counts = [len(engine.compile(level).nodes) for level in range(4)]
+        assert node_counts[0] > node_counts[1] >= node_counts[2]
+        # O3 unrolls loops, so it may be larger than O2.
+        assert node_counts[0] > node_counts[3]
+        assert dump_engine_data(engine.compile(1)) == dump_engine_data(
+            engine.compile(DEFAULT_OPTIMIZATION_PRESET)
+        )
+
+    def test_default_level_matches_original_pipeline(self, monkeypatch):
+        # Recorded from the compiler before optimization levels were added.
+        # Callbacks are lowered to a JumpLoop as they were then, since the
+        # structured lowering of finalize_cfg changes the nodes but not the
+        # optimized callbacks they are lowered from.
+        recorded = json.loads(
+            (Path(__file__).parent / "data" / "o1_engine_data.json").read_text()
+        )
+        monkeypatch.setattr(
+            "sonolus.engine.engine.finalize_cfg",
+            functools.partial(finalize_cfg, structured=False),
+        )
+        assert engine.compile().get_data() == recorded["engine"]
+        assert (
+            control_flow_engine.compile().get_data()
+            == recorded["control_flow_engine"]
+        )
+
+    def test_optimization_levels_preserve_behavior(self):
+        script_ids = {script: i for i, script in enumerate(engine.scripts)}
+        for script in engine.scripts:
+            for callback_type in script._metadata_.callbacks:
+                for seed in range(8):
+                    results = []
+                    for level in (0, 3):
+                        cfg, _ = trace_callback(script, callback_type, script_ids)
+                        cfg = run_optimization_passes(
+                            cfg, get_optimization_preset(level)
+                        )
+                        results.append(_run_callback(cfg, seed))
+                    assert results[0] == results[1], (
+                        script.__name__,
+                        callback_type.name,
+                        seed,
+                    )
+
+    def test_finalized_nodes_preserve_behavior(self):
+        func_names = set()
+        for tested_engine in (engine, control_flow_engine):
+            script_ids = {script: i for i, script in enumerate(tested_engine.scripts)}
+            for script in tested_engine.scripts:
+                for callback_type in script._metadata_.callbacks:
+                    for level in range(4):
+                        cfg, _ = trace_callback(script, callback_type, script_ids)
+                        cfg = run_optimization_passes(
+                            cfg, get_optimization_preset(level)
+                        )
+                        node = finalize_cfg(cfg)
+                        jump_loop = finalize_cfg(cfg, structured=False)
+                        func_names |= _func_names(node)
+                        for seed in range(4):
+                            expected = _run_callback(cfg, seed)
+                            assert _run_finalized(node, seed) == expected, (
+                                script.__name__,
+                                callback_type.name,
+                                level,
+                                seed,
+                            )
+                            assert _run_finalized(jump_loop, seed) == expected
+        assert {"If", "While", "JumpLoop", "SwitchIntegerWithDefault"} <= func_names
+
+    def test_temporary_memory_reused(self):
+        unoptimized, optimized = CompileReport(), CompileReport()
+        engine.compile([Allocate()], report=unoptimized)
+        engine.compile([InterferenceAllocate()], report=optimized)
+        for before, after in zip(unoptimized.callbacks, optimized.callbacks):
+            assert after.temporary_memory <= before.temporary_memory
+        assert sum(c.temporary_memory for c in optimized.callbacks) < sum(
+            c.temporary_memory for c in unoptimized.callbacks
+        )
+
+    def test_invalid_optimization_level(self):
+        with pytest.raises(ValueError):
+            engine.compile(4)
+
+
+_CACHED_ENGINE_SOURCE = """
+from sonolus.core import *
+from benchmarks.engines import Buckets, Options, engine as base_engine
+from sonolus.engine.engine import Engine
+from cached_helpers import get_offset
+
+SCALE = 1
+
+
+class Cached(Script):
+    memory: Num
+    shared_memory: Num
+    data: Num
+
+    @callback_function
+    def update_parallel(self):
+        self.memory @= self.data * SCALE + get_offset()
+
+
+engine = Engine([Cached], Buckets, Options, base_engine.ui)
+"""
+
+_CACHED_HELPERS_SOURCE = """
+OFFSET = 1
+
+
+def get_offset():
+    return OFFSET
+"""
+
+
+class TestCompileCache:
+    @pytest.fixture(autouse=True)
+    def modules(self, tmp_path, monkeypatch):
+        monkeypatch.syspath_prepend(str(tmp_path))
+        yield
+        for name in ("cached_engine", "cached_helpers"):
+            sys.modules.pop(name, None)
+
+    def compile(self, tmp_path, sources, cache=True):
+        for name, source in sources.items():
+            path = tmp_path / f"{name}.py"
+            path.write_text(source)
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+        # The engine module is reloaded last, so it uses the reloaded helpers.
+        for name in ("cached_helpers", "cached_engine"):
+            if name in sys.modules:
+                importlib.reload(sys.modules[name])
+        module = importlib.import_module("cached_engine")
+        return dump_engine_data(
+            module.engine.compile(
+                cache=CompileCache(tmp_path / "cache") if cache else None
+            )
+        )
+
+    def test_module_constant_invalidates(self, tmp_path):
+        first = self.compile(
+            tmp_path,
+            {
+                "cached_helpers": _CACHED_HELPERS_SOURCE,
+                "cached_engine": _CACHED_ENGINE_SOURCE,
+            },
+        )
+        changed = _CACHED_ENGINE_SOURCE.replace("SCALE = 1", "SCALE = 2")
+        assert self.compile(tmp_path, {"cached_engine": changed}) != first
+
+    def test_helper_in_imported_module_invalidates(self, tmp_path):
+        first = self.compile(
+            tmp_path,
+            {
+                "cached_helpers": _CACHED_HELPERS_SOURCE,
+                "cached_engine": _CACHED_ENGINE_SOURCE,
+            },
+        )
+        changed = _CACHED_HELPERS_SOURCE.replace("OFFSET = 1", "OFFSET = 2")
+        # get_offset is plain python called while tracing, so it is not a
+        # dependency, but it is defined in a module the callback's module imports.
+        second = self.compile(tmp_path, {"cached_helpers": changed})
+        assert second != first
+        assert self.compile(tmp_path, {}, cache=False) == second
+
+
+_WATCHED_ENGINE_SOURCE = """
+from sonolus.backend.compile_report import CompileReport
+from sonolus.backend.optimization.optmization_presets import DEFAULT_OPTIMIZATION_PRESET
+from sonolus.core import *
+from benchmarks.engines import Buckets, Options, engine as base_engine
+from sonolus.engine.engine import Engine
+
+
+class Watched(Script):
+    memory: Num
+    shared_memory: Num
+    data: Num
+
+    @callback_function
+    def update_parallel(self):
+        self.memory @= VALUE
+
+
+engine = Engine([Watched], Buckets, Options, base_engine.ui)
+"""
+
+
+class TestEngineWatcher:
+    def test_rebuilds_on_change(self, tmp_path, monkeypatch):
+        monkeypatch.syspath_prepend(str(tmp_path))
+        source = tmp_path / "watched_engine.py"
+        source.write_text(_WATCHED_ENGINE_SOURCE.replace("VALUE", "1"))
+        watcher = EngineWatcher(
+            "watched_engine:engine", tmp_path / "out", cache=CompileCache(tmp_path)
+        )
+        first = dump_engine_data(watcher.build())
+        assert not watcher.poll()
+
+        source.write_text(_WATCHED_ENGINE_SOURCE.replace("VALUE", "2"))
+        os.utime(source, ns=(0, os.stat(source).st_mtime_ns + 1))
+        assert watcher.poll()
+        assert dump_engine_data(watcher.engine.compile()) != first
+        assert (tmp_path / "out" / "EngineData").exists()
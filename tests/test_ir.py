@@ -0,0 +1,105 @@
+import math
+
+from sonolus.backend.cfg import CFGNode
+from sonolus.backend.ir import (
+    IRConst,
+    IRFunc,
+    IRGet,
+    IRSet,
+    Location,
+    MemoryBlock,
+    TempRef,
+)
+from sonolus.backend.ir_visitor import StructuralKeys
+
+
+def location(offset=None, base=0):
+    if offset is None:
+        offset = IRConst.of(0)
+    return Location(MemoryBlock.ENTITY_MEMORY, offset, base, None)
+
+
+class TestInterning:
+    def test_const(self):
+        assert IRConst.of(1.5) is IRConst.of(1.5)
+        assert IRConst.of(1.5) is not IRConst.of(2.5)
+
+    def test_const_distinguishes_types_and_signed_zero(self):
+        assert IRConst.of(1) is not IRConst.of(1.0)
+        assert IRConst.of(0.0) is not IRConst.of(-0.0)
+        assert math.copysign(1, IRConst.of(-0.0).value) == -1
+
+    def test_nan_is_not_interned(self):
+        assert IRConst.of(math.nan) is not IRConst.of(math.nan)
+
+    def test_get_with_constant_location(self):
+        assert IRGet.of(location(base=3)) is IRGet.of(location(base=3))
+        assert IRGet.of(location(base=3)) is not IRGet.of(location(base=4))
+        temp_location = Location(TempRef("a"), IRConst.of(0), 0, 1)
+        assert IRGet.of(temp_location) is IRGet.of(
+            Location(TempRef("a"), IRConst.of(0), 0, 1)
+        )
+
+    def test_get_with_dynamic_location(self):
+        offset = IRGet.of(location())
+        assert IRGet.of(location(offset)) is not IRGet.of(location(offset))
+
+    def test_pure_func(self):
+        a = IRGet.of(location())
+        assert IRFunc.of("Add", [a, IRConst.of(1)]) is IRFunc.of(
+            "Add", [a, IRConst.of(1)]
+        )
+        assert IRFunc.of("Add", [a, IRConst.of(1)]) is not IRFunc.of(
+            "Add", [IRConst.of(1), a]
+        )
+
+    def test_impure_func(self):
+        assert IRFunc.of("Random", []) is not IRFunc.of("Random", [])
+        assert IRFunc.of("DebugLog", [IRConst.of(1)]) is not IRFunc.of(
+            "DebugLog", [IRConst.of(1)]
+        )
+
+
+class TestStructuralKeys:
+    def test_equal_structures(self):
+        keys = StructuralKeys()
+        # Impure calls and dynamic locations aren't interned, but are keyed alike.
+        first = IRFunc.of("Random", [IRGet.of(location(IRGet.of(location())))])
+        second = IRFunc.of("Random", [IRGet.of(location(IRGet.of(location())))])
+        assert first is not second
+        assert keys.get(first) == keys.get(second)
+        assert keys.get(IRSet(location(), first)) == keys.get(
+            IRSet(location(), second)
+        )
+        assert keys.get(IRSet(location(), first)) != keys.get(
+            IRSet(location(base=1), second)
+        )
+
+    def test_constants(self):
+        keys = StructuralKeys()
+        assert keys.get(IRConst(1)) == keys.get(IRConst(1))
+        assert keys.get(IRConst(1)) != keys.get(IRConst(1.0))
+        assert keys.get(IRConst(0.0)) != keys.get(IRConst(-0.0))
+        nan = IRConst(math.nan)
+        assert keys.get(nan) == keys.get(nan)
+        assert keys.get(nan) != keys.get(IRConst(math.nan))
+
+
+class TestRepresentation:
+    def test_nodes_are_slotted(self):
+        location = Location(TempRef("a"), IRConst.of(0), 0, 1)
+        for node in [
+            IRConst.of(1),
+            IRFunc.of("Add", []),
+            IRGet.of(location),
+            location,
+            CFGNode([], None),
+        ]:
+            assert not hasattr(node, "__dict__")
+
+    def test_cfg_node_storage_is_lazy(self):
+        node = CFGNode([], None)
+        assert node.annotations is None
+        assert node.phi is None
+        node.annotate("key", 1)
+        assert node.annotations == {"key": 1}
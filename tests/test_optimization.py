@@ -0,0 +1,879 @@
+from sonolus.backend.callback import CALLBACK_TYPES
+from sonolus.backend.cfg_traversal import traverse_cfg
+from sonolus.backend.interpreter import CFGInterpreter
+from sonolus.backend.ir import (
+    IRConst,
+    IRFunc,
+    IRGet,
+    IRSet,
+    Location,
+    MemoryBlock,
+    SSARef,
+    TempRef,
+)
+from sonolus.backend.ir_visitor import IRVisitor
+from sonolus.backend.optimization.allocate import (
+    Allocate,
+    InterferenceAllocate,
+    get_temporary_memory_size,
+)
+from sonolus.backend.optimization.analyses import (
+    Dominators,
+    Loops,
+    ReversePostorder,
+    TempRefSizes,
+)
+from sonolus.backend.optimization.arithmetic_simplification import (
+    ArithmeticSimplification,
+)
+from sonolus.backend.optimization.basic_dead_code_elimination import (
+    BasicDeadCodeElimination,
+)
+from sonolus.backend.optimization.basic_dead_store_elimination import (
+    BasicDeadStoreElimination,
+)
+from sonolus.backend.optimization.coalesce_flow import CoalesceFlow
+from sonolus.backend.optimization.copy_propagation import CopyPropagation
+from sonolus.backend.optimization.conditional_constant_propagation import (
+    ConditionalConstantPropagation,
+)
+from sonolus.backend.optimization.dead_store_elimination import DeadStoreElimination
+from sonolus.backend.optimization.global_value_numbering import GlobalValueNumbering
+from sonolus.backend.optimization.if_conversion import IfConversion
+from sonolus.backend.optimization.if_to_switch import IfToSwitch
+from sonolus.backend.optimization.loop_invariant_code_motion import (
+    LoopInvariantCodeMotion,
+)
+from sonolus.backend.optimization.loop_unrolling import LoopUnrolling
+from sonolus.backend.optimization.optimization_pass import (
+    FixedPoint,
+    OptimizationPass,
+    PassInstrumentation,
+    run_optimization_passes,
+    run_passes,
+)
+from sonolus.backend.optimization.optmization_presets import DEFAULT_REWRITE_RULES
+from sonolus.backend.optimization.peephole import (
+    Call,
+    Capture,
+    PeepholeTransformer,
+    Peephole,
+    Rest,
+    RewriteRule,
+)
+from sonolus.backend.optimization.ssa import FromSSA, ToSSA
+from sonolus.backend.optimization.strength_reduction import STRENGTH_REDUCTION_RULES
+from sonolus.backend.optimization.tail_merging import TailMerging
+from sonolus.core import *
+from sonolus.scripting import evaluate_function
+from sonolus.scripting.blocks import get_level_memory, get_level_options
+
+
+@sls_func
+def diamond(a: Num = 1):
+    b = +Num(0)
+    if a > 0:
+        b @= a + 1
+    else:
+        b @= a - 1
+    return b
+
+
+@sls_func
+def nested_loops(n: Num = 3):
+    total = +Num(0)
+    i = +Num(0)
+    while i < n:
+        j = +Num(0)
+        while j < n:
+            total += i * j
+            j += 1
+        i += 1
+    return total
+
+
+class TestAnalyses:
+    def test_analysis_is_cached(self):
+        cfg = evaluate_function(diamond)
+        assert TempRefSizes.get(cfg) is TempRefSizes.get(cfg)
+
+    def test_analysis_invalidated_unless_preserved(self):
+        cfg = evaluate_function(diamond)
+        order = ReversePostorder.get(cfg)
+        sizes = TempRefSizes.get(cfg)
+        run_optimization_passes(cfg, [ArithmeticSimplification()])
+        assert ReversePostorder.get(cfg) is order
+        assert TempRefSizes.get(cfg) is not sizes
+
+    def test_dominators(self):
+        cfg = evaluate_function(diamond)
+        dominators = Dominators.get(cfg)
+        nodes = ReversePostorder.get(cfg)
+        entry = cfg.entry_node
+        assert nodes[0] is entry
+        for node in nodes:
+            assert dominators.dominates(entry, node)
+        branches = [edge.to_node for edge in cfg.edges_by_from[entry]]
+        assert len(branches) == 2
+        for branch in branches:
+            assert dominators.idom[branch] is entry
+            assert dominators.frontiers[branch] == {cfg.exit_node}
+
+    def test_loops(self):
+        cfg = evaluate_function(nested_loops)
+        dominators = Dominators.get(cfg)
+        inner, outer = Loops.get(cfg)
+        assert inner.nodes < outer.nodes
+        assert outer.header not in inner.nodes
+        for loop in (inner, outer):
+            assert all(dominators.dominates(loop.header, n) for n in loop.nodes)
+        assert not Loops.get(evaluate_function(diamond))
+
+
+class _CountingPass(OptimizationPass):
+    def __init__(self, changed=True):
+        self.changed = changed
+        self.count = 0
+
+    def run(self, cfg):
+        self.count += 1
+        return self.changed
+
+
+class _RecordingInstrumentation(PassInstrumentation):
+    def __init__(self):
+        self.passes = []
+
+    def before_pass(self, opt_pass, cfg):
+        pass
+
+    def after_pass(self, opt_pass, cfg, changed):
+        self.passes.append((type(opt_pass), changed))
+
+
+class TestFixedPoint:
+    def get_passes(self):
+        return [
+            ConditionalConstantPropagation(),
+            CoalesceFlow(),
+            ArithmeticSimplification(),
+            BasicDeadCodeElimination(),
+            BasicDeadStoreElimination(),
+            CoalesceFlow(),
+        ]
+
+    def test_converges(self):
+        cfg = evaluate_function(diamond)
+        assert run_passes(cfg, [FixedPoint(self.get_passes(), max_iterations=100)])
+        assert not run_passes(cfg, self.get_passes())
+
+    def test_unchanged_pass_preserves_analyses(self):
+        cfg = evaluate_function(diamond)
+        run_passes(cfg, [FixedPoint(self.get_passes(), max_iterations=100)])
+        sizes = TempRefSizes.get(cfg)
+        assert not run_passes(cfg, [ConditionalConstantPropagation()])
+        assert TempRefSizes.get(cfg) is sizes
+
+    def test_stops_when_unchanged(self):
+        opt_pass = _CountingPass(changed=False)
+        cfg = evaluate_function(diamond)
+        assert not run_passes(cfg, [FixedPoint([opt_pass])])
+        assert opt_pass.count == 1
+
+    def test_iteration_limit(self):
+        opt_pass = _CountingPass()
+        cfg = evaluate_function(diamond)
+        assert run_passes(cfg, [FixedPoint([opt_pass], max_iterations=3)])
+        assert opt_pass.count == 3
+
+    def test_inner_passes_instrumented(self):
+        instrumentation = _RecordingInstrumentation()
+        cfg = evaluate_function(diamond)
+        run_passes(
+            cfg,
+            [FixedPoint([_CountingPass(), _CountingPass(False)], max_iterations=2)],
+            instrumentation,
+        )
+        assert (
+            instrumentation.passes
+            == [(_CountingPass, True), (_CountingPass, False)] * 2
+        )
+
+
+class _SSARefCollector(IRVisitor):
+    def __init__(self):
+        self.refs = set()
+
+    def visit_Location(self, location):
+        super().visit_Location(location)
+        if isinstance(location.ref, SSARef):
+            self.refs.add(location.ref)
+
+
+class TestSSA:
+    def test_phi_placement(self):
+        cfg = evaluate_function(diamond)
+        expected = CFGInterpreter().run(cfg)
+        assert run_passes(cfg, [ToSSA()])
+        phis = [(node, phi) for node in traverse_cfg(cfg) for phi in node.phi or ()]
+        # Only the result is live where the branches join.
+        assert len(phis) == 1
+        node, phi = phis[0]
+        assert node is cfg.exit_node
+        assert len(phi.values) == 2
+        assert CFGInterpreter().run(cfg) == expected
+        # Every scalar temp ref was converted.
+        assert not run_passes(cfg, [ToSSA()])
+
+    def test_round_trip(self):
+        for fn in (diamond, nested_loops):
+            cfg = evaluate_function(fn)
+            expected = CFGInterpreter().run(cfg)
+            run_passes(cfg, [ToSSA(), FromSSA()])
+            collector = _SSARefCollector()
+            collector.visit(cfg)
+            assert not collector.refs
+            assert not any(node.phi for node in traverse_cfg(cfg))
+            assert CFGInterpreter().run(cfg) == expected
+            run_passes(cfg, [Allocate()])
+            assert CFGInterpreter().run(cfg) == expected
+
+    def test_parallel_copies(self):
+        a, b, c = SSARef("a", 1), SSARef("b", 1), SSARef("c", 1)
+        copies = FromSSA().sequentialize([(a, b), (b, a), (c, a)])
+        interpreter = CFGInterpreter(blocks={a: [1], b: [2], c: [3]})
+        for copy in copies:
+            interpreter.run_node(copy)
+        assert [interpreter.blocks[ref][0] for ref in (a, b, c)] == [2, 1, 1]
+
+
+class _Pair(Struct):
+    a: Num
+    b: Num
+
+
+@sls_func
+def repeated_options():
+    options = get_level_options(_Pair)
+    result = options.a * options.b
+    if options.a > 0:
+        result @= result + options.a * options.b
+    else:
+        result @= result - options.a * options.b
+    return result
+
+
+@sls_func
+def repeated_memory():
+    memory = get_level_memory(_Pair)
+    memory.a @= memory.b * 2 + 1
+    memory.b @= memory.b * 2 + 1
+    return memory.b * 2 + 1
+
+
+class _FuncCounter(IRVisitor):
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+
+    def visit_IRFunc(self, node: IRFunc):
+        super().visit_IRFunc(node)
+        if node.name == self.name:
+            self.count += 1
+
+
+def _count_funcs(cfg, name):
+    counter = _FuncCounter(name)
+    counter.visit(cfg)
+    return counter.count
+
+
+def _run_with_blocks(cfg):
+    blocks = {MemoryBlock.LEVEL_OPTION: [3, 4], MemoryBlock.LEVEL_MEMORY: [1, 2]}
+    interpreter = CFGInterpreter(blocks=blocks)
+    return interpreter.run(cfg), blocks[MemoryBlock.LEVEL_MEMORY]
+
+
+class TestGlobalValueNumbering:
+    def get_passes(self):
+        return [
+            ConditionalConstantPropagation(),
+            CoalesceFlow(),
+            ArithmeticSimplification(),
+            GlobalValueNumbering(),
+        ]
+
+    def test_dominated_values_reused(self):
+        cfg = evaluate_function(repeated_options)
+        expected = _run_with_blocks(cfg)
+        assert _count_funcs(cfg, "Multiply") == 3
+        assert run_passes(cfg, self.get_passes())
+        assert _count_funcs(cfg, "Multiply") == 1
+        assert _run_with_blocks(cfg) == expected
+
+    def test_written_values_recomputed(self):
+        cfg = evaluate_function(repeated_memory)
+        expected = _run_with_blocks(cfg)
+        run_passes(cfg, self.get_passes())
+        assert _count_funcs(cfg, "Multiply") == 3
+        assert _run_with_blocks(cfg) == expected
+
+    def test_computed_ref_writes_limited_by_callback(self):
+        def run(callback):
+            cfg = evaluate_function(repeated_options)
+            cfg.callback = callback
+            # A write to memory at an offset read from entity memory.
+            pointer = IRGet.of(Location(MemoryBlock.ENTITY_MEMORY, IRConst.of(0), 0, 1))
+            write = IRSet(Location(pointer, IRConst.of(0), 0, 1), IRConst.of(0))
+            for node in traverse_cfg(cfg):
+                node.body = [write, *node.body]
+            run_passes(cfg, self.get_passes())
+            return _count_funcs(cfg, "Multiply")
+
+        assert run(None) == 3
+        # Level options can't be written while updating in parallel.
+        assert run(CALLBACK_TYPES["update_parallel"]) == 1
+
+    def test_converges(self):
+        cfg = evaluate_function(repeated_options)
+        run_passes(cfg, self.get_passes())
+        assert not run_passes(cfg, [GlobalValueNumbering()])
+
+
+@sls_func
+def reassigned_product():
+    options = get_level_options(_Pair)
+    memory = get_level_memory(_Pair)
+    x = +Num(0)
+    x @= options.a * options.b
+    memory.a @= x
+    x @= options.a
+    if options.b > 0:
+        memory.b @= options.a * options.b + x
+    return memory.b
+
+
+class _TempRefCollector(IRVisitor):
+    def __init__(self):
+        self.refs = set()
+
+    def visit_Location(self, location):
+        super().visit_Location(location)
+        if isinstance(location.ref, TempRef):
+            self.refs.add(location.ref)
+
+
+class TestGlobalValueNumberingInSSA:
+    def test_values_read_from_ssa_refs(self):
+        cfg = evaluate_function(reassigned_product)
+        expected = _run_with_blocks(cfg)
+        run_passes(cfg, [CoalesceFlow(), ToSSA(), GlobalValueNumbering()])
+        assert _count_funcs(cfg, "Multiply") == 1
+        run_passes(cfg, [FromSSA()])
+        collector = _TempRefCollector()
+        collector.visit(cfg)
+        # The product is read from the ssa ref it was first assigned to, even
+        # though the temp ref it came from is reassigned before it is reused.
+        assert collector.refs
+        assert not any(ref.name.startswith("gvn$") for ref in collector.refs)
+        assert _run_with_blocks(cfg) == expected
+
+
+class TestInterferenceAllocate:
+    def test_disjoint_temps_share_memory(self):
+        cfg = evaluate_function(diamond)
+        expected = CFGInterpreter().run(cfg)
+        separate = run_optimization_passes(evaluate_function(diamond), [Allocate()])
+        run_passes(cfg, [InterferenceAllocate()])
+        assert get_temporary_memory_size(cfg) < get_temporary_memory_size(separate)
+        assert CFGInterpreter().run(cfg) == expected
+
+    def test_live_temps_not_shared(self):
+        cfg = evaluate_function(repeated_options)
+        expected = _run_with_blocks(cfg)
+        run_passes(cfg, [InterferenceAllocate()])
+        assert get_temporary_memory_size(cfg) > 1
+        assert _run_with_blocks(cfg) == expected
+
+
+@sls_func
+def copy_chain():
+    options = get_level_options(_Pair)
+    a = options.a + 1
+    b = +a
+    c = +b
+    return b + c
+
+
+@sls_func
+def overwritten_copy_source():
+    options = get_level_options(_Pair)
+    a = options.a + 1
+    b = +a
+    a @= options.b
+    return a + b
+
+
+def _count_copies(cfg):
+    return sum(
+        isinstance(statement, IRSet)
+        and isinstance(statement.value, IRGet)
+        and isinstance(statement.value.location.ref, TempRef)
+        for node in traverse_cfg(cfg)
+        for statement in node.body
+    )
+
+
+class TestCopyPropagation:
+    def get_passes(self):
+        return [CopyPropagation(), BasicDeadStoreElimination()]
+
+    def test_copies_removed(self):
+        cfg = evaluate_function(copy_chain)
+        expected = _run_with_blocks(cfg)
+        assert _count_copies(cfg) == 2
+        assert run_passes(cfg, self.get_passes())
+        assert _count_copies(cfg) == 0
+        assert _run_with_blocks(cfg) == expected
+
+    def test_overwritten_source_not_propagated(self):
+        cfg = evaluate_function(overwritten_copy_source)
+        expected = _run_with_blocks(cfg)
+        run_passes(cfg, self.get_passes())
+        assert _count_copies(cfg) == 1
+        assert _run_with_blocks(cfg) == expected
+
+
+@sls_func
+def invariant_in_loop():
+    options = get_level_options(_Pair)
+    memory = get_level_memory(_Pair)
+    i = +Num(0)
+    while i < 3:
+        memory.a @= memory.a + options.a * options.b
+        i += 1
+    return memory.a
+
+
+class TestLoopInvariantCodeMotion:
+    def test_invariant_hoisted(self):
+        cfg = evaluate_function(invariant_in_loop)
+        expected = _run_with_blocks(cfg)
+        assert run_passes(cfg, [LoopInvariantCodeMotion()])
+        (loop,) = Loops.get(cfg)
+        outside = [node for node in traverse_cfg(cfg) if node not in loop.nodes]
+        assert sum(_count_funcs(node, "Multiply") for node in loop.nodes) == 0
+        assert sum(_count_funcs(node, "Multiply") for node in outside) == 1
+        assert _run_with_blocks(cfg) == expected
+
+    def test_written_memory_not_hoisted(self):
+        cfg = evaluate_function(invariant_in_loop)
+        run_passes(cfg, [LoopInvariantCodeMotion()])
+        (loop,) = Loops.get(cfg)
+        assert sum(_count_funcs(node, "Add") for node in loop.nodes) == 2
+
+
+@sls_func
+def options_bounded_loop():
+    options = get_level_options(_Pair)
+    memory = get_level_memory(_Pair)
+    i = +Num(0)
+    while i < options.a:
+        memory.a @= memory.a + i
+        i += 1
+    return memory.a
+
+
+class TestLoopUnrolling:
+    def test_constant_loop_unrolled(self):
+        cfg = evaluate_function(invariant_in_loop)
+        expected = _run_with_blocks(cfg)
+        assert run_passes(cfg, [LoopUnrolling()])
+        assert not Loops.get(cfg)
+        assert sum(_count_funcs(node, "Multiply") for node in traverse_cfg(cfg)) == 3
+        assert _run_with_blocks(cfg) == expected
+
+    def test_unknown_trip_count_not_unrolled(self):
+        cfg = evaluate_function(options_bounded_loop)
+        assert not run_passes(cfg, [LoopUnrolling()])
+        assert len(Loops.get(cfg)) == 1
+
+    def test_budget(self):
+        cfg = evaluate_function(invariant_in_loop)
+        assert not run_passes(cfg, [LoopUnrolling(max_iterations=2)])
+        assert not run_passes(cfg, [LoopUnrolling(max_size=10)])
+        assert len(Loops.get(cfg)) == 1
+
+
+@sls_func
+def if_elif_chain():
+    options = get_level_options(_Pair)
+    memory = get_level_memory(_Pair)
+    if options.a == 0:
+        memory.b @= 10
+    elif options.a == 1:
+        memory.b @= 20
+    elif 2 == options.a:
+        memory.b @= 30
+    else:
+        memory.b @= 40
+    return memory.b
+
+
+class TestIfToSwitch:
+    def test_chain_merged(self):
+        cfg = evaluate_function(if_elif_chain)
+        expected = _run_with_blocks(cfg)
+        assert run_passes(cfg, [IfToSwitch()])
+        (switch,) = [
+            node for node in traverse_cfg(cfg) if len(cfg.edges_by_from[node]) > 2
+        ]
+        assert {edge.condition for edge in cfg.edges_by_from[switch]} == {
+            0,
+            1,
+            2,
+            None,
+        }
+        # Only the comparison in the first branch is left, as a dead store.
+        assert _count_funcs(cfg, "Equal") == 1
+        assert _run_with_blocks(cfg) == expected
+
+    def test_comparison_stored_at_other_offset_not_merged(self):
+        cfg = evaluate_function(if_elif_chain)
+        (second,) = [
+            edge.to_node
+            for edge in cfg.edges_by_from[cfg.entry_node]
+            if edge.condition == 0
+        ]
+        for node in (cfg.entry_node, second):
+            (comparison,) = node.body
+            temp = comparison.location.ref
+            node.body = [
+                IRSet(Location(temp, IRConst.of(0), 0, 1), comparison.value)
+            ]
+            # Tests a different element of the temp ref than the one stored to.
+            node.test = IRGet.of(Location(temp, IRConst.of(1), 0, 1))
+        assert not run_passes(cfg, [IfToSwitch()])
+
+
+@sls_func
+def shared_tails():
+    options = get_level_options(_Pair)
+    memory = get_level_memory(_Pair)
+    if options.a > 0:
+        memory.a @= 1
+        memory.b @= options.b
+    elif options.a < 0:
+        memory.a @= 2
+        memory.b @= options.b
+    else:
+        memory.a @= 2
+        memory.b @= options.b
+    return memory.b
+
+
+def _count_statements(cfg):
+    return sum(len(node.body) for node in traverse_cfg(cfg))
+
+
+class TestTailMerging:
+    def test_merged(self):
+        cfg = evaluate_function(shared_tails)
+        expected = _run_with_blocks(cfg)
+        assert _count_statements(cfg) == 8
+        assert run_passes(cfg, [CoalesceFlow(), TailMerging()])
+        # The last two branches are merged, then the stores to b are shared.
+        assert _count_statements(cfg) == 5
+        assert _run_with_blocks(cfg) == expected
+
+    def test_unchanged(self):
+        cfg = evaluate_function(diamond)
+        run_passes(cfg, [CoalesceFlow()])
+        assert not run_passes(cfg, [TailMerging()])
+
+
+@sls_func
+def overwritten_stores():
+    memory = get_level_memory(_Pair)
+    x = +Num(0)
+    i = +Num(0)
+    while i < 3:
+        x @= memory.a * 2
+        x @= memory.b + i
+        memory.a @= x
+        i += 1
+    return x
+
+
+class TestDeadStoreElimination:
+    def test_overwritten_stores_removed(self):
+        cfg = evaluate_function(overwritten_stores)
+        expected = _run_with_blocks(cfg)
+        assert not run_passes(cfg, [BasicDeadStoreElimination()])
+        assert run_passes(cfg, [DeadStoreElimination()])
+        assert _count_funcs(cfg, "Multiply") == 0
+        assert _run_with_blocks(cfg) == expected
+
+
+def _option(index):
+    return IRGet.of(Location(MemoryBlock.LEVEL_OPTION, IRConst.of(0), index, 1))
+
+
+def _reduce(node):
+    transformer = PeepholeTransformer(STRENGTH_REDUCTION_RULES)
+    result = transformer.visit(node)
+    assert transformer.changed == (result is not node)
+    return result
+
+
+def _evaluate(node, value):
+    interpreter = CFGInterpreter(blocks={MemoryBlock.LEVEL_OPTION: [value, 3]})
+    return interpreter.run_node(node)
+
+
+class TestStrengthReduction:
+    def test_rewrites(self):
+        x = _option(0)
+        y = _option(1)
+        cases = [
+            (IRFunc.of("Power", [x, IRConst.of(2)]), IRFunc.of("Multiply", [x, x])),
+            (IRFunc.of("Mod", [x, IRConst.of(1)]), IRFunc.of("Frac", [x])),
+            (
+                IRFunc.of("Divide", [x, IRConst.of(4)]),
+                IRFunc.of("Multiply", [IRConst.of(0.25), x]),
+            ),
+            (
+                IRFunc.of("Add", [x, IRFunc.of("Multiply", [IRConst.of(-1), y])]),
+                IRFunc.of("Subtract", [x, y]),
+            ),
+            (
+                IRFunc.of(
+                    "Min",
+                    [IRFunc.of("Max", [x, IRConst.of(0)]), IRConst.of(1)],
+                ),
+                IRFunc.of("Clamp", [x, IRConst.of(0), IRConst.of(1)]),
+            ),
+            (
+                IRFunc.of(
+                    "Max",
+                    [IRConst.of(1), IRFunc.of("Max", [x, IRConst.of(2)])],
+                ),
+                IRFunc.of("Max", [x, IRConst.of(2)]),
+            ),
+            (
+                IRFunc.of("Not", [IRFunc.of("Not", [IRFunc.of("Less", [x, y])])]),
+                IRFunc.of("Less", [x, y]),
+            ),
+            (IRFunc.of("Lerp", [IRConst.of(0), IRConst.of(1), x]), x),
+        ]
+        for node, expected in cases:
+            # Calls of builtins without constant folding aren't interned.
+            assert repr(_reduce(node)) == repr(expected)
+            for value in (-2.5, 0, 0.75, 3):
+                assert _evaluate(node, value) == _evaluate(expected, value)
+
+    def test_inexact_rewrites_skipped(self):
+        x = _option(0)
+        nodes = [
+            IRFunc.of("Divide", [x, IRConst.of(3)]),
+            IRFunc.of("Power", [IRFunc("Random", [x, x]), IRConst.of(2)]),
+            IRFunc.of("Not", [IRFunc.of("Not", [x])]),
+            IRFunc.of("Min", [IRFunc.of("Max", [x, IRConst.of(1)]), IRConst.of(0)]),
+        ]
+        for node in nodes:
+            assert _reduce(node) is node
+
+    def test_effectful_args_kept(self):
+        x = _option(0)
+        log = IRFunc("DebugLog", [IRConst.of(3)])
+        random = IRFunc("Random", [x, x])
+        half = IRConst.of(0.5)
+        nodes = [
+            IRFunc.of("Power", [log, IRConst.of(0)]),
+            IRFunc.of("If", [log, IRConst.of(1), IRConst.of(1)]),
+            IRFunc.of("Min", [random, random]),
+            IRFunc.of(
+                "Clamp",
+                [IRFunc.of("Clamp", [x, random, IRConst.of(1)]), random, IRConst.of(1)],
+            ),
+            IRFunc.of("If", [IRFunc.of("Less", [random, half]), random, half]),
+            IRFunc.of("If", [IRFunc.of("Less", [half, random]), random, half]),
+            IRFunc.of("Multiply", [IRConst.of(-1), IRFunc.of("Subtract", [log, x])]),
+        ]
+        for node in nodes:
+            assert _reduce(node) is node
+
+
+@sls_func
+def conditional_assignments():
+    options = get_level_options(_Pair)
+    memory = get_level_memory(_Pair)
+    x = +Num(0)
+    if options.a > options.b:
+        x @= options.a
+    else:
+        x @= options.b
+    y = +Num(1)
+    if options.a < 0:
+        y @= 2
+    memory.a @= x + y
+    return memory.a
+
+
+@sls_func
+def paired_assignments():
+    options = get_level_options(_Pair)
+    memory = get_level_memory(_Pair)
+    x = +Num(0)
+    y = +Num(0)
+    if options.a + options.b > 1:
+        x @= 1
+        y @= options.a
+    else:
+        x @= 2
+        y @= options.b
+    memory.a @= x
+    memory.b @= y
+    return memory.a
+
+
+class TestIfConversion:
+    def get_passes(self):
+        return [CoalesceFlow(), CopyPropagation(), IfConversion(), CoalesceFlow()]
+
+    def test_converted(self):
+        cfg = evaluate_function(conditional_assignments)
+        expected = _run_with_blocks(cfg)
+        assert run_passes(cfg, self.get_passes())
+        assert len([*traverse_cfg(cfg)]) == 1
+        assert _count_funcs(cfg, "Max") == 1
+        assert _count_funcs(cfg, "If") == 1
+        assert _run_with_blocks(cfg) == expected
+
+    def test_condition_evaluated_once(self):
+        cfg = evaluate_function(paired_assignments)
+        expected = _run_with_blocks(cfg)
+        assert run_passes(cfg, self.get_passes())
+        assert len([*traverse_cfg(cfg)]) == 1
+        assert _count_funcs(cfg, "If") == 2
+        assert _count_funcs(cfg, "Greater") == 1
+        assert _run_with_blocks(cfg) == expected
+
+    def test_budget(self):
+        cfg = evaluate_function(conditional_assignments)
+        run_passes(cfg, [CoalesceFlow(), CopyPropagation()])
+        assert not run_passes(cfg, [IfConversion(max_cost=1)])
+
+
+def _peephole(node, rules=DEFAULT_REWRITE_RULES):
+    transformer = PeepholeTransformer(rules)
+    return transformer.visit(node)
+
+
+class TestPeephole:
+    def test_default_rules(self):
+        x = _option(0)
+        cases = [
+            (IRFunc.of("Floor", [IRFunc.of("Round", [x])]), IRFunc.of("Round", [x])),
+            (IRFunc.of("Abs", [IRFunc.of("Frac", [x])]), IRFunc.of("Frac", [x])),
+            (
+                IRFunc.of("Abs", [IRFunc.of("Multiply", [IRConst.of(-1), x])]),
+                IRFunc.of("Abs", [x]),
+            ),
+            (
+                IRFunc.of(
+                    "Unlerp", [IRConst.of(0), IRConst.of(1), IRFunc.of("Floor", [x])]
+                ),
+                IRFunc.of("Floor", [x]),
+            ),
+        ]
+        for node, expected in cases:
+            assert _peephole(node) is expected
+            for value in (-2.5, 0, 0.75, 3):
+                assert _evaluate(node, value) == _evaluate(expected, value)
+
+    def test_sign_of_zero_kept(self):
+        # Sign(0) is 0 at runtime, so Abs(Sign(x)) is not always 1.
+        node = IRFunc.of("Abs", [IRFunc.of("Sign", [_option(0)])])
+        assert _peephole(node) is node
+
+    def test_rewrites_applied_bottom_up_until_fixed_point(self):
+        x = _option(0)
+        node = IRFunc.of(
+            "Abs",
+            [IRFunc.of("Abs", [IRFunc.of("Multiply", [IRConst.of(-1), x])])],
+        )
+        assert _peephole(node) is IRFunc.of("Abs", [x])
+
+    def test_custom_rules(self):
+        x = _option(0)
+        y = _option(1)
+        a = Capture("a")
+        b = Capture("b")
+        rules = [
+            RewriteRule(
+                Call("Add", Call("Multiply", a, b), Call("Multiply", a, Capture("c"))),
+                lambda a, b, c: IRFunc.of("Multiply", [a, IRFunc.of("Add", [b, c])]),
+                lambda a, b, c: b is not c,
+            ),
+        ]
+        factored = IRFunc.of(
+            "Add",
+            [IRFunc.of("Multiply", [x, y]), IRFunc.of("Multiply", [x, IRConst.of(2)])],
+        )
+        assert _peephole(factored, rules) is IRFunc.of(
+            "Multiply", [x, IRFunc.of("Add", [y, IRConst.of(2)])]
+        )
+        # Captures with the same name must match the same value.
+        unfactored = IRFunc.of(
+            "Add",
+            [IRFunc.of("Multiply", [x, y]), IRFunc.of("Multiply", [y, x])],
+        )
+        assert _peephole(unfactored, rules) is unfactored
+        # The guard rejects sums of equal products.
+        doubled = IRFunc.of(
+            "Add",
+            [IRFunc.of("Multiply", [x, y]), IRFunc.of("Multiply", [x, y])],
+        )
+        assert _peephole(doubled, rules) is doubled
+
+    def test_rest_captures_remaining_args(self):
+        x = _option(0)
+        y = _option(1)
+        rules = [
+            RewriteRule(
+                Call("Max", Capture("a"), Rest("args")),
+                lambda a, args: IRFunc.of("Max", [*args, a]),
+                lambda a, args: a.constant() is not None and bool(args),
+            ),
+        ]
+        node = IRFunc.of("Max", [IRConst.of(1), x, y])
+        assert _peephole(node, rules) is IRFunc.of("Max", [x, y, IRConst.of(1)])
+        assert _peephole(IRFunc.of("Max", [IRConst.of(1)]), rules) is IRFunc.of(
+            "Max", [IRConst.of(1)]
+        )
+
+    def test_rules_indexed_by_arity(self):
+        x = _option(0)
+        y = _option(1)
+        rules = [
+            RewriteRule(Call("Max", Capture("a"), Capture("b")), lambda a, b: a),
+            RewriteRule(Call("Max", Rest("args")), lambda args: args[-1]),
+        ]
+        transformer = PeepholeTransformer(rules)
+        assert transformer.visit(IRFunc.of("Max", [x, y])) is x
+        node = IRFunc.of("Max", [x, y, IRConst.of(2)])
+        assert transformer.visit(node) is IRConst.of(2)
+        assert [*transformer.table] == [("Max", 2), ("Max", 3)]
+        assert transformer.table[("Max", 3)] == rules[1:]
+
+    def test_pass(self):
+        cfg = evaluate_function(shared_tails)
+        assert not run_passes(cfg, [Peephole(DEFAULT_REWRITE_RULES)])
+        x = _option(0)
+        location = Location(MemoryBlock.LEVEL_MEMORY, IRConst.of(0), 0, 1)
+        cfg.entry_node.body.append(
+            IRSet(location, IRFunc.of("Abs", [IRFunc.of("Abs", [x])]))
+        )
+        assert run_passes(cfg, [Peephole(DEFAULT_REWRITE_RULES)])
+        assert cfg.entry_node.body[-1].value is IRFunc.of("Abs", [x])